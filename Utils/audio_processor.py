@@ -5,11 +5,11 @@ from typing import Dict, List, Optional
 
 from funasr import AutoModel
 from funasr.utils.postprocess_utils import rich_transcription_postprocess
-from langchain_community.chat_models import ChatLiteLLM
 from langchain_core.messages import HumanMessage, SystemMessage
 from Utils.utils import selenium_api_search, web_search_deduplicate_and_format_sources
 from langchain_core.tools import tool
 from Tools.tools import queries_formatter
+from Utils.llm_policy import ainvoke_with_policy
 
 
 # %%
@@ -41,12 +41,12 @@ async def get_background_knowledge(model_name: str, key_word: str):
         A keyword in English should generate queries in English.
     </Task>
     """
-    tool_model = ChatLiteLLM(model=model_name, temperature=0).bind_tools(
-        [queries_formatter], tool_choice="required"
-    )
-    output = await tool_model.ainvoke(
+    output = await ainvoke_with_policy(
+        model_name,
         [SystemMessage(content=system_instruction.format(key_word=key_word))]
-        + [HumanMessage(content="Please help me to find relevant information.")]
+        + [HumanMessage(content="Please help me to find relevant information.")],
+        tool=[queries_formatter],
+        tool_choice="required",
     )
     web_results = selenium_api_search(output.tool_calls[0]["args"]["queries"], True)
     source_str = web_search_deduplicate_and_format_sources(web_results, 5000, True)
@@ -67,16 +67,16 @@ async def get_background_knowledge(model_name: str, key_word: str):
     If it is in English, please use English for the writing.
     </Limit>
     """
-    tool_model = ChatLiteLLM(model=model_name, temperature=0).bind_tools(
-        [background_knowledge_formatter], tool_choice="required"
-    )
-    output = await tool_model.ainvoke(
+    output = await ainvoke_with_policy(
+        model_name,
         [SystemMessage(content=system_instruction)]
         + [
             HumanMessage(
                 content="Please help me to summarize knowledge into column and hashtags."
             )
-        ]
+        ],
+        tool=[background_knowledge_formatter],
+        tool_choice="required",
     )
     return output.tool_calls[0]["args"]
 
@@ -114,8 +114,8 @@ async def model_refine_transcription(
     </Guideline>
     """
     model_name = "deepseek/deepseek-chat"
-    tool_model = ChatLiteLLM(model=model_name, temperature=0)
-    output = await tool_model.ainvoke(
+    output = await ainvoke_with_policy(
+        model_name,
         [
             SystemMessage(
                 content=system_instruction.format(
@@ -127,7 +127,7 @@ async def model_refine_transcription(
             HumanMessage(
                 content="Please help me to adjust this paragraph into suitable content and format."
             )
-        ]
+        ],
     )
     return output.content
 
@@ -0,0 +1,338 @@
+import json
+import os
+import threading
+from array import array
+from typing import Any, Callable, List
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import Field
+from scipy import sparse
+
+
+def default_preprocessing_func(text: str) -> List[str]:
+    return text.split()
+
+
+class SparseBM25Index(object):
+    """Okapi BM25 over a CSR term-document matrix.
+
+    Scoring follows `rank_bm25.BM25Okapi` (used by langchain's BM25Retriever):
+    idf = log((N - df + 0.5) / (df + 0.5)), negative idf replaced by
+    `epsilon * mean(idf)`. Term weights are precomputed once per index
+    version, so a batch of queries is scored with one sparse matrix product.
+    Documents can be appended or removed without re-tokenising the corpus.
+
+    Mutation and scoring hold `lock`: scoring reads the posting arrays through
+    buffer views, and an `array` cannot grow while a view of it exists.
+    """
+
+    def __init__(
+        self,
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+        preprocess_func: Callable[[str], List[str]] = default_preprocessing_func,
+    ):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.preprocess_func = preprocess_func
+        self.vocab = {}
+        self.ids = []
+        self.rows = {}
+        self.indptr = array("q", [0])
+        self.indices = array("i")
+        self.counts = array("f")
+        self.doc_len = array("f")
+        self.alive = array("b")
+        self.df = np.zeros(0, dtype=np.int64)
+        self._weights = None
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.rows
+
+    @property
+    def tokenizer_name(self):
+        return getattr(self.preprocess_func, "name", "whitespace")
+
+    def add(self, ids: List[str], texts: List[str]):
+        if hasattr(self.preprocess_func, "tokenize_many"):
+            return self.add_tokens(ids, self.preprocess_func.tokenize_many(texts))
+        return self.add_tokens(ids, [self.preprocess_func(text) for text in texts])
+
+    def add_tokens(self, ids: List[str], token_lists: List[List[str]]):
+        with self.lock:
+            self._add_tokens(ids, token_lists)
+
+    def _add_tokens(self, ids, token_lists):
+        self.remove([doc_id for doc_id in ids if doc_id in self.rows])
+        for doc_id, tokens in zip(ids, token_lists):
+            term_counts = {}
+            for token in tokens:
+                col = self.vocab.get(token)
+                if col is None:
+                    col = self.vocab[token] = len(self.vocab)
+                term_counts[col] = term_counts.get(col, 0) + 1
+            if len(self.vocab) > len(self.df):
+                self.df = np.concatenate(
+                    [self.df, np.zeros(len(self.vocab) - len(self.df), np.int64)]
+                )
+            cols = sorted(term_counts)
+            self.indices.extend(cols)
+            self.counts.extend(term_counts[col] for col in cols)
+            self.indptr.append(len(self.indices))
+            self.doc_len.append(len(tokens))
+            self.alive.append(1)
+            self.df[cols] += 1
+            self.rows[doc_id] = len(self.ids)
+            self.ids.append(doc_id)
+        self._weights = None
+
+    def remove(self, ids: List[str]):
+        with self.lock:
+            for doc_id in ids:
+                row = self.rows.pop(doc_id, None)
+                if row is None:
+                    continue
+                self.alive[row] = 0
+                cols = self.indices[self.indptr[row] : self.indptr[row + 1]]
+                self.df[np.asarray(cols, dtype=np.int64)] -= 1
+            if ids:
+                self._weights = None
+
+    def compact(self):
+        """Drop removed rows so their postings stop taking memory."""
+        with self.lock:
+            self._compact()
+
+    def _compact(self):
+        if len(self.rows) == len(self.ids):
+            return
+        matrix = self.count_matrix()
+        keep = np.flatnonzero(np.frombuffer(self.alive, dtype=np.int8))
+        matrix = matrix[keep]
+        self.ids = [self.ids[row] for row in keep]
+        self.rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.indptr = array("q", matrix.indptr.astype(np.int64))
+        self.indices = array("i", matrix.indices.astype(np.int32))
+        self.counts = array("f", matrix.data.astype(np.float32))
+        self.doc_len = array("f", np.asarray(self.doc_len, dtype=np.float32)[keep])
+        self.alive = array("b", [1] * len(self.ids))
+        self._weights = None
+
+    def count_matrix(self):
+        return sparse.csr_matrix(
+            (
+                np.frombuffer(self.counts, dtype=np.float32),
+                np.frombuffer(self.indices, dtype=np.int32),
+                np.frombuffer(self.indptr, dtype=np.int64),
+            ),
+            shape=(len(self.ids), len(self.vocab)),
+        )
+
+    def weights(self):
+        """CSR matrix of per (document, term) BM25 contributions."""
+        with self.lock:
+            if self._weights is None:
+                self._weights = self._compute_weights()
+            return self._weights
+
+    def _compute_weights(self):
+        # astype copies, so the result holds no views of the posting arrays.
+        matrix = self.count_matrix().astype(np.float32)
+        alive = np.frombuffer(self.alive, dtype=np.int8).astype(bool)
+        doc_len = np.frombuffer(self.doc_len, dtype=np.float32)
+        num_docs = int(alive.sum())
+        avgdl = doc_len[alive].mean() if num_docs else 1.0
+        avgdl = avgdl if avgdl > 0 else 1.0
+
+        idf = np.log(num_docs - self.df + 0.5) - np.log(self.df + 0.5)
+        present = self.df > 0
+        average_idf = idf[present].mean() if present.any() else 0.0
+        idf[present & (idf < 0)] = self.epsilon * average_idf
+        idf[~present] = 0.0
+
+        norms = self.k1 * (1 - self.b + self.b * doc_len / avgdl)
+        row_norms = np.repeat(norms, np.diff(matrix.indptr))
+        tf = matrix.data
+        matrix.data = (
+            idf[matrix.indices] * tf * (self.k1 + 1) / (tf + row_norms)
+        ).astype(np.float32)
+        # Removed rows keep their postings until compact(); zero them out.
+        matrix = sparse.diags(alive.astype(np.float32)) @ matrix
+        return matrix.tocsr()
+
+    def query_matrix(self, queries: List[str], num_terms=None):
+        rows, cols, data = [], [], []
+        for row, query in enumerate(queries):
+            for token in self.preprocess_func(query):
+                col = self.vocab.get(token)
+                if col is not None and (num_terms is None or col < num_terms):
+                    rows.append(row)
+                    cols.append(col)
+                    data.append(1.0)
+        return sparse.csr_matrix(
+            (data, (rows, cols)),
+            shape=(len(queries), num_terms or len(self.vocab)),
+            dtype=np.float32,
+        )
+
+    def score(self, queries: List[str], rows=None):
+        """Dense `(len(queries), num_rows)` score matrix, or only the given rows."""
+        # The weights are immutable once built; score against that snapshot.
+        weights = self.weights()
+        if rows is not None:
+            weights = weights[rows]
+        queries = self.query_matrix(queries, weights.shape[1])
+        return (queries @ weights.T).toarray()
+
+    def search(self, queries: List[str], k: int, ids: List[str] = None):
+        """Top-k `(doc_id, score)` pairs for each query.
+
+        With `ids`, only those documents are scored.
+        """
+        with self.lock:
+            if ids is None:
+                rows = np.flatnonzero(np.frombuffer(self.alive, dtype=np.int8))
+                scores = self.score(queries)[:, rows]
+            else:
+                rows = np.array(
+                    [self.rows[doc_id] for doc_id in ids if doc_id in self.rows],
+                    dtype=np.int64,
+                )
+                scores = self.score(queries, rows)
+            if len(rows) == 0:
+                return [[] for _ in queries]
+            k = min(k, len(rows))
+            results = []
+            for row_scores in scores:
+                top = np.argpartition(-row_scores, k - 1)[:k]
+                top = top[np.argsort(-row_scores[top], kind="stable")]
+                results.append(
+                    [(self.ids[rows[idx]], float(row_scores[idx])) for idx in top]
+                )
+            return results
+
+    def save(self, path):
+        with self.lock:
+            self._save(path)
+
+    def _save(self, path):
+        self._compact()
+        os.makedirs(path, exist_ok=True)
+        tmp_path = os.path.join(path, "bm25.tmp.npz")
+        np.savez(
+            tmp_path,
+            indptr=np.frombuffer(self.indptr, dtype=np.int64),
+            indices=np.frombuffer(self.indices, dtype=np.int32),
+            counts=np.frombuffer(self.counts, dtype=np.float32),
+            doc_len=np.frombuffer(self.doc_len, dtype=np.float32),
+            df=self.df,
+        )
+        with open(os.path.join(path, "bm25.tmp.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "k1": self.k1,
+                    "b": self.b,
+                    "epsilon": self.epsilon,
+                    "tokenizer": self.tokenizer_name,
+                    "ids": self.ids,
+                    "vocab": self.vocab,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, os.path.join(path, "bm25.npz"))
+        os.replace(os.path.join(path, "bm25.tmp.json"), os.path.join(path, "bm25.json"))
+
+    @classmethod
+    def load(cls, path, preprocess_func=default_preprocessing_func):
+        """Load an index saved by `save`, or return None if there is none or it
+        was built with a different tokenizer than `preprocess_func`."""
+        if not os.path.exists(os.path.join(path, "bm25.json")):
+            return None
+        with open(os.path.join(path, "bm25.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("tokenizer", "whitespace") != getattr(
+            preprocess_func, "name", "whitespace"
+        ):
+            return None
+        arrays = np.load(os.path.join(path, "bm25.npz"))
+        index = cls(meta["k1"], meta["b"], meta["epsilon"], preprocess_func)
+        index.vocab = meta["vocab"]
+        index.ids = meta["ids"]
+        index.rows = {doc_id: row for row, doc_id in enumerate(index.ids)}
+        index.indptr = array("q", arrays["indptr"])
+        index.indices = array("i", arrays["indices"])
+        index.counts = array("f", arrays["counts"])
+        index.doc_len = array("f", arrays["doc_len"])
+        index.alive = array("b", [1] * len(index.ids))
+        index.df = arrays["df"].astype(np.int64)
+        return index
+
+
+class SparseBM25Retriever(BaseRetriever):
+    """LangChain retriever over a `SparseBM25Index`.
+
+    Drop-in replacement for `BM25Retriever` that supports appending
+    documents and batched queries. Tokenisation is whatever the index's
+    `preprocess_func` does (see `Utils.text_tokenizers`). `docs` maps ids to
+    documents: a dict, or any mapping that reads them on lookup.
+    """
+
+    index: Any
+    docs: Any = Field(default_factory=dict, repr=False)
+    k: int = 4
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], ids=None, index=None, **kwargs):
+        if index is None:
+            index = SparseBM25Index()
+        retriever = cls(index=index, **kwargs)
+        retriever.add_documents(documents, ids=ids)
+        return retriever
+
+    def add_documents(self, documents: List[Document], ids=None):
+        if ids is None:
+            ids = [str(len(self.docs) + idx) for idx in range(len(documents))]
+        missing = [
+            (doc_id, doc)
+            for doc_id, doc in zip(ids, documents)
+            if doc_id not in self.index
+        ]
+        # Store the documents first so a concurrent search never finds an id
+        # without its document.
+        self.docs.update(zip(ids, documents))
+        if missing:
+            self.index.add(
+                [doc_id for doc_id, _ in missing],
+                [doc.page_content for _, doc in missing],
+            )
+
+    def remove_documents(self, ids: List[str]):
+        self.index.remove(ids)
+        for doc_id in ids:
+            self.docs.pop(doc_id, None)
+
+    def batch_search(self, queries: List[str], k: int = None, ids: List[str] = None):
+        """Top-k `(Document, score)` pairs for every query in one matrix product.
+
+        With `ids`, only those documents are scored.
+        """
+        hits = self.index.search(queries, k or self.k, ids=ids)
+        return [
+            [(self.docs[doc_id], score) for doc_id, score in query_hits]
+            for query_hits in hits
+        ]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return [doc for doc, _ in self.batch_search([query])[0]]
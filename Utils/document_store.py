@@ -0,0 +1,282 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+logger = logging.getLogger("DocumentStore")
+logger.setLevel(logging.DEBUG)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+PARAGRAPH_BOUNDARY = re.compile(r"(?=\n\n)")
+TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-{3,}")
+
+
+def split_with_offsets(text_splitter, doc, doc_id):
+    """Split `doc` and replace its metadata offsets with `(doc_id, start, end)`.
+
+    `text_splitter` must be created with `add_start_index=True`.
+    """
+    chunks = text_splitter.split_documents([doc])
+    for chunk in chunks:
+        start = chunk.metadata.pop("start_index")
+        chunk.metadata["doc_id"] = doc_id
+        chunk.metadata["start"] = start
+        chunk.metadata["end"] = start + len(chunk.page_content)
+    return chunks
+
+
+def paragraph_boundaries(text):
+    """Sorted positions of every (possibly overlapping) `\\n\\n` in `text`."""
+    return [match.start() for match in PARAGRAPH_BOUNDARY.finditer(text)]
+
+
+def expand_context(
+    text,
+    boundaries,
+    start,
+    end,
+    forward_capacity=10000,
+    backward_capacity=2500,
+):
+    """Widen `text[start:end]` by the given capacities and snap both ends to
+    paragraph boundaries, using the precomputed `boundaries` index."""
+    start = max(0, start)
+    end = min(len(text), max(start, end))
+    desired_start_idx = max(0, start - backward_capacity)
+    desired_end_idx = min(len(text), end + forward_capacity)
+
+    # Last boundary that ends before desired_start_idx, first one at or after desired_end_idx.
+    idx = bisect_right(boundaries, desired_start_idx - 2) - 1
+    final_start_idx = boundaries[idx] + 2 if idx >= 0 else 0
+    idx = bisect_left(boundaries, desired_end_idx)
+    final_end_idx = boundaries[idx] if idx < len(boundaries) else len(text)
+    return text[final_start_idx:final_end_idx]
+
+
+class DocumentStore(object):
+    """Full document texts keyed by document id.
+
+    Chunks only carry `doc_id`, `start` and `end`; the full text is resolved
+    here when a retrieved chunk needs to be expanded. Texts registered with
+    `add_file` are read lazily from their preprocessed JSON file and kept in a
+    small LRU cache, texts registered with `add_text` stay in memory. Each
+    text is cached together with its paragraph-boundary index so expansion
+    is a pair of binary searches.
+
+    A file registered with its content hash is only read while it still has
+    that hash, since the chunk offsets point into that version. Otherwise,
+    or if the file is gone, the text is unavailable and `get`, `get_span`
+    and `expand` return None; callers fall back to the chunk itself.
+    """
+
+    def __init__(self, max_cached_docs=64, content_key="full_content"):
+        self.max_cached_docs = max_cached_docs
+        self.content_key = content_key
+        self.sources = {}
+        self.texts = {}
+        self.text_boundaries = {}
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, doc_id):
+        return doc_id in self.sources or doc_id in self.texts
+
+    def __len__(self):
+        return len(self.sources) + len(self.texts)
+
+    def add_file(self, doc_id, path, file_hash=None):
+        """Resolve `doc_id` from `path`, whose SHA-256 must be `file_hash` if given."""
+        with self.lock:
+            self.sources[doc_id] = (path, file_hash)
+            self.cache.pop(doc_id, None)
+
+    def add_text(self, doc_id, text):
+        with self.lock:
+            self.texts[doc_id] = text
+            self.text_boundaries.pop(doc_id, None)
+
+    def remove(self, doc_id):
+        with self.lock:
+            self.sources.pop(doc_id, None)
+            self.texts.pop(doc_id, None)
+            self.text_boundaries.pop(doc_id, None)
+            self.cache.pop(doc_id, None)
+
+    def load(self, path, file_hash=None):
+        """Full text of `path`, or None if it is missing or no longer has `file_hash`."""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            logger.warning(f"{path} was removed since it was indexed")
+            return None
+        if file_hash is not None and hashlib.sha256(data).hexdigest() != file_hash:
+            logger.warning(f"{path} changed since it was indexed")
+            return None
+        return json.loads(data)[self.content_key]
+
+    def get_entry(self, doc_id):
+        """Return `(text, paragraph_boundaries)` for `doc_id`, or None."""
+        with self.lock:
+            if doc_id in self.texts:
+                if doc_id not in self.text_boundaries:
+                    self.text_boundaries[doc_id] = paragraph_boundaries(
+                        self.texts[doc_id]
+                    )
+                return self.texts[doc_id], self.text_boundaries[doc_id]
+            if doc_id in self.cache:
+                self.cache.move_to_end(doc_id)
+                return self.cache[doc_id]
+            source = self.sources.get(doc_id)
+        if source is None:
+            return None
+
+        text = self.load(*source)
+        if text is None:
+            return None
+        entry = (text, paragraph_boundaries(text))
+        with self.lock:
+            self.cache[doc_id] = entry
+            self.cache.move_to_end(doc_id)
+            while len(self.cache) > self.max_cached_docs:
+                self.cache.popitem(last=False)
+        return entry
+
+    def get(self, doc_id):
+        entry = self.get_entry(doc_id)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def get_span(self, doc_id, start, end):
+        text = self.get(doc_id)
+        if text is None:
+            return None
+        return text[start:end]
+
+    def expand(
+        self, doc_id, start, end, forward_capacity=10000, backward_capacity=2500
+    ):
+        entry = self.get_entry(doc_id)
+        if entry is None:
+            return None
+        text, boundaries = entry
+        return expand_context(
+            text, boundaries, start, end, forward_capacity, backward_capacity
+        )
+
+    def expand_many(self, spans):
+        """`expand` for a list of `(doc_id, start, end, forward, backward)` tuples."""
+        return [self.expand(*span) for span in spans]
+
+
+def is_table(metadata):
+    """Whether a chunk is a table row-block (see `split_table`)."""
+    return "table_row_start" in metadata
+
+
+def table_header_size(lines):
+    """Number of header lines: a markdown header plus its `|---|` separator."""
+    if len(lines) > 1 and TABLE_SEPARATOR.match(lines[1]):
+        return 2
+    return 1 if lines else 0
+
+
+def split_table(table, max_chars=8000):
+    """Split a table into row-blocks of at most about `max_chars` characters.
+
+    Returns `(header, blocks)` where `blocks` are `(start, end)` row ranges
+    (rows counted after the header). A single row longer than `max_chars`
+    forms its own block.
+    """
+    lines = table.split("\n")
+    header_size = table_header_size(lines)
+    header, rows = lines[:header_size], lines[header_size:]
+    budget = max(1, max_chars - len("\n".join(header)))
+    blocks, start, size = [], 0, 0
+    for idx, row in enumerate(rows):
+        if idx > start and size + len(row) + 1 > budget:
+            blocks.append((start, idx))
+            start, size = idx, 0
+        size += len(row) + 1
+    if rows or not blocks:
+        blocks.append((start, len(rows)))
+    return "\n".join(header), blocks
+
+
+class TableStore(object):
+    """Table bodies resolved lazily from the preprocessed table JSON files.
+
+    Table chunks only carry the file path, its SHA-256 and their row range;
+    heading, paragraph and rows are read here when a hit is rendered, and
+    the parsed tables of recently used files are kept in a small LRU cache.
+    A file that is gone or no longer has the indexed hash is not read, since
+    the row range points into the indexed version.
+    """
+
+    def __init__(self, max_cached_tables=32):
+        self.max_cached_tables = max_cached_tables
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_entry(self, path, file_hash=None):
+        key = (path, file_hash)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            logger.warning(f"{path} was removed since it was indexed")
+            return None
+        if file_hash is not None and hashlib.sha256(data).hexdigest() != file_hash:
+            logger.warning(f"{path} changed since it was indexed")
+            return None
+        information = json.loads(data)
+        lines = (information.get("table") or "").split("\n")
+        header_size = table_header_size(lines)
+        entry = {
+            "context_heading": information.get("context_heading") or "None",
+            "context_paragraph": information.get("context_paragraph") or "None",
+            "header": "\n".join(lines[:header_size]),
+            "rows": lines[header_size:],
+        }
+        with self.lock:
+            self.cache[key] = entry
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_cached_tables:
+                self.cache.popitem(last=False)
+        return entry
+
+    def load(self, metadata):
+        """`{"context_heading", "context_paragraph", "table"}` for a table chunk,
+        or None if its file is gone or changed."""
+        entry = self.get_entry(metadata["path"], metadata.get("file_hash"))
+        if entry is None:
+            return None
+        rows = entry["rows"][metadata["table_row_start"] : metadata["table_row_end"]]
+        return {
+            "context_heading": entry["context_heading"],
+            "context_paragraph": entry["context_paragraph"],
+            "table": "\n".join([entry["header"], *rows]),
+        }
+
+
+_table_store = TableStore()
+
+
+def load_table(metadata):
+    """Heading, paragraph and row-block of a table chunk, read on demand, or
+    None if the table file is gone or changed since it was indexed."""
+    return _table_store.load(metadata)
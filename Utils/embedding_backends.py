@@ -0,0 +1,200 @@
+"""Embedding model backends: PyTorch, exported ONNX and int8-quantised ONNX.
+
+The backend is chosen per deployment with `embedding_backend` in
+`retriever_config.yaml` or the `EMBEDDING_BACKEND` environment variable.
+ONNX models are exported (and quantised) once into `EMBEDDING_EXPORT_PATH`.
+Check that a backend stays close enough to the float model before using it:
+
+    python -m Utils.embedding_backends --backend onnx-int8 --corpus /path/to/preprocessed_data/
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import threading
+
+import numpy as np
+from langchain_huggingface import HuggingFaceEmbeddings
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+DEFAULT_EXPORT_PATH = os.environ.get("EMBEDDING_EXPORT_PATH", "./embedding_models")
+# sentence-transformers quantisation preset: "arm64", "avx2", "avx512" or "avx512_vnni".
+DEFAULT_QUANTIZATION = os.environ.get("EMBEDDING_QUANTIZATION", "avx512_vnni")
+DEFAULT_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 32))
+
+_export_lock = threading.Lock()
+
+
+def cache_namespace(model_name, backend):
+    """Embedding cache namespace; quantised vectors must not mix with float ones."""
+    if backend in (None, "torch"):
+        return model_name
+    return f"{model_name}@{backend}"
+
+
+def find_file(directory, name):
+    matches = sorted(glob.glob(os.path.join(directory, "**", name), recursive=True))
+    if not matches:
+        return None
+    return os.path.relpath(matches[0], directory)
+
+
+def export_onnx_model(model_name, quantization=None, export_path=DEFAULT_EXPORT_PATH):
+    """Export `model_name` to ONNX (and int8 with `quantization`) once.
+
+    Returns `(model_dir, onnx_file_name)` for loading with `backend="onnx"`.
+    """
+    try:
+        from sentence_transformers import (
+            SentenceTransformer,
+            export_dynamic_quantized_onnx_model,
+        )
+    except ImportError:
+        raise ImportError(
+            "ONNX embedding backends need sentence-transformers>=3.2 with ONNX "
+            'support: pip install "sentence-transformers[onnx]"'
+        )
+    model_dir = os.path.join(export_path, model_name.replace("/", "--"))
+    target = (
+        "model.onnx" if quantization is None else f"model_qint8_{quantization}.onnx"
+    )
+    with _export_lock:
+        file_name = find_file(model_dir, target)
+        if file_name is not None:
+            return model_dir, file_name
+        if find_file(model_dir, "model.onnx") is None:
+            model = SentenceTransformer(model_name, backend="onnx", device="cpu")
+            model.save(model_dir)
+        if quantization is not None:
+            model = SentenceTransformer(
+                model_dir,
+                backend="onnx",
+                device="cpu",
+                model_kwargs={"file_name": find_file(model_dir, "model.onnx")},
+            )
+            export_dynamic_quantized_onnx_model(model, quantization, model_dir)
+        return model_dir, find_file(model_dir, target)
+
+
+def load_embeddings(model_name, backend=None, batch_size=DEFAULT_BATCH_SIZE):
+    """`HuggingFaceEmbeddings` for `model_name` on the given backend."""
+    backend = backend or DEFAULT_BACKEND
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(
+            f"Unknown embedding backend {backend}, use one of {EMBEDDING_BACKENDS}"
+        )
+    if backend == "torch":
+        return HuggingFaceEmbeddings(model_name=model_name)
+
+    model_dir, file_name = export_onnx_model(
+        model_name, DEFAULT_QUANTIZATION if backend == "onnx-int8" else None
+    )
+    # sentence-transformers sorts each batch by length, so padding stays small.
+    return HuggingFaceEmbeddings(
+        model_name=model_dir,
+        model_kwargs={
+            "device": "cpu",
+            "backend": "onnx",
+            "model_kwargs": {
+                "file_name": file_name,
+                "provider": "CPUExecutionProvider",
+            },
+        },
+        encode_kwargs={"batch_size": batch_size},
+    )
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def compare_embeddings(reference, candidate, documents, queries, k=5):
+    """How far `candidate` embeddings drift from `reference` ones.
+
+    Returns the mean and minimum cosine similarity between the two
+    embeddings of each document, and the overlap of the top-k documents
+    each model retrieves for `queries` (recall@k of candidate vs reference).
+    """
+    ref_docs = normalize(reference.embed_documents(documents))
+    cand_docs = normalize(candidate.embed_documents(documents))
+    cosines = (ref_docs * cand_docs).sum(axis=1)
+    ref_queries = normalize([reference.embed_query(query) for query in queries])
+    cand_queries = normalize([candidate.embed_query(query) for query in queries])
+    k = min(k, len(documents))
+    ref_top = np.argsort(-(ref_queries @ ref_docs.T), axis=1)[:, :k]
+    cand_top = np.argsort(-(cand_queries @ cand_docs.T), axis=1)[:, :k]
+    recall = [
+        len(set(ref_row) & set(cand_row)) / k
+        for ref_row, cand_row in zip(ref_top, cand_top)
+    ]
+    return {
+        "mean_cosine": float(cosines.mean()),
+        "min_cosine": float(cosines.min()),
+        f"recall_at_{k}": float(np.mean(recall)),
+    }
+
+
+def sample_corpus(corpus_dirs, num_docs, num_queries, seed=0):
+    """Paragraphs of preprocessed files as documents, and their openings as queries."""
+    rng = random.Random(seed)
+    files = sorted(
+        file for directory in corpus_dirs for file in glob.glob(f"{directory}/*.json")
+    )
+    rng.shuffle(files)
+    paragraphs = []
+    for file in files:
+        with open(file, "rb") as f:
+            information = json.load(f)
+        text = information.get("full_content") or information.get("summary") or ""
+        paragraphs.extend(p.strip() for p in text.split("\n\n") if len(p.strip()) > 50)
+        if len(paragraphs) >= num_docs:
+            break
+    documents = [p[:1500] for p in paragraphs[:num_docs]]
+    queries = [
+        doc[:60] for doc in rng.sample(documents, min(num_queries, len(documents)))
+    ]
+    return documents, queries
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check an embedding backend against the float PyTorch model."
+    )
+    parser.add_argument("--model", default="BAAI/bge-m3")
+    parser.add_argument("--backend", default="onnx-int8", choices=EMBEDDING_BACKENDS)
+    parser.add_argument(
+        "--corpus", nargs="+", required=True, help="Preprocessed data dirs"
+    )
+    parser.add_argument("--num-docs", type=int, default=500)
+    parser.add_argument("--num-queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--min-cosine", type=float, default=0.98)
+    parser.add_argument("--min-recall", type=float, default=0.9)
+    args = parser.parse_args()
+
+    documents, queries = sample_corpus(args.corpus, args.num_docs, args.num_queries)
+    if not documents:
+        parser.error("No documents found in the corpus directories")
+    report = compare_embeddings(
+        load_embeddings(args.model, "torch"),
+        load_embeddings(args.model, args.backend),
+        documents,
+        queries,
+        args.k,
+    )
+    report["passed"] = (
+        report["mean_cosine"] >= args.min_cosine
+        and report[f"recall_at_{min(args.k, len(documents))}"] >= args.min_recall
+    )
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
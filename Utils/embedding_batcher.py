@@ -0,0 +1,128 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, Queue
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger("EmbeddingBatcher")
+logger.setLevel(logging.DEBUG)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+DEFAULT_MAX_BATCH = int(os.environ.get("EMBEDDING_MAX_BATCH", 64))
+DEFAULT_MAX_WAIT = float(os.environ.get("EMBEDDING_MAX_WAIT_MS", 5)) / 1000
+
+
+def encode(embeddings, kind, texts):
+    """Embed `texts` as documents or queries with one model call where possible."""
+    if kind == "documents":
+        return embeddings.embed_documents(texts)
+    # Models with a query instruction cannot embed queries as documents.
+    if getattr(embeddings, "query_encode_kwargs", None):
+        return [embeddings.embed_query(text) for text in texts]
+    return embeddings.embed_documents(texts)
+
+
+class EmbeddingBatcher(Embeddings):
+    """Share one embedding model between threads with micro-batched forward passes.
+
+    The worker takes the first waiting request, then keeps collecting for up
+    to `max_wait` seconds or `max_batch` texts, and embeds all documents and
+    all queries of the batch with one model call each. Requests at least
+    `max_batch` texts long (index builds) go straight to the model.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_batch=DEFAULT_MAX_BATCH,
+        max_wait=DEFAULT_MAX_WAIT,
+    ):
+        self.embeddings = embeddings
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = Queue()
+        self.batches = 0
+        self.requests = 0
+        self.worker = threading.Thread(
+            target=self.run, name="embedding-batcher", daemon=True
+        )
+        self.worker.start()
+
+    def submit(self, kind, texts):
+        future = Future()
+        if not texts:
+            future.set_result([])
+        elif len(texts) >= self.max_batch:
+            try:
+                future.set_result(encode(self.embeddings, kind, texts))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            self.queue.put((kind, list(texts), future))
+        return future
+
+    def collect(self):
+        batch = [self.queue.get()]
+        num_texts = len(batch[0][1])
+        deadline = time.time() + self.max_wait
+        while num_texts < self.max_batch:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    item = self.queue.get(timeout=remaining)
+                else:
+                    # Still take whatever queued up during the last forward pass.
+                    item = self.queue.get_nowait()
+            except Empty:
+                break
+            batch.append(item)
+            num_texts += len(item[1])
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            for kind in ("documents", "queries"):
+                items = [item for item in batch if item[0] == kind]
+                if items:
+                    self.answer(kind, items)
+            self.batches += 1
+            self.requests += len(batch)
+
+    def answer(self, kind, items):
+        texts = list(dict.fromkeys(text for item in items for text in item[1]))
+        try:
+            found = dict(zip(texts, encode(self.embeddings, kind, texts)))
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(texts)} texts failed: {e}")
+            for _, _, future in items:
+                future.set_exception(e)
+            return
+        for _, item_texts, future in items:
+            future.set_result([list(found[text]) for text in item_texts])
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "queued": self.queue.qsize(),
+        }
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.submit("documents", texts).result()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.submit("queries", texts).result()
@@ -0,0 +1,199 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from Utils.embedding_backends import DEFAULT_BACKEND, cache_namespace, load_embeddings
+from Utils.embedding_batcher import EmbeddingBatcher
+
+logger = logging.getLogger("EmbeddingCache")
+logger.setLevel(logging.DEBUG)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    "EMBEDDING_CACHE_PATH", "./embedding_cache/embeddings.sqlite"
+)
+DEFAULT_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 2000000))
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache(object):
+    """SQLite store of embeddings keyed by (model name, text hash).
+
+    Entries are evicted least-recently-used first once the table holds more
+    than `max_entries` rows. Safe to share between threads and processes.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "last_used REAL NOT NULL, PRIMARY KEY (model, text_hash))"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self.conn.commit()
+
+    def get_many(self, model, hashes, batch_size=500):
+        found = {}
+        now = time.time()
+        with self.lock:
+            for i in range(0, len(hashes), batch_size):
+                batch = hashes[i : i + batch_size]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for digest, blob in rows:
+                    found[digest] = array("f", blob).tolist()
+                if rows:
+                    self.conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash IN ({placeholders})",
+                        [now, model, *batch],
+                    )
+            self.conn.commit()
+        return found
+
+    def put_many(self, model, items):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [
+                    (model, digest, array("f", vector).tobytes(), now)
+                    for digest, vector in items
+                ],
+            )
+            self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count <= self.max_entries:
+            return
+        # Trim an extra 10% so eviction does not run on every insert.
+        excess = count - int(self.max_entries * 0.9)
+        self.conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        logger.info(f"Evicted {excess} embeddings from {self.path}")
+
+
+class CachedEmbeddings(Embeddings):
+    """Wrap an `EmbeddingBatcher` so only texts missing from the cache are embedded."""
+
+    def __init__(
+        self, embeddings: EmbeddingBatcher, model_name: str, cache: EmbeddingCache
+    ):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        found = self.cache.get_many(self.model_name, list(set(hashes)))
+        missing = {}
+        for text, digest in zip(texts, hashes):
+            if digest not in found and digest not in missing:
+                missing[digest] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_name, new_items)
+            found.update(new_items)
+        logger.debug(
+            f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses"
+        )
+        return [list(found[digest]) for digest in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries, running one forward pass for the cache misses."""
+        # Queries are cached under their own namespace: some models embed
+        # queries differently from documents.
+        namespace = f"{self.model_name}#query"
+        hashes = [text_hash(text) for text in texts]
+        found = self.cache.get_many(namespace, list(set(hashes)))
+        missing = {}
+        for text, digest in zip(texts, hashes):
+            if digest not in found and digest not in missing:
+                missing[digest] = text
+        if missing:
+            vectors = self.embeddings.embed_queries(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.cache.put_many(namespace, new_items)
+            found.update(new_items)
+        return [list(found[digest]) for digest in hashes]
+
+
+_caches = {}
+_base_models = {}
+_models = {}
+_registry_lock = threading.Lock()
+
+
+def get_embedding_cache(path=None, max_entries=None):
+    path = path or DEFAULT_CACHE_PATH
+    with _registry_lock:
+        if path not in _caches:
+            _caches[path] = EmbeddingCache(path, max_entries or DEFAULT_MAX_ENTRIES)
+        return _caches[path]
+
+
+def register_embeddings(model_name, embeddings: Embeddings, backend=None):
+    """Serve `model_name` from `embeddings` instead of loading a HuggingFace model.
+
+    Registers it for `backend` (default `EMBEDDING_BACKEND`), the one
+    `get_embeddings` will be asked for. Must be called before the first
+    `get_embeddings(model_name)`.
+    """
+    name = cache_namespace(model_name, backend or DEFAULT_BACKEND)
+    with _registry_lock:
+        _base_models[name] = EmbeddingBatcher(embeddings)
+
+
+def get_embeddings(model_name, cache_path=None, max_entries=None, backend=None):
+    """Process-wide cached embedding model for `model_name`.
+
+    Callers asking for the same model and backend share one loaded model,
+    one micro-batching queue in front of it and one cache. `backend` is one
+    of `Utils.embedding_backends.EMBEDDING_BACKENDS` and defaults to
+    `EMBEDDING_BACKEND`.
+    """
+    cache = get_embedding_cache(cache_path, max_entries)
+    name = cache_namespace(model_name, backend or DEFAULT_BACKEND)
+    key = (name, cache.path)
+    with _registry_lock:
+        if name not in _base_models:
+            _base_models[name] = EmbeddingBatcher(load_embeddings(model_name, backend))
+        if key not in _models:
+            _models[key] = CachedEmbeddings(_base_models[name], name, cache)
+        return _models[key]
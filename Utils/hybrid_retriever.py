@@ -0,0 +1,305 @@
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from Utils.metadata_index import normalize_source
+
+FUSION_METHODS = ("rrf", "minmax", "zscore")
+
+# Dense searches run here while the calling thread scores BM25.
+_dense_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-dense")
+# Shard fan-out; separate from the dense pool so shards cannot starve it.
+_shard_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-shard")
+# Merged shard candidates are keyed by (shard position << 32) + BM25 row.
+SHARD_CODE_BITS = 32
+SHARD_ROW_MASK = (1 << SHARD_CODE_BITS) - 1
+
+
+def embed_queries(embeddings, queries):
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(queries)
+    return [embeddings.embed_query(query) for query in queries]
+
+
+def fuse(hit_lists, weights, method="rrf", c=60):
+    """Fuse ranked `(codes, scores)` arrays from several retrievers.
+
+    `rrf` sums `weight / (rank + c)` like `EnsembleRetriever`; `minmax` and
+    `zscore` normalise each side's raw scores and sum them weighted, with a
+    document missing from one side getting nothing from it. Returns
+    `(codes, fused_scores)` sorted best first.
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method {method}, use one of {FUSION_METHODS}")
+    all_codes, all_scores = [], []
+    for (codes, scores), weight in zip(hit_lists, weights):
+        if len(codes) == 0:
+            continue
+        if method == "rrf":
+            fused = weight / (np.arange(1, len(codes) + 1) + c)
+        elif method == "minmax":
+            span = scores.max() - scores.min()
+            fused = weight * (
+                (scores - scores.min()) / span if span > 0 else np.ones_like(scores)
+            )
+        else:
+            std = scores.std()
+            fused = weight * (
+                (scores - scores.mean()) / std if std > 0 else np.zeros_like(scores)
+            )
+        all_codes.append(codes)
+        all_scores.append(fused)
+    if not all_codes:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    codes, inverse = np.unique(np.concatenate(all_codes), return_inverse=True)
+    scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+    order = np.argsort(-scores, kind="stable")
+    return codes[order], scores[order]
+
+
+class CachedBatchRetriever(BaseRetriever):
+    """Retriever answering query batches, with an optional `RetrievalCache`
+    in front of `search`. Subclasses implement `search_with_scores`."""
+
+    cache: Any = None
+    k: int = 4
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.batch_get_relevant_documents([query])[0]
+
+    def batch_get_relevant_documents(self, queries, filters=None):
+        """Top-k documents for every query.
+
+        `filters` (see `MetadataIndex`) are applied before scoring, so only
+        the matching chunks are searched. With a `RetrievalCache`, only
+        queries it has not seen for the current index version are searched.
+        """
+        if not queries:
+            return []
+        if self.cache is None:
+            return self.search(queries, filters)
+        results = self.cache.get_many(queries, self.k, filters)
+        missing = list(
+            dict.fromkeys(
+                query for query, result in zip(queries, results) if result is None
+            )
+        )
+        if missing:
+            found = dict(zip(missing, self.search(missing, filters)))
+            self.cache.put_many(missing, self.k, filters, [found[q] for q in missing])
+            results = [
+                found[query] if result is None else result
+                for query, result in zip(queries, results)
+            ]
+        return results
+
+    def search(self, queries, filters=None):
+        """Uncached `batch_get_relevant_documents`."""
+        return [
+            [doc for doc, _ in hits]
+            for hits in self.search_with_scores(queries, filters)
+        ]
+
+    def search_with_scores(self, queries, filters=None):
+        raise NotImplementedError
+
+
+class HybridRetriever(CachedBatchRetriever):
+    """Dense + BM25 retriever fused on integer ids.
+
+    The dense search (embedding included) runs on a worker thread while BM25
+    scores on the caller's, both only return `(id, score)` pairs, and the
+    lists are fused as arrays keyed by BM25 row. `Document` objects are
+    looked up only for the final `k` hits of each query. Optional
+    `MetadataIndex` filters restrict both searches, and an optional
+    `RetrievalCache` short-circuits repeated queries.
+    """
+
+    vectorstore: Any
+    bm25_retriever: Any
+    metadata_index: Any = None
+    weights: List[float] = [0.5, 0.5]
+    dense_candidates: int = 4
+    bm25_candidates: int = 4
+    fusion: str = "rrf"
+    rrf_c: int = 60
+
+    def fingerprint(self):
+        """Digest of the ranking settings, for cache keys."""
+        payload = json.dumps(
+            [
+                self.k,
+                list(self.weights),
+                self.dense_candidates,
+                self.bm25_candidates,
+                self.fusion,
+                self.rrf_c,
+            ]
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def dense_search(
+        self, queries, allowed_ids=None, where=None, query_embeddings=None
+    ):
+        """`(id, score)` lists from the vector store, higher scores first."""
+        if query_embeddings is None:
+            query_embeddings = embed_queries(self.vectorstore.embeddings, queries)
+        if hasattr(self.vectorstore, "batch_search_ids"):
+            return self.vectorstore.batch_search_ids(
+                query_embeddings, self.dense_candidates, ids=allowed_ids
+            )
+        dense = self.vectorstore._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=self.dense_candidates,
+            where=where,
+            include=["distances"],
+        )
+        return [
+            [(doc_id, -distance) for doc_id, distance in zip(ids, distances)]
+            for ids, distances in zip(dense["ids"], dense["distances"])
+        ]
+
+    def codes(self, hits):
+        rows = self.bm25_retriever.index.rows
+        hits = [(rows[doc_id], score) for doc_id, score in hits if doc_id in rows]
+        return (
+            np.array([row for row, _ in hits], dtype=np.int64),
+            np.array([score for _, score in hits], dtype=np.float64),
+        )
+
+    def candidates(self, queries, filters=None, query_embeddings=None):
+        """Raw dense and BM25 candidates of every query, before fusion.
+
+        Returns one `(dense, bm25)` pair of `(codes, scores)` arrays per
+        query, best first, with codes being BM25 rows.
+        """
+        allowed_ids, where = None, None
+        if filters and self.metadata_index is not None:
+            allowed_ids = self.metadata_index.select(filters)
+            if not allowed_ids:
+                return [(self.codes([]), self.codes([])) for _ in queries]
+            where = self.metadata_index.chroma_where(filters)
+
+        dense_future = _dense_pool.submit(
+            self.dense_search, queries, allowed_ids, where, query_embeddings
+        )
+        bm25_hits = self.bm25_retriever.index.search(
+            queries, self.bm25_candidates, ids=allowed_ids
+        )
+        dense_hits = dense_future.result()
+        return [
+            (self.codes(dense), self.codes(bm25))
+            for dense, bm25 in zip(dense_hits, bm25_hits)
+        ]
+
+    def fuse(self, hit_lists):
+        return fuse(hit_lists, self.weights, self.fusion, self.rrf_c)
+
+    def document(self, code):
+        return self.bm25_retriever.docs[self.bm25_retriever.index.ids[code]]
+
+    def search_with_scores(self, queries, filters=None, query_embeddings=None):
+        """Top-k `(Document, fused_score)` pairs for every query, uncached."""
+        results = []
+        for hit_lists in self.candidates(queries, filters, query_embeddings):
+            codes, scores = self.fuse(hit_lists)
+            results.append(
+                [
+                    (self.document(code), float(score))
+                    for code, score in zip(codes[: self.k], scores[: self.k])
+                ]
+            )
+        return results
+
+
+class ShardedRetriever(CachedBatchRetriever):
+    """Fan a query batch out to one `HybridRetriever` per corpus shard.
+
+    Every `raw_file_path` directory is an independently persisted shard, so
+    adding a directory only indexes that directory. Shards are searched in
+    parallel for their raw dense and BM25 candidates, which are merged per
+    side by raw score and fused once as if the corpus were one index; fused
+    scores (RRF ranks, per-shard normalisation) do not compare across
+    shards. A `shards` entry in `filters` (shard names or directory paths)
+    limits the search to those shards; the remaining filters are passed to
+    each shard.
+    """
+
+    shards: Dict[str, Any]
+    directories: Dict[str, str] = {}
+
+    def select_shards(self, selected=None):
+        if not selected:
+            return list(self.shards)
+        names = {str(name) for name in selected}
+        directories = {normalize_source(name) for name in selected}
+        return [
+            name
+            for name in self.shards
+            if name in names
+            or (
+                name in self.directories
+                and normalize_source(self.directories[name]) in directories
+            )
+        ]
+
+    def search_with_scores(self, queries, filters=None):
+        filters = dict(filters or {})
+        names = self.select_shards(filters.pop("shards", None))
+        if not names:
+            return [[] for _ in queries]
+        if len(names) == 1:
+            return self.shards[names[0]].search_with_scores(queries, filters)
+        # Shards normally share one embedding model: embed the batch once.
+        query_embeddings = None
+        models = {id(self.shards[name].vectorstore.embeddings) for name in names}
+        if len(models) == 1:
+            query_embeddings = embed_queries(
+                self.shards[names[0]].vectorstore.embeddings, queries
+            )
+        futures = [
+            _shard_pool.submit(
+                self.shards[name].candidates, queries, filters, query_embeddings
+            )
+            for name in names
+        ]
+        shard_candidates = [future.result() for future in futures]
+        # Shards share the ranking settings; the first one fuses for all.
+        lead = self.shards[names[0]]
+        results = []
+        for query_idx in range(len(queries)):
+            hit_lists = []
+            for side, depth in enumerate((lead.dense_candidates, lead.bm25_candidates)):
+                # Code = shard position in the high bits, BM25 row in the low ones.
+                codes = np.concatenate(
+                    [
+                        (position << SHARD_CODE_BITS) + candidates[query_idx][side][0]
+                        for position, candidates in enumerate(shard_candidates)
+                    ]
+                )
+                scores = np.concatenate(
+                    [candidates[query_idx][side][1] for candidates in shard_candidates]
+                )
+                order = np.argsort(-scores, kind="stable")[:depth]
+                hit_lists.append((codes[order], scores[order]))
+            codes, scores = lead.fuse(hit_lists)
+            results.append(
+                [
+                    (
+                        self.shards[names[code >> SHARD_CODE_BITS]].document(
+                            code & SHARD_ROW_MASK
+                        ),
+                        float(score),
+                    )
+                    for code, score in zip(codes[: self.k], scores[: self.k])
+                ]
+            )
+        return results
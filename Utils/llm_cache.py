@@ -0,0 +1,198 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from langchain_core.load import dumpd, load
+from langchain_core.messages import messages_to_dict
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from Utils.llm_client import model_temperature
+
+logger = logging.getLogger("LLMCache")
+logger.setLevel(logging.DEBUG)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+# "off", "on" (deterministic calls only), "record" (every call) or "replay".
+LLM_CACHE_MODES = ("off", "on", "record", "replay")
+DEFAULT_LLM_CACHE_MODE = os.environ.get("LLM_CACHE_MODE", "off")
+DEFAULT_LLM_CACHE_PATH = os.environ.get(
+    "LLM_CACHE_PATH", "./llm_cache/responses.sqlite"
+)
+DEFAULT_LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+DEFAULT_LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 100000))
+
+
+class LLMCacheMiss(KeyError):
+    """Raised in replay mode when a call has no recorded response."""
+
+
+class LLMResponseCache(object):
+    """SQLite store of chat model responses keyed by the request content.
+
+    The key hashes the model, temperature, messages, tool schemas and
+    tool_choice. The cache is off unless `LLM_CACHE_MODE` turns it on. In
+    "on" mode only temperature-0 calls are cached; "record" caches every
+    call; "replay" serves recorded responses and raises `LLMCacheMiss`
+    instead of calling the provider. A response is stored under the model
+    that answered it, so one from the backup is never replayed for the
+    primary. Entries expire after
+    `ttl` seconds (0 keeps them) and least recently used ones are evicted
+    beyond `max_entries`.
+    """
+
+    def __init__(
+        self,
+        path=DEFAULT_LLM_CACHE_PATH,
+        mode=DEFAULT_LLM_CACHE_MODE,
+        ttl=DEFAULT_LLM_CACHE_TTL,
+        max_entries=DEFAULT_LLM_CACHE_MAX_ENTRIES,
+    ):
+        if mode not in LLM_CACHE_MODES:
+            raise ValueError(
+                f"Unknown LLM cache mode {mode}, use one of {LLM_CACHE_MODES}"
+            )
+        self.path = path
+        self.mode = mode
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.tool_schemas = {}
+        self.lock = threading.Lock()
+        self.conn = None
+        if mode == "off":
+            return
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, response TEXT NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_created ON responses (created)"
+        )
+        self.conn.commit()
+
+    def tool_schema(self, tool):
+        if isinstance(tool, dict):
+            return tool
+        with self.lock:
+            if id(tool) not in self.tool_schemas:
+                self.tool_schemas[id(tool)] = (tool, convert_to_openai_tool(tool))
+            return self.tool_schemas[id(tool)][1]
+
+    def key(self, model_name, prompt, tool=None, tool_choice=None):
+        """Cache key of a call, or None if this call must not be cached."""
+        temperature = model_temperature(model_name)
+        if self.mode == "off" or (self.mode == "on" and temperature != 0):
+            return None
+        payload = json.dumps(
+            [
+                model_name,
+                temperature,
+                messages_to_dict(prompt),
+                [self.tool_schema(item) for item in tool or []],
+                tool_choice,
+            ],
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        if key is None:
+            return None
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl and now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                if self.mode == "replay":
+                    raise LLMCacheMiss(f"No recorded LLM response for key {key}")
+                return None
+            self.hits += 1
+            self.conn.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (now, key)
+            )
+            self.conn.commit()
+        return load(json.loads(row[0]))
+
+    def put(self, key, model_name, response):
+        if key is None or self.mode == "replay":
+            return
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (
+                    key,
+                    model_name,
+                    json.dumps(dumpd(response), ensure_ascii=False),
+                    now,
+                    now,
+                ),
+            )
+            self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        if self.ttl:
+            self.conn.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)
+            )
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count <= self.max_entries:
+            return
+        excess = count - int(self.max_entries * 0.9)
+        self.conn.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        logger.info(f"Evicted {excess} LLM responses from {self.path}")
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "mode": self.mode,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """Process-wide response cache configured from the `LLM_CACHE_*` environment."""
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMResponseCache()
+        return _llm_cache
@@ -0,0 +1,165 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import threading
+
+import httpx
+import litellm
+from langchain_community.chat_models import ChatLiteLLM
+
+from Utils.llm_scheduler import get_llm_scheduler, remaining_time
+
+logger = logging.getLogger("LLMClient")
+logger.setLevel(logging.DEBUG)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 100))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("LLM_MAX_KEEPALIVE_CONNECTIONS", 20))
+
+# Reasoning models only accept the default temperature.
+FIXED_TEMPERATURE_MODELS = {"o3-mini": 1, "o4-mini": 1}
+
+
+def model_temperature(model_name, temperature=0):
+    return FIXED_TEMPERATURE_MODELS.get(model_name, temperature)
+
+
+def tool_key(tool):
+    """Hashable identity of a tool list; schemas are converted once per tool object."""
+    if not tool:
+        return None
+    return tuple(
+        json.dumps(item, sort_keys=True) if isinstance(item, dict) else id(item)
+        for item in tool
+    )
+
+
+class ChatModelRegistry(object):
+    """Process-wide `ChatLiteLLM` clients, bound to their tools once.
+
+    Models are keyed by (model, temperature, tools, tool_choice) and shared
+    across calls and threads. Synchronous calls share one pooled
+    `httpx.Client` through litellm; async calls use litellm's own per-loop
+    clients, since `asyncio.run` gives each batch a new event loop.
+    """
+
+    def __init__(
+        self,
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+    ):
+        self.lock = threading.Lock()
+        self.models = {}
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            timeout=None,
+        )
+        litellm.client_session = self.http_client
+        self.closed = False
+
+    def get(self, model_name, temperature=0, tool=None, tool_choice=None):
+        temperature = model_temperature(model_name, temperature)
+        key = (model_name, temperature, tool_key(tool), tool_choice)
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("The chat model registry has been shut down")
+            if key not in self.models:
+                # Retries are left to `Utils.llm_policy`.
+                model = ChatLiteLLM(
+                    model=model_name, temperature=temperature, max_retries=1
+                )
+                if tool:
+                    model = model.bind_tools(tools=tool, tool_choice=tool_choice)
+                # Keep the tools alive so their ids are not reused by other objects.
+                self.models[key] = (model, tool)
+            return self.models[key][0]
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.models.clear()
+            if litellm.client_session is self.http_client:
+                litellm.client_session = None
+            self.http_client.close()
+        logger.debug("Closed chat model clients")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_chat_model(model_name, temperature=0, tool=None, tool_choice=None):
+    """Shared chat model for `model_name`, bound to `tool` when given."""
+    global _registry
+    with _registry_lock:
+        if _registry is None or _registry.closed:
+            _registry = ChatModelRegistry()
+            atexit.register(_registry.close)
+        registry = _registry
+    return registry.get(model_name, temperature, tool, tool_choice)
+
+
+def shutdown_chat_models():
+    """Drop cached clients and close their connection pool."""
+    with _registry_lock:
+        if _registry is not None:
+            _registry.close()
+
+
+def invoke_chat_model(
+    model_name,
+    prompt,
+    tool=None,
+    tool_choice=None,
+    temperature=0,
+    deadline=None,
+    on_start=None,
+):
+    """Call a shared chat model once it gets a slot from the LLM scheduler.
+
+    `deadline` (a `time.monotonic()` value) bounds the wait for the slot and
+    the request; what is left after the wait is litellm's request timeout.
+    `on_start()` is called once the slot is held, just before the request.
+    """
+    model = get_chat_model(model_name, temperature, tool, tool_choice)
+    with get_llm_scheduler().slot(model_name, prompt, deadline) as slot:
+        if on_start is not None:
+            on_start()
+        response = model.invoke(prompt, request_timeout=remaining_time(deadline))
+        slot.record(response)
+    return response
+
+
+async def ainvoke_chat_model(
+    model_name,
+    prompt,
+    tool=None,
+    tool_choice=None,
+    temperature=0,
+    deadline=None,
+    on_start=None,
+):
+    model = get_chat_model(model_name, temperature, tool, tool_choice)
+    async with get_llm_scheduler().aslot(model_name, prompt, deadline) as slot:
+        if on_start is not None:
+            on_start()
+        timeout = remaining_time(deadline)
+        # Also cancel the request if litellm does not honour the timeout.
+        response = await asyncio.wait_for(
+            model.ainvoke(prompt, request_timeout=timeout), timeout
+        )
+        slot.record(response)
+    return response
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import httpx
+import litellm
+
+from Utils.llm_client import ainvoke_chat_model
+from Utils.llm_scheduler import report_config_section
+
+logger = logging.getLogger("LLMPolicy")
+logger.setLevel(logging.DEBUG)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+# Seconds: `timeout` bounds one attempt, `deadline` a call with all its retries.
+DEFAULT_POLICY = {
+    "timeout": 120,
+    "max_attempts": 3,
+    "base_delay": 1.0,
+    "max_delay": 30.0,
+    "deadline": 600,
+}
+# Long generations: a report section or the conclusion can take minutes.
+DEFAULT_ROLE_POLICIES = {
+    "writer": {"timeout": 300, "deadline": 900},
+    "conclude": {"timeout": 300, "deadline": 900},
+}
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+RETRYABLE_ERRORS = (
+    TimeoutError,
+    asyncio.TimeoutError,
+    ConnectionError,
+    httpx.TimeoutException,
+    httpx.TransportError,
+    litellm.Timeout,
+    litellm.RateLimitError,
+    litellm.APIConnectionError,
+    litellm.InternalServerError,
+    litellm.ServiceUnavailableError,
+)
+
+
+def is_retryable(error):
+    """Transient failures (timeouts, rate limits, 5xx, dropped connections).
+
+    Bad requests, authentication errors and context-window overflows fail
+    the same way on every attempt and are raised at once.
+    """
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES
+
+
+class CallPolicy(object):
+    """Timeouts and bounded retries for the LLM calls of one role.
+
+    Each attempt, including its wait for a scheduler slot and any backup or
+    hedged request, must end within `timeout` seconds, and all attempts
+    within `deadline` seconds. Retryable errors are retried up to `max_attempts`
+    times in total with full-jitter exponential backoff between
+    `base_delay` and `max_delay`.
+    """
+
+    def __init__(
+        self,
+        role="default",
+        timeout=120,
+        max_attempts=3,
+        base_delay=1.0,
+        max_delay=30.0,
+        deadline=600,
+    ):
+        self.role = role
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def attempt_deadline(self, deadline):
+        now = time.monotonic()
+        if deadline <= now:
+            raise TimeoutError(
+                f"{self.role} LLM call passed its {self.deadline}s deadline"
+            )
+        return min(now + self.timeout, deadline)
+
+    def retry_delay(self, error, attempt, deadline):
+        """Seconds to wait before the next attempt, or None to give up."""
+        if attempt + 1 >= self.max_attempts or not is_retryable(error):
+            return None
+        delay = self.backoff(attempt)
+        if time.monotonic() + delay >= deadline:
+            return None
+        logger.warning(
+            f"{self.role} LLM call failed ({error}), retry {attempt + 1} in {delay:.1f}s"
+        )
+        return delay
+
+    def run(self, func):
+        """Call `func(deadline)` under this policy.
+
+        `deadline` is the `time.monotonic()` time by which the attempt must end.
+        """
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_attempts):
+            try:
+                return func(self.attempt_deadline(deadline))
+            except Exception as e:
+                delay = self.retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    async def arun(self, func):
+        """Await `func(deadline)` under this policy."""
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_attempts):
+            try:
+                return await func(self.attempt_deadline(deadline))
+            except Exception as e:
+                delay = self.retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+
+_policies = None
+_policies_lock = threading.Lock()
+
+
+def get_call_policy(role="default"):
+    """Policy for `role` from `LLM_CALL_POLICY` in `report_config.yaml`.
+
+    Roles not listed use its `default` entry, which itself falls back to
+    `DEFAULT_POLICY`. `DEFAULT_ROLE_POLICIES` raises the timeouts of the
+    long-running roles over the `default` entry; list a role to change them.
+    """
+    global _policies
+    with _policies_lock:
+        if _policies is None:
+            _policies = report_config_section("LLM_CALL_POLICY") or {}
+        settings = {
+            **DEFAULT_POLICY,
+            **_policies.get("default", {}),
+            **DEFAULT_ROLE_POLICIES.get(role, {}),
+            **_policies.get(role, {}),
+        }
+    return CallPolicy(role, **settings)
+
+
+async def ainvoke_with_policy(
+    model_name, prompt, tool=None, tool_choice=None, role="extraction"
+):
+    """Call one model, without a backup, under the policy of `role`."""
+    return await get_call_policy(role).arun(
+        lambda deadline: ainvoke_chat_model(
+            model_name, prompt, tool, tool_choice, deadline=deadline
+        )
+    )
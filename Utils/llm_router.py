@@ -0,0 +1,361 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
+
+import numpy as np
+
+from Utils.llm_client import ainvoke_chat_model, invoke_chat_model
+from Utils.llm_policy import is_retryable
+from Utils.llm_scheduler import remaining_time, report_config_section
+
+logger = logging.getLogger("LLMRouter")
+logger.setLevel(logging.DEBUG)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+DEFAULT_BREAKER = {"failure_threshold": 5, "recovery_time": 30}
+DEFAULT_HEDGING = {"enabled": False, "percentile": 95, "min_samples": 20}
+LATENCY_WINDOW = 200
+
+# Runs sync primaries that may be hedged; a thread cannot be interrupted, so a
+# losing sync call finishes in the background and its result is dropped.
+_hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+
+
+class CircuitBreaker(object):
+    """Consecutive-failure circuit breaker for one model.
+
+    After `failure_threshold` failures in a row the circuit opens and
+    `allow()` returns False, so calls go straight to the backup. Once
+    `recovery_time` seconds have passed, one caller is let through as a
+    probe; its success closes the circuit, its failure re-opens it.
+    Successful call latencies are kept to derive the hedging delay.
+    """
+
+    def __init__(self, name, failure_threshold=5, recovery_time=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.probing else "open"
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.time() - self.opened_at < self.recovery_time:
+                return False
+            self.probing = True
+            logger.info(f"Probing {self.name} for recovery")
+            return True
+
+    def record_success(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            if self.opened_at is not None:
+                logger.info(f"Circuit for {self.name} closed")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or (
+                self.opened_at is None and self.failures >= self.failure_threshold
+            ):
+                logger.warning(
+                    f"Circuit for {self.name} opened after {self.failures} failures"
+                )
+                self.opened_at = time.time()
+            self.probing = False
+
+    def release_probe(self):
+        """Let another caller probe when a probe was cancelled before finishing."""
+        with self.lock:
+            self.probing = False
+
+    def latency_percentile(self, percentile, min_samples):
+        with self.lock:
+            if len(self.latencies) < min_samples:
+                return None
+            return float(np.percentile(self.latencies, percentile))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "samples": len(self.latencies),
+            }
+
+
+class LLMRouter(object):
+    """Route calls between a primary and a backup model.
+
+    Configured by `LLM_CIRCUIT_BREAKER` (`failure_threshold`, `recovery_time`)
+    and `LLM_HEDGING` (`enabled`, `percentile`, `min_samples`) in
+    `report_config.yaml`. With hedging enabled, the backup is started when
+    the primary runs longer than that percentile of its recent latencies,
+    and the first response wins.
+    """
+
+    def __init__(self, breaker=None, hedging=None):
+        self.breaker_settings = {**DEFAULT_BREAKER, **(breaker or {})}
+        self.hedging = {**DEFAULT_HEDGING, **(hedging or {})}
+        self.breakers = {}
+        self.hedged = 0
+        self.hedges_won = 0
+        self.lock = threading.Lock()
+
+    def breaker(self, model_name):
+        with self.lock:
+            if model_name not in self.breakers:
+                self.breakers[model_name] = CircuitBreaker(
+                    model_name, **self.breaker_settings
+                )
+            return self.breakers[model_name]
+
+    def hedge_delay(self, model_name):
+        if not self.hedging["enabled"]:
+            return None
+        return self.breaker(model_name).latency_percentile(
+            self.hedging["percentile"], self.hedging["min_samples"]
+        )
+
+    def record_failure(self, model_name, error, started):
+        """Count `error` against the model only if its request was sent and
+        the error is transient; a bad request or a timeout while queueing
+        says nothing about the provider's health."""
+        breaker = self.breaker(model_name)
+        if started and is_retryable(error):
+            breaker.record_failure()
+        else:
+            breaker.release_probe()
+
+    def invoke(self, model_name, prompt, tool=None, tool_choice=None, deadline=None):
+        """Call one model. Returns `(model_name, response)`."""
+        # Latency is measured from when the scheduler slot is held.
+        start_time = []
+        try:
+            response = invoke_chat_model(
+                model_name,
+                prompt,
+                tool,
+                tool_choice,
+                deadline=deadline,
+                on_start=lambda: start_time.append(time.time()),
+            )
+        except Exception as e:
+            self.record_failure(model_name, e, bool(start_time))
+            raise
+        self.breaker(model_name).record_success(time.time() - start_time[0])
+        return model_name, response
+
+    async def ainvoke(
+        self, model_name, prompt, tool=None, tool_choice=None, deadline=None
+    ):
+        start_time = []
+        try:
+            response = await ainvoke_chat_model(
+                model_name,
+                prompt,
+                tool,
+                tool_choice,
+                deadline=deadline,
+                on_start=lambda: start_time.append(time.time()),
+            )
+        except asyncio.CancelledError:
+            self.breaker(model_name).release_probe()
+            raise
+        except Exception as e:
+            self.record_failure(model_name, e, bool(start_time))
+            raise
+        self.breaker(model_name).record_success(time.time() - start_time[0])
+        return model_name, response
+
+    def call(
+        self,
+        model_name,
+        backup_model_name,
+        prompt,
+        tool=None,
+        tool_choice=None,
+        deadline=None,
+    ):
+        """Answer from the primary or the backup model by `deadline`.
+
+        Returns `(model_name, response)` naming the model that answered.
+        `deadline` is a `time.monotonic()` time shared by both models: a
+        backup started after the primary fails or lags only gets what is
+        left of it.
+        """
+        if not self.breaker(model_name).allow():
+            logger.info(f"Circuit for {model_name} is open, using {backup_model_name}")
+            return self.invoke(backup_model_name, prompt, tool, tool_choice, deadline)
+        delay = self.hedge_delay(model_name)
+        if delay is None:
+            try:
+                return self.invoke(model_name, prompt, tool, tool_choice, deadline)
+            except Exception as e:
+                logger.error(e)
+                return self.invoke(
+                    backup_model_name, prompt, tool, tool_choice, deadline
+                )
+
+        primary = _hedge_pool.submit(
+            self.invoke, model_name, prompt, tool, tool_choice, deadline
+        )
+        try:
+            remaining = remaining_time(deadline)
+            return primary.result(
+                timeout=delay if remaining is None else min(delay, remaining)
+            )
+        except FutureTimeoutError:
+            pass
+        except Exception as e:
+            logger.error(e)
+            return self.invoke(backup_model_name, prompt, tool, tool_choice, deadline)
+        # No hedge once the deadline has passed.
+        remaining_time(deadline)
+        self.hedged += 1
+        backup = _hedge_pool.submit(
+            self.invoke, backup_model_name, prompt, tool, tool_choice, deadline
+        )
+        pending = {primary, backup}
+        while pending:
+            done, pending = wait(
+                pending, timeout=remaining_time(deadline), return_when=FIRST_COMPLETED
+            )
+            if not done:
+                raise TimeoutError(f"{model_name} and {backup_model_name} timed out")
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        if loser.cancel() and loser is primary:
+                            self.breaker(model_name).release_probe()
+                    if future is backup:
+                        self.hedges_won += 1
+                    return future.result()
+                logger.error(future.exception())
+        return backup.result()
+
+    async def acall(
+        self,
+        model_name,
+        backup_model_name,
+        prompt,
+        tool=None,
+        tool_choice=None,
+        deadline=None,
+    ):
+        if not self.breaker(model_name).allow():
+            logger.info(f"Circuit for {model_name} is open, using {backup_model_name}")
+            return await self.ainvoke(
+                backup_model_name, prompt, tool, tool_choice, deadline
+            )
+        delay = self.hedge_delay(model_name)
+        if delay is None:
+            try:
+                return await self.ainvoke(
+                    model_name, prompt, tool, tool_choice, deadline
+                )
+            except Exception as e:
+                logger.error(e)
+                return await self.ainvoke(
+                    backup_model_name, prompt, tool, tool_choice, deadline
+                )
+
+        primary = asyncio.ensure_future(
+            self.ainvoke(model_name, prompt, tool, tool_choice, deadline)
+        )
+        try:
+            remaining = remaining_time(deadline)
+            return await asyncio.wait_for(
+                asyncio.shield(primary),
+                delay if remaining is None else min(delay, remaining),
+            )
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        except Exception as e:
+            logger.error(e)
+            return await self.ainvoke(
+                backup_model_name, prompt, tool, tool_choice, deadline
+            )
+        pending = {primary}
+        try:
+            # No hedge once the deadline has passed.
+            remaining_time(deadline)
+            self.hedged += 1
+            backup = asyncio.ensure_future(
+                self.ainvoke(backup_model_name, prompt, tool, tool_choice, deadline)
+            )
+            pending.add(backup)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=remaining_time(deadline),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    raise TimeoutError(
+                        f"{model_name} and {backup_model_name} timed out"
+                    )
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.hedges_won += 1
+                        return task.result()
+                    logger.error(task.exception())
+            return backup.result()
+        finally:
+            # The loser is cancelled, which also closes its HTTP request.
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        with self.lock:
+            breakers = dict(self.breakers)
+        return {
+            "hedged": self.hedged,
+            "hedges_won": self.hedges_won,
+            "models": {name: breaker.stats() for name, breaker in breakers.items()},
+        }
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_llm_router():
+    """Process-wide router, configured from `report_config.yaml` when present."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = LLMRouter(
+                report_config_section("LLM_CIRCUIT_BREAKER"),
+                report_config_section("LLM_HEDGING"),
+            )
+        return _router
@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import omegaconf
+
+logger = logging.getLogger("LLMScheduler")
+logger.setLevel(logging.DEBUG)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+REPORT_CONFIG_PATH = "report_config.yaml"
+# Longest sleep of an async waiter between retries; sync waiters are woken on release.
+ASYNC_POLL_INTERVAL = 0.05
+DEFAULT_LIMITS = {"max_concurrency": 0, "rpm": 0, "tpm": 0}
+
+
+def estimate_tokens(prompt):
+    """Rough prompt size; CJK text runs close to one token per character."""
+    return (
+        sum(len(str(getattr(message, "content", message))) for message in prompt) // 2
+    )
+
+
+def remaining_time(deadline):
+    """Seconds left before a `time.monotonic()` deadline, or None without one."""
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("LLM call passed its deadline")
+    return remaining
+
+
+def response_tokens(response):
+    usage = getattr(response, "usage_metadata", None) or {}
+    return usage.get("total_tokens")
+
+
+class TokenBucket(object):
+    """`per_minute` units refilled continuously, at most `per_minute` stored."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        self.refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount
+
+
+class ModelLimiter(object):
+    """Concurrency cap plus requests- and tokens-per-minute buckets for one model.
+
+    Zero disables a limit. Callers wait in `acquire` / `acquire_async` instead
+    of failing, until their deadline if they have one; `stats` reports the
+    queue depth and time spent waiting.
+    """
+
+    def __init__(self, name, max_concurrency=0, rpm=0, tpm=0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def try_acquire(self, tokens):
+        """Take a slot and return 0, or return how long to wait before retrying."""
+        if self.max_concurrency and self.active >= self.max_concurrency:
+            return None
+        waits = [0.0]
+        if self.requests is not None:
+            waits.append(self.requests.wait_time(1))
+        if self.tokens is not None:
+            waits.append(self.tokens.wait_time(tokens))
+        if max(waits) > 0:
+            return max(waits)
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(min(tokens, self.tokens.capacity))
+        self.active += 1
+        return 0.0
+
+    def record_wait(self, seconds):
+        self.completed += 1
+        self.total_wait += seconds
+        self.max_wait = max(self.max_wait, seconds)
+        if seconds > 1:
+            logger.info(f"Waited {seconds:.1f}s for a {self.name} slot")
+
+    def acquire(self, tokens, deadline=None):
+        start_time = time.monotonic()
+        with self.condition:
+            self.waiting += 1
+            try:
+                while True:
+                    wait = self.try_acquire(tokens)
+                    if wait == 0:
+                        break
+                    remaining = remaining_time(deadline)
+                    if remaining is not None:
+                        wait = min(wait, remaining) if wait is not None else remaining
+                    # None: wait for a release to free a concurrency slot.
+                    self.condition.wait(timeout=wait)
+            finally:
+                self.waiting -= 1
+            self.record_wait(time.monotonic() - start_time)
+
+    async def acquire_async(self, tokens, deadline=None):
+        # Calls run on short-lived event loops, so waiters poll a thread-safe
+        # state instead of sharing asyncio primitives.
+        start_time = time.monotonic()
+        with self.condition:
+            self.waiting += 1
+        try:
+            while True:
+                with self.condition:
+                    wait = self.try_acquire(tokens)
+                if wait == 0:
+                    break
+                delay = min(wait or ASYNC_POLL_INTERVAL, ASYNC_POLL_INTERVAL)
+                remaining = remaining_time(deadline)
+                await asyncio.sleep(
+                    delay if remaining is None else min(delay, remaining)
+                )
+        finally:
+            with self.condition:
+                self.waiting -= 1
+        with self.condition:
+            self.record_wait(time.monotonic() - start_time)
+
+    def release(self, estimated_tokens, used_tokens=None):
+        with self.condition:
+            self.active -= 1
+            if self.tokens is not None and used_tokens is not None:
+                # Charge the bucket for what the call actually used.
+                self.tokens.refill()
+                self.tokens.take(
+                    used_tokens - min(estimated_tokens, self.tokens.capacity)
+                )
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "active": self.active,
+                "queued": self.waiting,
+                "completed": self.completed,
+                "mean_wait": (
+                    self.total_wait / self.completed if self.completed else 0.0
+                ),
+                "max_wait": self.max_wait,
+            }
+
+
+class CallSlot(object):
+    """Held while a call runs; `record(response)` reports its real token usage."""
+
+    def __init__(self, estimated_tokens):
+        self.estimated_tokens = estimated_tokens
+        self.used_tokens = None
+
+    def record(self, response):
+        self.used_tokens = response_tokens(response)
+
+
+class LLMScheduler(object):
+    """Per-model limiters configured by `LLM_RATE_LIMITS` in `report_config.yaml`.
+
+    `LLM_RATE_LIMITS` maps model names to `max_concurrency`, `rpm` and `tpm`;
+    a `default` entry applies to models not listed. Without configuration no
+    limit applies.
+    """
+
+    def __init__(self, limits=None):
+        limits = dict(limits or {})
+        self.default = {**DEFAULT_LIMITS, **dict(limits.pop("default", {}))}
+        self.limits = {name: dict(value) for name, value in limits.items()}
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def limiter(self, model_name):
+        with self.lock:
+            if model_name not in self.limiters:
+                settings = {**self.default, **self.limits.get(model_name, {})}
+                self.limiters[model_name] = ModelLimiter(model_name, **settings)
+            return self.limiters[model_name]
+
+    @contextmanager
+    def slot(self, model_name, prompt, deadline=None):
+        """Hold a slot for one call; raises `TimeoutError` if `deadline` passes first."""
+        limiter = self.limiter(model_name)
+        slot = CallSlot(estimate_tokens(prompt))
+        limiter.acquire(slot.estimated_tokens, deadline)
+        try:
+            yield slot
+        finally:
+            limiter.release(slot.estimated_tokens, slot.used_tokens)
+
+    @asynccontextmanager
+    async def aslot(self, model_name, prompt, deadline=None):
+        limiter = self.limiter(model_name)
+        slot = CallSlot(estimate_tokens(prompt))
+        await limiter.acquire_async(slot.estimated_tokens, deadline)
+        try:
+            yield slot
+        finally:
+            limiter.release(slot.estimated_tokens, slot.used_tokens)
+
+    def stats(self):
+        with self.lock:
+            limiters = dict(self.limiters)
+        return {name: limiter.stats() for name, limiter in limiters.items()}
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def report_config_section(key):
+    """Plain-dict `key` section of `report_config.yaml`, or None."""
+    if not os.path.exists(REPORT_CONFIG_PATH):
+        return None
+    section = omegaconf.OmegaConf.load(REPORT_CONFIG_PATH).get(key, None)
+    if section is None:
+        return None
+    return omegaconf.OmegaConf.to_container(section)
+
+
+def get_llm_scheduler():
+    """Process-wide scheduler, configured from `report_config.yaml` when present."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler(report_config_section("LLM_RATE_LIMITS"))
+        return _scheduler
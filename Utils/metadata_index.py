@@ -0,0 +1,179 @@
+import os
+import re
+
+import numpy as np
+
+DATE_PATTERN = re.compile(r"(\d{4})\s*[年/\-.]\s*(\d{1,2})(?:\s*[月/\-.]\s*(\d{1,2}))?")
+COMPACT_DATE_PATTERN = re.compile(r"(?<!\d)(\d{4})(\d{2})(\d{2})(?!\d)")
+
+
+def parse_date_key(date):
+    """Turn a free-form report date into a sortable `YYYYMMDD` int (0 if unknown).
+
+    Handles `2024-03-05`, `2024/3/5`, `2024年3月5日`, `20240305` and
+    month-only dates such as `2024年3月` (treated as the first of the month).
+    """
+    if date is None:
+        return 0
+    date = str(date)
+    match = DATE_PATTERN.search(date) or COMPACT_DATE_PATTERN.search(date)
+    if match is None:
+        return 0
+    year, month, day = match.group(1), match.group(2), match.group(3) or 1
+    year, month, day = int(year), int(month), int(day)
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return 0
+    return year * 10000 + month * 100 + day
+
+
+def normalize_source(path):
+    """Absolute, normalised form of a corpus directory, for comparing paths."""
+    return os.path.abspath(str(path))
+
+
+class MetadataIndex(object):
+    """Columnar index of chunk metadata used to pre-filter retrieval.
+
+    Supported filters (all optional, combined with AND):
+        date_from / date_to: inclusive bounds, any format `parse_date_key` accepts.
+        sources: list of corpus directories (`raw_file_path` entries),
+            compared as absolute paths.
+        targets: list of investment targets / institutions, matched as
+            case-insensitive substrings.
+    Chunks without a known date are dropped by date filters.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.rows = {}
+        self.date_keys = np.zeros(0, dtype=np.int32)
+        self.source_codes = np.zeros(0, dtype=np.int32)
+        self.target_codes = np.zeros(0, dtype=np.int32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.sources = {}
+        self.targets = {}
+
+    @classmethod
+    def from_documents(cls, ids, documents):
+        return cls.from_metadatas(ids, [doc.metadata for doc in documents])
+
+    @classmethod
+    def from_metadatas(cls, ids, metadatas):
+        index = cls()
+        index.add(ids, metadatas)
+        return index
+
+    def __len__(self):
+        return len(self.rows)
+
+    def code(self, vocab, value):
+        if value not in vocab:
+            vocab[value] = len(vocab)
+        return vocab[value]
+
+    def add(self, ids, metadatas):
+        self.remove([doc_id for doc_id in ids if doc_id in self.rows])
+        start = len(self.ids)
+        self.ids.extend(ids)
+        for offset, doc_id in enumerate(ids):
+            self.rows[doc_id] = start + offset
+        self.date_keys = np.concatenate(
+            [
+                self.date_keys,
+                np.array(
+                    [metadata.get("date_key", 0) for metadata in metadatas],
+                    dtype=np.int32,
+                ),
+            ]
+        )
+        self.source_codes = np.concatenate(
+            [
+                self.source_codes,
+                np.array(
+                    [
+                        self.code(self.sources, metadata.get("source", "None"))
+                        for metadata in metadatas
+                    ],
+                    dtype=np.int32,
+                ),
+            ]
+        )
+        self.target_codes = np.concatenate(
+            [
+                self.target_codes,
+                np.array(
+                    [
+                        self.code(self.targets, metadata.get("target", "None"))
+                        for metadata in metadatas
+                    ],
+                    dtype=np.int32,
+                ),
+            ]
+        )
+        self.alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+
+    def remove(self, ids):
+        for doc_id in ids:
+            row = self.rows.pop(doc_id, None)
+            if row is not None:
+                self.alive[row] = False
+
+    def matching_sources(self, sources):
+        sources = {normalize_source(source) for source in sources}
+        return [value for value in self.sources if normalize_source(value) in sources]
+
+    def matching_targets(self, targets):
+        targets = [target.lower() for target in targets]
+        return [
+            value
+            for value in self.targets
+            if any(target in value.lower() for target in targets)
+        ]
+
+    def mask(self, filters):
+        mask = self.alive.copy()
+        date_from = parse_date_key(filters.get("date_from"))
+        date_to = parse_date_key(filters.get("date_to"))
+        if date_from:
+            mask &= self.date_keys >= date_from
+        if date_to:
+            mask &= (self.date_keys <= date_to) & (self.date_keys > 0)
+        if filters.get("sources"):
+            codes = [self.sources[v] for v in self.matching_sources(filters["sources"])]
+            mask &= np.isin(self.source_codes, codes)
+        if filters.get("targets"):
+            codes = [self.targets[v] for v in self.matching_targets(filters["targets"])]
+            mask &= np.isin(self.target_codes, codes)
+        return mask
+
+    def select(self, filters):
+        """Ids of the chunks matching `filters`, or None when nothing is filtered."""
+        if not filters:
+            return None
+        return [self.ids[row] for row in np.flatnonzero(self.mask(filters))]
+
+    def chroma_where(self, filters):
+        """Equivalent Chroma `where` clause, or None when nothing is filtered."""
+        if not filters:
+            return None
+        clauses = []
+        date_from = parse_date_key(filters.get("date_from"))
+        date_to = parse_date_key(filters.get("date_to"))
+        if date_from:
+            clauses.append({"date_key": {"$gte": date_from}})
+        if date_to:
+            clauses.append({"date_key": {"$lte": date_to}})
+            clauses.append({"date_key": {"$gt": 0}})
+        if filters.get("sources"):
+            clauses.append(
+                {"source": {"$in": self.matching_sources(filters["sources"]) or [""]}}
+            )
+        if filters.get("targets"):
+            clauses.append(
+                {"target": {"$in": self.matching_targets(filters["targets"]) or [""]}}
+            )
+        if not clauses:
+            return None
+        if len(clauses) == 1:
+            return clauses[0]
+        return {"$and": clauses}
@@ -7,7 +7,6 @@ from io import StringIO
 from typing import List
 
 import pandas as pd
-from langchain_community.chat_models import ChatLiteLLM
 from langchain_core.messages import HumanMessage, SystemMessage
 from markdown_it import MarkdownIt
 from marker.converters.pdf import PdfConverter
@@ -16,6 +15,8 @@ from marker.output import text_from_rendered
 from langchain_core.tools import tool
 from omegaconf import OmegaConf
 
+from Utils.llm_policy import ainvoke_with_policy
+
 config = OmegaConf.load("report_config.yaml")
 
 
@@ -107,14 +108,14 @@ async def table_summarization(
         + "\n"
         + f"Table: {table}"
     )
-    writer_model = ChatLiteLLM(model=model_name, temperature=0)
-    output = await writer_model.ainvoke(
+    output = await ainvoke_with_policy(
+        model_name,
         [SystemMessage(content=system_instructions.format(table=table))]
         + [
             HumanMessage(
                 content="Please help me to summarize this table into description for doing RAG."
             )
-        ]
+        ],
     )
     return output.content
 
@@ -145,16 +146,16 @@ async def financial_report_metadata_extraction(model_name, file_name, content):
     </Limit>
     """
     content = f"FileName:{file_name}" + "\n" + f"Content: {content}"
-    tool_model = ChatLiteLLM(model=model_name, temperature=0).bind_tools(
-        [financial_metadata_formatter], tool_choice="required"
-    )
-    output = await tool_model.ainvoke(
+    output = await ainvoke_with_policy(
+        model_name,
         [SystemMessage(content=system_instructions.format(content=content))]
         + [
             HumanMessage(
                 content="Please help me to summarize this table into description for doing RAG."
             )
-        ]
+        ],
+        tool=[financial_metadata_formatter],
+        tool_choice="required",
     )
     return output.tool_calls[0]["args"]
 
@@ -181,16 +182,16 @@ async def research_paper_metadata_extraction(model_name, file_name, content):
     </Limit>
     """
     content = f"FileName:{file_name}" + "\n" + f"Content: {content}"
-    tool_model = ChatLiteLLM(model=model_name, temperature=0).bind_tools(
-        [research_metadata_formatter], tool_choice="required"
-    )
-    output = await tool_model.ainvoke(
+    output = await ainvoke_with_policy(
+        model_name,
         [SystemMessage(content=system_instructions.format(content=content))]
         + [
             HumanMessage(
                 content="Please help me to summarize this table into description for doing RAG."
             )
-        ]
+        ],
+        tool=[research_metadata_formatter],
+        tool_choice="required",
     )
     return output.tool_calls[0]["args"]
 
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from copy import deepcopy
+
+from langchain_core.documents import Document
+
+
+def normalize_query(query):
+    """Collapse whitespace so trivially different spellings share a cache entry."""
+    return " ".join(query.split())
+
+
+def cache_key(query, k, filters, index_version):
+    payload = json.dumps(
+        [normalize_query(query), k, filters or {}, index_version],
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RetrievalCache(object):
+    """LRU cache of retrieval results keyed by (query, k, filters, index version).
+
+    Entries live in memory and, when `path` is set, in an SQLite file so they
+    survive restarts. The index version is part of every key, and on-disk
+    entries written for another version are purged by `set_version`, so a
+    re-synced index never serves stale hits. `hits` and `misses` count
+    lookups since the cache was created.
+    """
+
+    def __init__(self, max_entries=1024, path=None, max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.path = path
+        self.version = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, version TEXT NOT NULL, documents TEXT NOT NULL, "
+                "last_used REAL NOT NULL)"
+            )
+            self.conn.commit()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def set_version(self, version):
+        """Switch to a new index version, dropping entries for older ones."""
+        with self.lock:
+            if version == self.version:
+                return
+            self.version = version
+            self.entries.clear()
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM results WHERE version != ?", (version,))
+                self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self.entries),
+            }
+
+    def get_many(self, queries, k, filters=None):
+        """Cached results for each query (None for misses), in order."""
+        keys = [cache_key(query, k, filters, self.version) for query in queries]
+        results = []
+        with self.lock:
+            for key in keys:
+                documents = self.entries.get(key)
+                if documents is None and self.conn is not None:
+                    documents = self.load(key)
+                    if documents is not None:
+                        self.entries[key] = documents
+                if documents is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self.entries.move_to_end(key)
+                # Callers may mutate what they get back, keep the cached copy intact.
+                results.append(deepcopy(documents))
+            self.trim()
+        return results
+
+    def put_many(self, queries, k, filters, results):
+        keys = [cache_key(query, k, filters, self.version) for query in queries]
+        with self.lock:
+            for key, documents in zip(keys, results):
+                self.entries[key] = deepcopy(documents)
+                self.entries.move_to_end(key)
+            self.trim()
+            if self.conn is not None:
+                now = time.time()
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO results (key, version, documents, last_used) VALUES (?, ?, ?, ?)",
+                    [
+                        (key, self.version, self.dump(documents), now)
+                        for key, documents in zip(keys, results)
+                    ],
+                )
+                self.evict()
+                self.conn.commit()
+
+    def trim(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def load(self, key):
+        row = self.conn.execute(
+            "SELECT documents FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self.conn.execute(
+            "UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key)
+        )
+        self.conn.commit()
+        return [
+            Document(item["page_content"], metadata=item["metadata"])
+            for item in json.loads(row[0])
+        ]
+
+    def dump(self, documents):
+        return json.dumps(
+            [
+                {"page_content": doc.page_content, "metadata": doc.metadata}
+                for doc in documents
+            ],
+            ensure_ascii=False,
+        )
+
+    def evict(self):
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM results").fetchone()
+        if count <= self.max_disk_entries:
+            return
+        self.conn.execute(
+            "DELETE FROM results WHERE key IN "
+            "(SELECT key FROM results ORDER BY last_used LIMIT ?)",
+            (count - int(self.max_disk_entries * 0.9),),
+        )
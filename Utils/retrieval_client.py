@@ -0,0 +1,78 @@
+import os
+from typing import List
+
+import requests
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+RETRIEVAL_HOST = os.environ.get("RETRIEVAL_HOST", None)
+RETRIEVAL_PORT = os.environ.get("RETRIEVAL_PORT", "8001")
+
+
+def retrieval_service_url():
+    """Base URL of the shared retrieval service, or None if none is configured."""
+    if not RETRIEVAL_HOST:
+        return None
+    return f"http://{RETRIEVAL_HOST}:{RETRIEVAL_PORT}"
+
+
+def document_to_dict(doc):
+    return {"page_content": doc.page_content, "metadata": doc.metadata}
+
+
+def document_from_dict(item):
+    return Document(item["page_content"], metadata=item["metadata"])
+
+
+class RemoteRetriever(BaseRetriever):
+    """Client for `retrieval_service.py` with the same batch interface as
+    the in-process `ShardedRetriever`."""
+
+    url: str
+    timeout: float = 300
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.batch_get_relevant_documents([query])[0]
+
+    def batch_get_relevant_documents(self, queries, filters=None):
+        if not queries:
+            return []
+        response = requests.post(
+            f"{self.url}/retrieve",
+            json={"queries": list(queries), "filters": filters},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return [
+            [document_from_dict(item) for item in results]
+            for results in response.json()["results"]
+        ]
+
+
+class RemoteDocumentStore(object):
+    """Client for the document store held by `retrieval_service.py`."""
+
+    def __init__(self, url, timeout=300):
+        self.url = url
+        self.timeout = timeout
+
+    def expand_many(self, spans):
+        if not spans:
+            return []
+        response = requests.post(
+            f"{self.url}/expand",
+            json={"spans": [list(span) for span in spans]},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()["contents"]
+
+    def expand(
+        self, doc_id, start, end, forward_capacity=10000, backward_capacity=2500
+    ):
+        return self.expand_many(
+            [(doc_id, start, end, forward_capacity, backward_capacity)]
+        )[0]
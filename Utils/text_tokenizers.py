@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import List
+
+DEFAULT_TOKENIZER = os.environ.get("BM25_TOKENIZER", "cjk_bigram")
+DEFAULT_TOKEN_CACHE_PATH = os.environ.get(
+    "TOKEN_CACHE_PATH", "./token_cache/tokens.sqlite"
+)
+DEFAULT_TOKEN_CACHE_MAX_ENTRIES = int(
+    os.environ.get("TOKEN_CACHE_MAX_ENTRIES", 2000000)
+)
+
+# Han (incl. extension A and compatibility ideographs), kana and hangul.
+CJK_CHARS = "㐀-䶿一-鿿豈-﫿぀-ヿ가-힯"
+TOKEN_PATTERN = re.compile(rf"[{CJK_CHARS}]+|[^\W{CJK_CHARS}]+")
+CJK_RUN = re.compile(rf"[{CJK_CHARS}]+")
+
+
+def whitespace_tokenize(text: str) -> List[str]:
+    """Split on whitespace only (langchain `BM25Retriever` behaviour)."""
+    return text.split()
+
+
+def cjk_bigram_tokenize(text: str) -> List[str]:
+    """Overlapping character bigrams for CJK runs, lowercased words otherwise.
+
+    Needs no dictionary, so it handles Traditional Chinese, names and
+    tickers equally. Text is NFKC-normalised so full-width letters and
+    digits match their ASCII forms.
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(unicodedata.normalize("NFKC", text)):
+        token = match.group()
+        if CJK_RUN.fullmatch(token):
+            if len(token) == 1:
+                tokens.append(token)
+            else:
+                tokens.extend(token[i : i + 2] for i in range(len(token) - 1))
+        else:
+            tokens.append(token.lower())
+    return tokens
+
+
+def jieba_tokenize(text: str) -> List[str]:
+    """Word segmentation with `jieba` (optional dependency), search-engine mode."""
+    try:
+        import jieba
+    except ImportError:
+        raise ImportError(
+            "The jieba BM25 tokenizer needs the jieba package: pip install jieba"
+        )
+    return [
+        token.lower()
+        for token in jieba.lcut_for_search(unicodedata.normalize("NFKC", text))
+        if TOKEN_PATTERN.fullmatch(token)
+    ]
+
+
+TOKENIZERS = {
+    "whitespace": whitespace_tokenize,
+    "cjk_bigram": cjk_bigram_tokenize,
+    "jieba": jieba_tokenize,
+}
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class TokenCache(object):
+    """SQLite store of token streams keyed by (tokenizer, text hash).
+
+    Lets BM25 indexes be rebuilt, and the same pages be indexed by several
+    processes, without segmenting a document twice. Least recently used
+    entries are evicted beyond `max_entries`.
+    """
+
+    def __init__(
+        self, path=DEFAULT_TOKEN_CACHE_PATH, max_entries=DEFAULT_TOKEN_CACHE_MAX_ENTRIES
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tokens ("
+            "tokenizer TEXT NOT NULL, text_hash TEXT NOT NULL, tokens TEXT NOT NULL, "
+            "last_used REAL NOT NULL, PRIMARY KEY (tokenizer, text_hash))"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS tokens_last_used ON tokens (last_used)"
+        )
+        self.conn.commit()
+
+    def get_many(self, tokenizer, hashes, batch_size=500):
+        found = {}
+        now = time.time()
+        with self.lock:
+            for i in range(0, len(hashes), batch_size):
+                batch = hashes[i : i + batch_size]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT text_hash, tokens FROM tokens WHERE tokenizer = ? AND text_hash IN ({placeholders})",
+                    [tokenizer, *batch],
+                ).fetchall()
+                for digest, tokens in rows:
+                    found[digest] = json.loads(tokens)
+                if rows:
+                    self.conn.execute(
+                        f"UPDATE tokens SET last_used = ? WHERE tokenizer = ? AND text_hash IN ({placeholders})",
+                        [now, tokenizer, *batch],
+                    )
+            self.conn.commit()
+        return found
+
+    def put_many(self, tokenizer, items):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO tokens (tokenizer, text_hash, tokens, last_used) VALUES (?, ?, ?, ?)",
+                [
+                    (tokenizer, digest, json.dumps(tokens, ensure_ascii=False), now)
+                    for digest, tokens in items
+                ],
+            )
+            self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM tokens").fetchone()
+        if count <= self.max_entries:
+            return
+        self.conn.execute(
+            "DELETE FROM tokens WHERE rowid IN "
+            "(SELECT rowid FROM tokens ORDER BY last_used LIMIT ?)",
+            (count - int(self.max_entries * 0.9),),
+        )
+
+
+class Tokenizer(object):
+    """Named BM25 tokenizer, optionally backed by a `TokenCache`.
+
+    Calling it tokenizes one text (used for queries); `tokenize_many`
+    consults the cache first and is used when indexing documents.
+    """
+
+    def __init__(self, name=DEFAULT_TOKENIZER, cache=None):
+        if name not in TOKENIZERS:
+            raise ValueError(
+                f"Unknown BM25 tokenizer {name}, use one of {list(TOKENIZERS)}"
+            )
+        self.name = name
+        self.func = TOKENIZERS[name]
+        self.cache = cache
+
+    def __call__(self, text: str) -> List[str]:
+        return self.func(text)
+
+    def tokenize_many(self, texts: List[str]) -> List[List[str]]:
+        if self.cache is None or self.name == "whitespace":
+            return [self.func(text) for text in texts]
+        hashes = [text_hash(text) for text in texts]
+        found = self.cache.get_many(self.name, list(set(hashes)))
+        missing = {}
+        for text, digest in zip(texts, hashes):
+            if digest not in found and digest not in missing:
+                missing[digest] = self.func(text)
+        if missing:
+            self.cache.put_many(self.name, list(missing.items()))
+            found.update(missing)
+        return [found[digest] for digest in hashes]
+
+
+_token_caches = {}
+_token_caches_lock = threading.Lock()
+
+
+def get_tokenizer(name=None, cache_path=None, max_entries=None):
+    """`Tokenizer` for `name`, sharing one token cache per path process-wide.
+
+    Pass `cache_path=""` to disable the cache.
+    """
+    name = name or DEFAULT_TOKENIZER
+    if cache_path == "":
+        return Tokenizer(name)
+    cache_path = cache_path or DEFAULT_TOKEN_CACHE_PATH
+    with _token_caches_lock:
+        if cache_path not in _token_caches:
+            _token_caches[cache_path] = TokenCache(
+                cache_path, max_entries or DEFAULT_TOKEN_CACHE_MAX_ENTRIES
+            )
+        return Tokenizer(name, _token_caches[cache_path])
@@ -1,21 +1,34 @@
+import hashlib
 import json
 import logging
 import math
 import os
+import threading
 from copy import deepcopy
 from typing import List
 
 import requests
-from langchain.retrievers import BM25Retriever
 from langchain.retrievers.ensemble import EnsembleRetriever
 from langchain.schema import Document
 from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.chat_models import ChatLiteLLM
 from tavily import TavilyClient
 
 from State.state import Section
+from Utils.bm25_index import SparseBM25Index, SparseBM25Retriever
+from Utils.document_store import (
+    DocumentStore,
+    expand_context,
+    is_table,
+    load_table,
+    paragraph_boundaries,
+    split_with_offsets,
+)
+from Utils.embedding_cache import get_embeddings
+from Utils.llm_cache import get_llm_cache
+from Utils.llm_policy import get_call_policy
+from Utils.llm_router import get_llm_router
+from Utils.text_tokenizers import get_tokenizer
 
 host = os.environ.get("SEARCH_HOST", None)
 port = os.environ.get("SEARCH_PORT", None)
@@ -37,49 +50,80 @@ logger.addHandler(console_handler)
 # %%
 
 
+def is_cacheable(response, tool_choice, cache_if=None):
+    # A reply missing its required tool call is re-asked, not replayed.
+    if tool_choice == "required" and not response.tool_calls:
+        return False
+    return cache_if is None or cache_if(response)
+
+
+def put_llm_response(
+    cache, key, model_name, answered_by, prompt, tool, tool_choice, response
+):
+    # A backup's answer is cached under the backup's own key, never the primary's.
+    if answered_by != model_name:
+        key = cache.key(answered_by, prompt, tool, tool_choice)
+    cache.put(key, answered_by, response)
+
+
 def call_llm(
-    model_name: str, backup_model_name: str, prompt: List, tool=None, tool_choice=None
+    model_name: str,
+    backup_model_name: str,
+    prompt: List,
+    tool=None,
+    tool_choice=None,
+    role: str = "default",
+    cache_if=None,
 ):
-    try:
-        temperature = 0
-        if model_name == "o3-mini" or model_name == "o4-mini":
-            temperature = 1
-        model = ChatLiteLLM(model=model_name, temperature=temperature)
-        if tool:
-            model = model.bind_tools(tools=tool, tool_choice=tool_choice)
-        response = model.invoke(prompt)
-    except Exception as e:
-        logger.error(e)
-        temperature = 0
-        if model_name == "o3-mini" or model_name == "o4-mini":
-            temperature = 1
-        model = ChatLiteLLM(model=backup_model_name, temperature=temperature)
-        if tool:
-            model = model.bind_tools(tools=tool, tool_choice=tool_choice)
-        response = model.invoke(prompt)
+    """Call `model_name`, falling back to `backup_model_name`.
+
+    `role` selects the timeout and retry policy (`LLM_CALL_POLICY` in
+    `report_config.yaml`). When given, `cache_if(response)` must accept a
+    response for it to be cached, so a caller can re-ask for unusable ones.
+    """
+    # Responses are cached under the primary model even when the backup answered.
+    cache = get_llm_cache()
+    key = cache.key(model_name, prompt, tool, tool_choice)
+    response = cache.get(key)
+    if response is not None:
+        return response
+    router = get_llm_router()
+    answered_by, response = get_call_policy(role).run(
+        lambda deadline: router.call(
+            model_name, backup_model_name, prompt, tool, tool_choice, deadline
+        )
+    )
+    if is_cacheable(response, tool_choice, cache_if):
+        put_llm_response(
+            cache, key, model_name, answered_by, prompt, tool, tool_choice, response
+        )
     return response
 
 
 async def call_llm_async(
-    model_name: str, backup_model_name: str, prompt: List, tool=None, tool_choice=None
+    model_name: str,
+    backup_model_name: str,
+    prompt: List,
+    tool=None,
+    tool_choice=None,
+    role: str = "default",
+    cache_if=None,
 ):
-    try:
-        temperature = 0
-        if model_name == "o3-mini" or model_name == "o4-mini":
-            temperature = 1
-        model = ChatLiteLLM(model=model_name, temperature=temperature)
-        if tool:
-            model = model.bind_tools(tools=tool, tool_choice=tool_choice)
-        response = await model.ainvoke(prompt)
-    except Exception as e:
-        logger.error(e)
-        temperature = 0
-        if model_name == "o3-mini" or model_name == "o4-mini":
-            temperature = 1
-        model = ChatLiteLLM(model=backup_model_name, temperature=temperature)
-        if tool:
-            model = model.bind_tools(tools=tool, tool_choice=tool_choice)
-        response = await model.ainvoke(prompt)
+    cache = get_llm_cache()
+    key = cache.key(model_name, prompt, tool, tool_choice)
+    response = cache.get(key)
+    if response is not None:
+        return response
+    router = get_llm_router()
+    answered_by, response = await get_call_policy(role).arun(
+        lambda deadline: router.acall(
+            model_name, backup_model_name, prompt, tool, tool_choice, deadline
+        )
+    )
+    if is_cacheable(response, tool_choice, cache_if):
+        put_llm_response(
+            cache, key, model_name, answered_by, prompt, tool, tool_choice, response
+        )
     return response
 
 
@@ -89,25 +133,17 @@ def track_expanded_context(
     forward_capacity: int = 10000,
     backward_capacity: int = 2500,
 ):
+    # Prefer DocumentStore.expand with chunk offsets; this searches the whole text.
     start_idx = original_context.find(critical_context)
     if start_idx != -1:
-        end_idx = start_idx + len(critical_context)
-        desired_start_idx = max(0, start_idx - backward_capacity)
-        desired_end_idx = min(len(original_context), end_idx + forward_capacity)
-        start_boundary_pos = original_context.rfind("\n\n", 0, desired_start_idx)
-        if start_boundary_pos == -1:
-            final_start_idx = 0
-        else:
-            final_start_idx = start_boundary_pos + 2
-
-        end_boundary_pos = original_context.find("\n\n", desired_end_idx)
-        if end_boundary_pos == -1:
-            final_end_idx = len(original_context)
-        else:
-            final_end_idx = end_boundary_pos
-        expanded_context = original_context[final_start_idx:final_end_idx]
-
-        return expanded_context
+        return expand_context(
+            original_context,
+            paragraph_boundaries(original_context),
+            start_idx,
+            start_idx + len(critical_context),
+            forward_capacity,
+            backward_capacity,
+        )
 
     else:
         logger.critical("Can not find critical content")
@@ -118,15 +154,28 @@ class ContentExtractor(object):
     def __init__(self, temp_dir=temp_files_path, k=3):
         self.k = k
         self.temp_dir = temp_dir
-        embeddings = HuggingFaceEmbeddings(model_name="BAAI/bge-m3")
-        self.docs = [Document("None", metadata={"path": "None", "content": "None"})]
+        # Searches run from several threads; updates and queries take turns.
+        self.lock = threading.RLock()
+        embeddings = get_embeddings("BAAI/bge-m3")
+        self.document_store = DocumentStore()
+        self.document_store.add_text("None", "None")
+        self.docs = [
+            Document(
+                "None",
+                metadata={"path": "None", "doc_id": "None", "start": 0, "end": 4},
+            )
+        ]
         self.vectorstore = Chroma.from_documents(
             documents=self.docs,
             collection_name="temp_data",
             embedding=embeddings,
         )
-        self.bm25_retriever = BM25Retriever.from_documents(self.docs)
-        self.bm25_retriever.k = self.k
+        self.bm25_retriever = SparseBM25Retriever.from_documents(
+            self.docs,
+            ids=["None"],
+            index=SparseBM25Index(preprocess_func=get_tokenizer()),
+            k=self.k,
+        )
         self.hybrid_retriever = EnsembleRetriever(
             retrievers=[
                 self.vectorstore.as_retriever(search_kwargs={"k": self.k}),
@@ -140,44 +189,57 @@ class ContentExtractor(object):
             chunk_size=300,
             chunk_overlap=50,
             separators=["\n\n\n\n", "\n\n\n", "\n\n", "\n", ""],
+            add_start_index=True,
         )
         new_docs = []
         for file in files:
             with open(file, "r") as f:
                 texts = f.read()
             name = file.split("/")[-1].replace(".txt", "")
-            new_docs.append(Document(texts, metadata={"path": name, "content": texts}))
-        new_docs = text_splitter.split_documents(new_docs)
+            doc_id = hashlib.sha1(texts.encode("utf-8")).hexdigest()
+            if doc_id in self.document_store:
+                continue
+            self.document_store.add_text(doc_id, texts)
+            new_docs.extend(
+                split_with_offsets(
+                    text_splitter, Document(texts, metadata={"path": name}), doc_id
+                )
+            )
         return new_docs
 
     def update(self, files):
-        new_docs = self.update_new_docs(files)
-        self.vectorstore.add_documents(new_docs)
-        self.docs.extend(new_docs)
-
-        self.bm25_retriever = BM25Retriever.from_documents(self.docs)
-        self.bm25_retriever.k = self.k
-        self.hybrid_retriever = EnsembleRetriever(
-            retrievers=[
-                self.vectorstore.as_retriever(search_kwargs={"k": self.k}),
-                self.bm25_retriever,
-            ],
-            weights=[0.7, 0.3],
-        )
+        with self.lock:
+            new_docs = self.update_new_docs(files)
+            if not new_docs:
+                return
+            ids = [
+                f"{doc.metadata['doc_id']}-{doc.metadata['start']}" for doc in new_docs
+            ]
+            self.vectorstore.add_documents(new_docs, ids=ids)
+            self.docs.extend(new_docs)
+            # Appending keeps the existing postings; no re-tokenisation of old pages.
+            self.bm25_retriever.add_documents(new_docs, ids=ids)
 
     def query(self, q):
         seen, info = set(), []
-        results = self.hybrid_retriever.get_relevant_documents(q)
+        with self.lock:
+            results = self.hybrid_retriever.get_relevant_documents(q)
         for res in results:
             if res.page_content in seen:
                 continue
             seen.add(res.page_content)
-            expanded_content = track_expanded_context(
-                res.metadata["content"], res.page_content, 1500, 500
+            expanded_content = self.document_store.expand(
+                res.metadata["doc_id"],
+                res.metadata["start"],
+                res.metadata["end"],
+                1500,
+                500,
             )
             return_res = deepcopy(res)
-            return_res.metadata["content"] = expanded_content
-            info.append(res)
+            return_res.metadata["content"] = (
+                res.page_content if expanded_content is None else expanded_content
+            )
+            info.append(return_res)
         return info
 
 
@@ -236,25 +298,35 @@ def format_search_results(results: List[Document], char_limit: int = 500):
 def format_search_results_with_metadata(results: List[Document]):
     formatted_text = "Sources:\n\n"
     for doc in results:
-        if "table" in doc.metadata:
+        if is_table(doc.metadata):
+            # Table bodies are stored out of line; read this block only now.
+            table = load_table(doc.metadata) or {
+                # The file is gone or changed: show the chunk as it was indexed.
+                "context_heading": "None",
+                "context_paragraph": "None",
+                "table": doc.page_content,
+            }
             formatted_text += f"Source {doc.metadata['path']}:\n===\n"
             formatted_text += "Report Date:\n"
             formatted_text += doc.metadata["date"]
             formatted_text += "Context Heading:\n"
-            formatted_text += doc.metadata["context_heading"]
+            formatted_text += table["context_heading"]
             formatted_text += "Context Paragraph:\n"
-            formatted_text += doc.metadata["context_paragraph"]
+            formatted_text += table["context_paragraph"]
             formatted_text += "Summary:\n"
             formatted_text += doc.metadata["summary"]
-            formatted_text += "Table Content:\n"
-            formatted_text += doc.metadata["table"]
+            if doc.metadata.get("table_blocks", 1) > 1:
+                formatted_text += f"Table Content (rows {doc.metadata['table_row_start'] + 1}-{doc.metadata['table_row_end']}):\n"
+            else:
+                formatted_text += "Table Content:\n"
+            formatted_text += table["table"]
 
         elif "content" in doc.metadata:
             formatted_text += f"Source {doc.metadata['path']}:\n===\n"
             formatted_text += "Report Date:\n"
             formatted_text += doc.metadata["date"]
             formatted_text += "Source Content:\n"
-            formatted_text += doc.metadata["content"]
+            formatted_text += doc.metadata["content"] or doc.page_content
 
     return formatted_text
 
@@ -273,7 +345,17 @@ def tavily_search(search_queries, include_raw_content: bool):
     return search_docs
 
 
-content_extractor = ContentExtractor()
+_content_extractor = None
+_content_extractor_lock = threading.Lock()
+
+
+def get_content_extractor():
+    global _content_extractor
+    if _content_extractor is None:
+        with _content_extractor_lock:
+            if _content_extractor is None:
+                _content_extractor = ContentExtractor()
+    return _content_extractor
 
 
 def selenium_api_search(search_queries, include_raw_content: bool):
@@ -307,6 +389,7 @@ def selenium_api_search(search_queries, include_raw_content: bool):
                     logger.error(e)
 
             if len(large_files) > 0:
+                content_extractor = get_content_extractor()
                 content_extractor.update(large_files)
                 search_results = content_extractor.query(query)
                 for idx, results in enumerate(search_results):
@@ -0,0 +1,525 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Iterable, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger("VectorIndex")
+logger.setLevel(logging.DEBUG)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+# Retrain IVF whenever the row count has moved by this factor since the last
+# training; a sync that finishes retrains with the tighter `IVF_SYNC_GROWTH`.
+IVF_RETRAIN_GROWTH = 2.0
+IVF_SYNC_GROWTH = 1.25
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def merge_top_k(best_scores, best_rows, scores, rows, k):
+    """Merge a block of `(num_queries, block)` scores into running top-k arrays."""
+    rows = np.broadcast_to(rows, scores.shape)
+    scores = np.concatenate([best_scores, scores], axis=1)
+    rows = np.concatenate([best_rows, rows], axis=1)
+    if scores.shape[1] > k:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, top, axis=1)
+        rows = np.take_along_axis(rows, top, axis=1)
+    return scores, rows
+
+
+class MemmapVectorStore(VectorStore):
+    """Read-mostly vector store on memory-mapped files.
+
+    Embeddings are L2-normalised and stored as float16 (or int8 with a
+    per-vector scale) in `vectors.bin`; search is cosine similarity by NumPy
+    matmul over the mapped file, so several processes on one host share the
+    OS page cache instead of each holding a copy. With `nlist > 0` an
+    IVF coarse quantiser is trained once enough vectors exist, retrained as
+    the collection grows, and queries only scan the `nprobe` closest lists. Documents and ids live in
+    `docs.sqlite` and are only materialised for the final hits.
+    """
+
+    block_size = 16384
+
+    def __init__(
+        self,
+        path: str,
+        embedding_function: Embeddings,
+        dtype: str = "float16",
+        nlist: int = 0,
+        nprobe: int = 8,
+    ):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported vector dtype {dtype}")
+        self.path = path
+        self.embedding_function = embedding_function
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+        self.db = sqlite3.connect(
+            os.path.join(path, "docs.sqlite"), timeout=30, check_same_thread=False
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            "row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, "
+            "page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self.db.commit()
+
+        self.meta_path = os.path.join(path, "meta.json")
+        meta = {
+            "dtype": dtype,
+            "dim": None,
+            "count": 0,
+            "capacity": 0,
+            "trained_rows": 0,
+        }
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        self.dtype = meta["dtype"]
+        self.dim = meta["dim"]
+        self.count = meta["count"]
+        self.capacity = meta["capacity"]
+        self.trained_rows = meta.get("trained_rows", 0)
+        self.centroids = None
+        if os.path.exists(os.path.join(path, "centroids.npy")):
+            self.centroids = np.load(os.path.join(path, "centroids.npy"))
+        self.vectors = self.scales = self.lists = None
+        self.open_arrays()
+
+        self.rows = {}
+        self.alive = np.zeros(self.capacity, dtype=bool)
+        # Rows past `count` were written to SQLite after a crash mid-append.
+        self.db.execute("DELETE FROM docs WHERE row >= ?", (self.count,))
+        self.db.commit()
+        for row, doc_id in self.db.execute("SELECT row, id FROM docs"):
+            self.rows[doc_id] = row
+            self.alive[row] = True
+        self._list_index = None
+        self._row_ids = None
+
+    # -- storage ---------------------------------------------------------
+    def array_path(self, name):
+        return os.path.join(self.path, f"{name}.bin")
+
+    def open_arrays(self):
+        if self.capacity == 0:
+            return
+        self.vectors = np.memmap(
+            self.array_path("vectors"),
+            dtype=self.dtype,
+            mode="r+",
+            shape=(self.capacity, self.dim),
+        )
+        self.scales = np.memmap(
+            self.array_path("scales"),
+            dtype=np.float32,
+            mode="r+",
+            shape=(self.capacity,),
+        )
+        self.lists = np.memmap(
+            self.array_path("lists"), dtype=np.int32, mode="r+", shape=(self.capacity,)
+        )
+
+    def reserve(self, needed):
+        if needed <= self.capacity:
+            return
+        capacity = max(1024, self.capacity * 2, needed)
+        self.flush_arrays()
+        self.vectors = self.scales = self.lists = None
+        itemsize = np.dtype(self.dtype).itemsize
+        for name, row_bytes in (
+            ("vectors", itemsize * self.dim),
+            ("scales", 4),
+            ("lists", 4),
+        ):
+            with open(self.array_path(name), "ab") as f:
+                f.truncate(capacity * row_bytes)
+        self.capacity = capacity
+        self.alive = np.concatenate(
+            [self.alive, np.zeros(capacity - len(self.alive), dtype=bool)]
+        )
+        self.open_arrays()
+
+    def flush_arrays(self):
+        for array in (self.vectors, self.scales, self.lists):
+            if array is not None:
+                array.flush()
+
+    def save_meta(self):
+        self.flush_arrays()
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "dtype": self.dtype,
+                    "dim": self.dim,
+                    "count": self.count,
+                    "capacity": self.capacity,
+                    "trained_rows": self.trained_rows,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.meta_path)
+
+    def encode(self, vectors):
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales = np.maximum(scales, 1e-12)
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+
+    # -- VectorStore API -------------------------------------------------
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self.embedding_function
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        if ids is None:
+            ids = [os.urandom(16).hex() for _ in texts]
+        vectors = normalize(self.embedding_function.embed_documents(texts))
+        self.add_vectors(ids, vectors, texts, metadatas)
+        return ids
+
+    def add_vectors(self, ids, vectors, texts, metadatas):
+        with self.lock:
+            self.delete([doc_id for doc_id in ids if doc_id in self.rows])
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            start = self.count
+            self.reserve(start + len(ids))
+            encoded, scales = self.encode(vectors)
+            self.vectors[start : start + len(ids)] = encoded
+            self.scales[start : start + len(ids)] = scales
+            self.lists[start : start + len(ids)] = self.assign_lists(vectors)
+            self.count = start + len(ids)
+            self.save_meta()
+            self.db.executemany(
+                "INSERT INTO docs (row, id, page_content, metadata) VALUES (?, ?, ?, ?)",
+                [
+                    (start + offset, doc_id, text, json.dumps(metadata))
+                    for offset, (doc_id, text, metadata) in enumerate(
+                        zip(ids, texts, metadatas)
+                    )
+                ],
+            )
+            self.db.commit()
+            for offset, doc_id in enumerate(ids):
+                self.rows[doc_id] = start + offset
+            self.alive[start : start + len(ids)] = True
+            self._list_index = None
+            self._row_ids = None
+            self.maybe_train_ivf()
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return True
+        with self.lock:
+            rows = [self.rows.pop(doc_id) for doc_id in ids if doc_id in self.rows]
+            if not rows:
+                return True
+            self.alive[rows] = False
+            self.db.executemany(
+                "DELETE FROM docs WHERE row = ?", [(row,) for row in rows]
+            )
+            self.db.commit()
+            if self.count - len(self.rows) > max(1024, self.count // 4):
+                self.compact()
+        return True
+
+    def delete_collection(self):
+        with self.lock:
+            self.db.execute("DELETE FROM docs")
+            self.db.commit()
+            self.rows = {}
+            self.alive[:] = False
+            self.count = 0
+            self.centroids = None
+            self.trained_rows = 0
+            if os.path.exists(os.path.join(self.path, "centroids.npy")):
+                os.remove(os.path.join(self.path, "centroids.npy"))
+            self._list_index = None
+            self._row_ids = None
+            self.save_meta()
+
+    def get(self, ids=None, include=None, **kwargs):
+        """Chroma-style `get` returning ids, documents and metadatas.
+
+        Like Chroma, `documents` is None unless `include` asks for it (the
+        default includes both).
+        """
+        include = include or ["documents", "metadatas"]
+        with_documents = "documents" in include
+        query = "SELECT id, metadata"
+        if with_documents:
+            query += ", page_content"
+        query += " FROM docs"
+        params = []
+        if ids is not None:
+            query += f" WHERE id IN ({','.join('?' * len(ids))})"
+            params = list(ids)
+        with self.lock:
+            rows = self.db.execute(query + " ORDER BY row", params).fetchall()
+        return {
+            "ids": [row[0] for row in rows],
+            "documents": [row[2] for row in rows] if with_documents else None,
+            "metadatas": [json.loads(row[1]) for row in rows],
+        }
+
+    def compact(self):
+        """Rewrite the arrays without deleted rows."""
+        with self.lock:
+            keep = np.flatnonzero(self.alive[: self.count])
+            vectors = np.array(self.vectors[keep])
+            scales = np.array(self.scales[keep])
+            lists = np.array(self.lists[keep])
+            self.vectors[: len(keep)] = vectors
+            self.scales[: len(keep)] = scales
+            self.lists[: len(keep)] = lists
+            new_rows = {int(old): new for new, old in enumerate(keep)}
+            # Shift to negative rows first so the primary key never collides.
+            self.db.executemany(
+                "UPDATE docs SET row = ? WHERE row = ?",
+                [(-new - 1, old) for old, new in new_rows.items()],
+            )
+            self.db.execute("UPDATE docs SET row = -row - 1")
+            self.db.commit()
+            self.rows = {doc_id: new_rows[row] for doc_id, row in self.rows.items()}
+            self.alive[:] = False
+            self.alive[: len(keep)] = True
+            self.count = len(keep)
+            self._list_index = None
+            self._row_ids = None
+            self.save_meta()
+            logger.info(f"Compacted vector index to {self.count} rows")
+
+    # -- IVF -------------------------------------------------------------
+    def assign_lists(self, vectors):
+        if self.centroids is None:
+            return np.full(len(vectors), -1, dtype=np.int32)
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def maybe_train_ivf(self, growth=IVF_RETRAIN_GROWTH):
+        """Train IVF once `nlist * 39` rows exist, and retrain once the row
+        count has grown or shrunk by more than `growth` times since the last
+        training, so the lists keep following the collection. Returns
+        whether it trained."""
+        with self.lock:
+            num_rows = len(self.rows)
+            if not self.nlist or num_rows < self.nlist * 39:
+                return False
+            if (
+                self.centroids is not None
+                and self.trained_rows / growth <= num_rows <= self.trained_rows * growth
+            ):
+                return False
+            self.train_ivf()
+            return True
+
+    def train_ivf(self, iterations=10, sample_per_list=256, seed=0):
+        """Train `nlist` spherical k-means centroids and assign every row."""
+        with self.lock:
+            rng = np.random.default_rng(seed)
+            live = np.flatnonzero(self.alive[: self.count])
+            sample = rng.choice(
+                live, size=min(len(live), self.nlist * sample_per_list), replace=False
+            )
+            sample = self.decode(np.sort(sample))
+            centroids = sample[rng.choice(len(sample), self.nlist, replace=False)]
+            for _ in range(iterations):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                for idx in range(self.nlist):
+                    members = sample[assignment == idx]
+                    if len(members):
+                        centroids[idx] = members.mean(axis=0)
+                centroids = normalize(centroids)
+            self.centroids = centroids.astype(np.float32)
+            self.trained_rows = len(live)
+            np.save(os.path.join(self.path, "centroids.npy"), self.centroids)
+            for start in range(0, self.count, self.block_size):
+                end = min(start + self.block_size, self.count)
+                self.lists[start:end] = self.assign_lists(
+                    self.decode(np.arange(start, end))
+                )
+            self._list_index = None
+            self._row_ids = None
+            self.save_meta()
+            logger.info(
+                f"Trained IVF index with {self.nlist} lists over {len(live)} rows"
+            )
+
+    def list_index(self):
+        if self._list_index is None:
+            lists = np.asarray(self.lists[: self.count])
+            order = np.argsort(lists, kind="stable")
+            offsets = np.searchsorted(lists[order], np.arange(self.nlist + 1))
+            self._list_index = (order, offsets)
+        return self._list_index
+
+    def row_ids(self):
+        """Inverse of `rows`, rebuilt lazily after the row layout changes."""
+        if self._row_ids is None:
+            self._row_ids = {row: doc_id for doc_id, row in self.rows.items()}
+        return self._row_ids
+
+    # -- search ----------------------------------------------------------
+    def decode(self, rows):
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.dtype == "int8":
+            vectors *= np.asarray(self.scales[rows])[:, None]
+        return vectors
+
+    def search_rows(self, rows, queries, k):
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(rows), self.block_size):
+            block = rows[start : start + self.block_size]
+            block = block[self.alive[block]]
+            if len(block) == 0:
+                continue
+            scores = queries @ self.decode(block).T
+            best_scores, best_rows = merge_top_k(
+                best_scores, best_rows, scores, block, k
+            )
+        return best_scores, best_rows
+
+    def search_vectors(self, query_vectors, k, ids=None):
+        """Top-k `(row, score)` pairs for each query vector.
+
+        With `ids`, only those rows are scanned (exactly, bypassing IVF).
+        """
+        queries = normalize(query_vectors)
+        with self.lock:
+            if not self.rows:
+                return [[] for _ in queries]
+            if ids is not None:
+                rows = np.array(
+                    sorted(self.rows[doc_id] for doc_id in ids if doc_id in self.rows),
+                    dtype=np.int64,
+                )
+                scores, rows = self.search_rows(rows, queries, k)
+                batches = [(scores[i], rows[i]) for i in range(len(queries))]
+            elif self.centroids is None:
+                scores, rows = self.search_rows(np.arange(self.count), queries, k)
+                batches = [(scores[i], rows[i]) for i in range(len(queries))]
+            else:
+                order, offsets = self.list_index()
+                probes = np.argsort(-(queries @ self.centroids.T), axis=1)[
+                    :, : self.nprobe
+                ]
+                batches = []
+                for query, probe in zip(queries, probes):
+                    candidates = np.concatenate(
+                        [order[offsets[idx] : offsets[idx + 1]] for idx in probe]
+                    )
+                    scores, rows = self.search_rows(candidates, query[None, :], k)
+                    batches.append((scores[0], rows[0]))
+        results = []
+        for scores, rows in batches:
+            top = np.argsort(-scores, kind="stable")[:k]
+            results.append([(int(rows[i]), float(scores[i])) for i in top])
+        return results
+
+    def documents_for_rows(self, rows):
+        if not rows:
+            return {}
+        with self.lock:
+            found = self.db.execute(
+                f"SELECT row, page_content, metadata FROM docs WHERE row IN ({','.join('?' * len(rows))})",
+                list(rows),
+            ).fetchall()
+        return {
+            row: Document(page_content, metadata=json.loads(metadata))
+            for row, page_content, metadata in found
+        }
+
+    def batch_similarity_search_with_score_by_vector(self, embeddings, k=4, ids=None):
+        hits = self.search_vectors(embeddings, k, ids=ids)
+        docs = self.documents_for_rows(
+            sorted({row for query_hits in hits for row, _ in query_hits})
+        )
+        return [
+            [(docs[row], score) for row, score in query_hits if row in docs]
+            for query_hits in hits
+        ]
+
+    def batch_search_ids(self, embeddings, k=4, ids=None):
+        """Top-k `(doc_id, score)` pairs per query, without loading documents."""
+        hits = self.search_vectors(embeddings, k, ids=ids)
+        with self.lock:
+            row_ids = self.row_ids()
+        return [
+            [(row_ids[row], score) for row, score in query_hits if row in row_ids]
+            for query_hits in hits
+        ]
+
+    def batch_similarity_search_by_vector(self, embeddings, k=4, ids=None):
+        return [
+            [doc for doc, _ in hits]
+            for hits in self.batch_similarity_search_with_score_by_vector(
+                embeddings, k, ids=ids
+            )
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[tuple]:
+        embedding = self.embedding_function.embed_query(query)
+        return self.batch_similarity_search_with_score_by_vector([embedding], k)[0]
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return self.batch_similarity_search_by_vector([embedding], k)[0]
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        path: str = "./memmap_index",
+        **kwargs: Any,
+    ) -> "MemmapVectorStore":
+        store = cls(path, embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -33,6 +33,7 @@ from Utils.utils import (
     selenium_api_search,
     web_search_deduplicate_and_format_sources,
 )
+from Utils.llm_policy import get_call_policy, is_retryable
 from langgraph.types import Command
 
 # Setup logger
@@ -61,6 +62,7 @@ def queries_rewriter(queries: List[str]) -> List[str]:
         + [HumanMessage(content="Refine search queries on the provided queries.")],
         tool=[queries_formatter],
         tool_choice="required",
+        role="query",
     )
     queries = results.tool_calls[0]["args"]["queries"]
     return queries
@@ -78,32 +80,49 @@ class AgenticSearchState(TypedDict):
     url_memo: Set[str]
 
 
+def has_score(response):
+    return bool(response.tool_calls) and "score" in response.tool_calls[0]["args"]
+
+
 async def check_search_quality_async(query: str, document: str) -> int:
-    score = None
-    retry = 0
-    while retry < 5 and score is None:
-        system_instruction = results_filter_instruction.format(
-            query=query, document=document
-        )
-        results = await call_llm_async(
-            LIGHT_MODEL_NAME,
-            BACKUP_LIGHT_MODEL_NAME,
-            prompt=[SystemMessage(content=system_instruction)]
-            + [
-                HumanMessage(
-                    content="Generate the score of document on the provided query."
-                )
-            ],
-            tool=[quality_formatter],
-            tool_choice="required",
-        )
+    # Transport errors are retried inside call_llm_async; this loop only
+    # re-asks when the reply has no usable score, with the same backoff.
+    policy = get_call_policy("light")
+    system_instruction = results_filter_instruction.format(
+        query=query, document=document
+    )
+    for attempt in range(policy.max_attempts):
+        try:
+            results = await call_llm_async(
+                LIGHT_MODEL_NAME,
+                BACKUP_LIGHT_MODEL_NAME,
+                prompt=[SystemMessage(content=system_instruction)]
+                + [
+                    HumanMessage(
+                        content="Generate the score of document on the provided query."
+                    )
+                ],
+                tool=[quality_formatter],
+                tool_choice="required",
+                role="light",
+                # Otherwise the re-ask would be answered with the cached reply.
+                cache_if=has_score,
+            )
+        except Exception as e:
+            # A document whose transient failures outlasted the retries is
+            # dropped instead of failing the whole batch; anything else,
+            # including a replay cache miss, is raised.
+            if not is_retryable(e):
+                raise
+            logger.warning(f"Failed to score document for query: {query}: {e}")
+            return None
         try:
-            score = results.tool_calls[0]["args"]["score"]
+            return results.tool_calls[0]["args"]["score"]
         except (IndexError, KeyError):
             logger.warning(f"Failed to get score from tool call for query: {query}")
-            retry += 1
+            await asyncio.sleep(policy.backoff(attempt))
 
-    return score
+    return None
 
 
 def get_searching_budget(state: AgenticSearchState):
@@ -231,6 +250,7 @@ def compress_raw_content(state: AgenticSearchState):
                 ],
                 tool=[summary_formatter],
                 tool_choice="required",
+                role="compress",
             )
             logger.info(f"{len(compressed_result.tool_calls)} tool calls in compress")
             summary_content = ""
@@ -272,6 +292,7 @@ def check_searching_results(state: AgenticSearchState):
         ],
         tool=[searching_grader_formatter],
         tool_choice="required",
+        role="query",
     )
     feedback = feedback.tool_calls[0]["args"]
     if (
@@ -0,0 +1,341 @@
+"""Benchmark the local hybrid retriever on a synthetic corpus.
+
+Builds a sharded index with `retriever.build_hybrid_retriever` over generated
+preprocessed JSON files and reports build time, peak RSS, single-query and
+batched latency percentiles and recall@k against exact brute-force search,
+as JSON. Runs on CPU with a deterministic hash embedder, so results are
+comparable between machines and commits:
+
+    python benchmark_retriever.py --num-docs 2000 --output benchmark.json
+"""
+
+import os
+
+# CPU only: hide GPUs before torch is imported through retriever.
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+import argparse
+import hashlib
+import json
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+import omegaconf
+from langchain_core.embeddings import Embeddings
+
+from retriever import build_hybrid_retriever
+from Utils.embedding_cache import register_embeddings
+from Utils.hybrid_retriever import fuse
+from Utils.text_tokenizers import cjk_bigram_tokenize
+
+HASH_MODEL_NAME = "benchmark-hash-embedding"
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic feature-hashing embedder: token counts hashed into
+    `dim` signed buckets, L2-normalised."""
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in cjk_bigram_tokenize(text):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed(text)
+
+
+# =========================
+# Synthetic corpus
+# =========================
+CJK_CHARS = "的一是在不了有和人這中大為上個國我以要他時來用們生到作地於出就分對成會可主發年動同工也能下過子說產種面而方後多定行學法所民得經十三之進著等部度家電力裡如水化高自二理起小物現實加量都兩體制機當使點從業本去把性好應開它合還因由其些然前外天政四日那社義事平形相全表間樣與關各重新線內數正心反你明看原又麼利比或但質氣第向道命此變條只沒結解問意建月公無系軍很情者最立代想已通並提直題黨程展五果料象員革位入常文總次品式活設及管特件長求老頭基資邊流路級少圖山統接知較將組見計別她手角期根論運農指幾九區強放決西被幹做必戰先回則任取據處府研"
+
+
+def make_vocabulary(rng, size):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(CJK_CHARS) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_corpus(directories, num_docs, doc_chars, seed):
+    """Write `num_docs` preprocessed JSON files spread over `directories`.
+
+    Every document mixes a few topic words with common filler, so BM25 and
+    the hash embedder both have signal to work with.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng, 5000)
+    common = vocabulary[:200]
+    documents = []
+    for idx in range(num_docs):
+        topic = rng.sample(vocabulary[200:], 8)
+        paragraphs, length = [], 0
+        while length < doc_chars:
+            sentence = "".join(
+                rng.choice(topic) if rng.random() < 0.35 else rng.choice(common)
+                for _ in range(rng.randint(8, 20))
+            )
+            paragraphs.append(sentence + "。")
+            length += len(sentence) + 1
+            if rng.random() < 0.2:
+                paragraphs.append("\n\n")
+        text = "".join(paragraphs)
+        directory = directories[idx % len(directories)]
+        path = os.path.join(
+            directory, f"doc_{idx:06d}-2024{rng.randint(1, 12):02d}01.json"
+        )
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "date": f"2024-{rng.randint(1, 12):02d}-01",
+                    "investment_target": rng.choice(
+                        ["台積電", "聯發科", "鴻海", "None"]
+                    ),
+                    "full_content": text,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        documents.append(text)
+    return documents
+
+
+def make_queries(documents, num_queries, seed):
+    """Queries are random spans of corpus documents, so each has a known source."""
+    rng = random.Random(seed + 1)
+    queries = []
+    for _ in range(num_queries):
+        text = rng.choice(documents)
+        start = rng.randint(0, max(0, len(text) - 40))
+        queries.append(text[start : start + rng.randint(10, 40)].strip("。\n"))
+    return queries
+
+
+# =========================
+# Measurements
+# =========================
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished children (MB)."""
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000
+    return {
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p90_ms": float(np.percentile(samples, 90)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "mean_ms": float(samples.mean()),
+    }
+
+
+def measure_latency(retriever, queries, batch_size):
+    single = []
+    for query in queries:
+        start = time.perf_counter()
+        retriever.search([query])
+        single.append(time.perf_counter() - start)
+    batched = []
+    for i in range(0, len(queries), batch_size):
+        batch = queries[i : i + batch_size]
+        start = time.perf_counter()
+        retriever.search(batch)
+        batched.append(time.perf_counter() - start)
+    total = sum(batched)
+    return {
+        "single_query": percentiles(single),
+        "batched": {
+            "batch_size": batch_size,
+            **percentiles(batched),
+            "queries_per_second": len(queries) / total if total else 0.0,
+        },
+    }
+
+
+def chunk_key(doc):
+    """Identify a chunk by value: shards read documents on lookup, so the
+    same chunk comes back as a different object each time."""
+    return doc.page_content, json.dumps(doc.metadata, sort_keys=True)
+
+
+def exact_dense(embedder, shard, queries, depth):
+    """Brute-force cosine top-`depth` `(id, score)` lists over a shard."""
+    items = shard.bm25_retriever.docs.items()
+    if not items:
+        return [[] for _ in queries]
+    ids = [doc_id for doc_id, _ in items]
+    matrix = np.asarray(
+        embedder.embed_documents([doc.page_content for _, doc in items]),
+        dtype=np.float32,
+    )
+    scores = np.asarray(embedder.embed_documents(queries), dtype=np.float32) @ matrix.T
+    results = []
+    for row in scores:
+        top = np.argsort(-row, kind="stable")[:depth]
+        results.append([(ids[idx], float(row[idx])) for idx in top])
+    return results
+
+
+def measure_recall(embedder, retriever, queries, k):
+    """Recall of the dense side against brute force, and of the final hybrid
+    top-k against the same fusion computed from exact dense hits."""
+    dense_recall, hybrid_recall = [], []
+    exact_hybrid = [[] for _ in queries]
+    for shard in retriever.shards.values():
+        depth = shard.dense_candidates
+        exact = exact_dense(embedder, shard, queries, depth)
+        approx = shard.dense_search(queries)
+        for truth, found in zip(exact, approx):
+            if truth:
+                truth_ids = {doc_id for doc_id, _ in truth}
+                dense_recall.append(
+                    len(truth_ids & {doc_id for doc_id, _ in found}) / len(truth_ids)
+                )
+        bm25 = shard.bm25_retriever.index.search(queries, shard.bm25_candidates)
+        for idx, (truth, keyword) in enumerate(zip(exact, bm25)):
+            codes, scores = fuse(
+                [shard.codes(truth), shard.codes(keyword)],
+                shard.weights,
+                shard.fusion,
+                shard.rrf_c,
+            )
+            ids = shard.bm25_retriever.index.ids
+            exact_hybrid[idx].extend(
+                (ids[code], float(score)) for code, score in zip(codes[:k], scores[:k])
+            )
+    doc_ids = {
+        chunk_key(doc): doc_id
+        for shard in retriever.shards.values()
+        for doc_id, doc in shard.bm25_retriever.docs.items()
+    }
+    for truth, found in zip(exact_hybrid, retriever.search(queries)):
+        truth = sorted(truth, key=lambda hit: hit[1], reverse=True)[:k]
+        if truth:
+            truth_ids = {doc_id for doc_id, _ in truth}
+            found_ids = {doc_ids.get(chunk_key(doc)) for doc in found}
+            hybrid_recall.append(len(truth_ids & found_ids) / len(truth_ids))
+    return {
+        f"dense_recall_at_{k}": float(np.mean(dense_recall)) if dense_recall else None,
+        f"hybrid_recall_at_{k}": (
+            float(np.mean(hybrid_recall)) if hybrid_recall else None
+        ),
+    }
+
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="retriever-benchmark-")
+    corpus_dir = os.path.join(workdir, "corpus")
+    directories = [os.path.join(corpus_dir, f"shard_{i}") for i in range(args.shards)]
+    for directory in directories:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+    shutil.rmtree(os.path.join(workdir, "index"), ignore_errors=True)
+
+    embedder = HashEmbeddings(args.dim)
+    register_embeddings(HASH_MODEL_NAME, embedder, backend="torch")
+    documents = make_corpus(directories, args.num_docs, args.doc_chars, args.seed)
+    queries = make_queries(documents, args.num_queries, args.seed)
+
+    config = omegaconf.OmegaConf.create(
+        {
+            "raw_file_path": directories,
+            "split_chunk_size": args.chunk_size,
+            "split_chunk_overlap": args.chunk_size // 6,
+            "embedding_model": HASH_MODEL_NAME,
+            # Matches the registration above whatever EMBEDDING_BACKEND says.
+            "embedding_backend": "torch",
+            "embedding_cache_path": os.path.join(workdir, "embeddings.sqlite"),
+            "token_cache_path": os.path.join(workdir, "tokens.sqlite"),
+            "index_path": os.path.join(workdir, "index"),
+            "ingest_workers": args.ingest_workers,
+            "vector_backend": args.vector_backend,
+            "vector_dtype": args.vector_dtype,
+            "ivf_nlist": args.ivf_nlist,
+            "ivf_nprobe": args.ivf_nprobe,
+            "bm25_tokenizer": args.tokenizer,
+            "top_k": args.k,
+            "hybrid_weight": [0.4, 0.6],
+            "dense_candidates": args.candidates,
+            "bm25_candidates": args.candidates,
+            "retrieval_cache_size": 0,
+        }
+    )
+    start = time.perf_counter()
+    retriever, _, _ = build_hybrid_retriever(config)
+    build_seconds = time.perf_counter() - start
+    num_chunks = sum(
+        len(shard.bm25_retriever.docs) for shard in retriever.shards.values()
+    )
+
+    report = {
+        "config": vars(args),
+        "corpus": {"documents": len(documents), "chunks": num_chunks},
+        "build": {
+            "seconds": build_seconds,
+            "chunks_per_second": num_chunks / build_seconds if build_seconds else 0.0,
+        },
+        "latency": measure_latency(retriever, queries, args.batch_size),
+        "recall": measure_recall(embedder, retriever, queries, args.k),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--num-docs", type=int, default=1000)
+    parser.add_argument("--doc-chars", type=int, default=3000)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=600)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--ingest-workers", type=int, default=1)
+    parser.add_argument(
+        "--vector-backend", default="memmap", choices=["chroma", "memmap"]
+    )
+    parser.add_argument(
+        "--vector-dtype", default="float16", choices=["float16", "int8"]
+    )
+    parser.add_argument("--ivf-nlist", type=int, default=0)
+    parser.add_argument("--ivf-nprobe", type=int, default=8)
+    parser.add_argument("--tokenizer", default="cjk_bigram")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="Keep corpus and index here")
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -47,7 +47,7 @@ else:
 from copy import deepcopy
 
 from agentic_search import agentic_search_graph
-from retriever import hybrid_retriever
+from retriever import load_local_retrieval
 from State.state import (
     RefinedSection,
     clearable_list_reducer,
@@ -64,13 +64,13 @@ from Tools.tools import (
     refine_section_formatter,
     section_formatter,
 )
+from Utils.document_store import is_table
 from Utils.utils import (
     call_llm,
     format_human_feedback,
     format_search_results_with_metadata,
     format_sections,
     selenium_api_search,
-    track_expanded_context,
     web_search_deduplicate_and_format_sources,
 )
 
@@ -99,27 +99,45 @@ def clearable_list_reducer(left: list | None, right: list | str | None) -> list:
     return left + right
 
 
-def search_relevance_doc(queries):
+def search_relevance_doc(queries, filters=None):
+    # One call, so a concurrent index reload cannot pair mismatched halves.
+    hybrid_retriever, document_store = load_local_retrieval()
     seen = set()
     info = []
-    for q in queries:
-        if q == "":
-            continue
-        results = hybrid_retriever.get_relevant_documents(q)
+    text_hits = []
+    queries = [q for q in queries if q != ""]
+    for results in hybrid_retriever.batch_get_relevant_documents(
+        queries, filters=filters
+    ):
         for res in results:
             if res.page_content in seen:
                 continue
             seen.add(res.page_content)
-            if "table" in res.metadata:
+            if is_table(res.metadata):
                 info.append(res)
             else:
-                expanded_content = track_expanded_context(
-                    res.metadata["content"], res.page_content, 5000, 2500
-                )
                 return_res = deepcopy(res)
-                return_res.metadata["content"] = expanded_content
+                text_hits.append(return_res)
                 info.append(return_res)
 
+    # Expand all text hits at once (a single round trip with the retrieval service).
+    expanded_contents = document_store.expand_many(
+        [
+            (
+                res.metadata["doc_id"],
+                res.metadata["start"],
+                res.metadata["end"],
+                5000,
+                2500,
+            )
+            for res in text_hits
+        ]
+    )
+    for res, expanded_content in zip(text_hits, expanded_contents):
+        # None: the source file changed or is gone; keep the chunk itself.
+        res.metadata["content"] = (
+            res.page_content if expanded_content is None else expanded_content
+        )
     return info
 
 
@@ -164,6 +182,7 @@ def generate_report_plan(state: ReportState, config: RunnableConfig):
         ],
         tool=[queries_formatter],
         tool_choice="required",
+        role="query",
     )
     query_list = results.tool_calls[0]["args"]["queries"]
     logger.info("===End report planner query generation.===")
@@ -172,7 +191,9 @@ def generate_report_plan(state: ReportState, config: RunnableConfig):
     logger.info("===Start report planner query searching.===")
     source_str = ""
     if use_local_db:
-        results = search_relevance_doc(query_list)
+        results = search_relevance_doc(
+            query_list, filters=configurable.get("local_db_filters", None)
+        )
         source_str = format_search_results_with_metadata(results)
     if use_web:
         web_results = selenium_api_search(query_list, False)
@@ -200,6 +221,7 @@ def generate_report_plan(state: ReportState, config: RunnableConfig):
         ],
         tool=[section_formatter],
         tool_choice="required",
+        role="planner",
     )
     sections = [
         Section(**tool_call["args"]) for tool_call in report_sections.tool_calls
@@ -266,6 +288,7 @@ def generate_queries(state: SectionState, config: RunnableConfig):
         + [HumanMessage(content="Generate search queries on the provided topic.")],
         tool=[queries_formatter],
         tool_choice="required",
+        role="query",
     )
     logger.info(f"== End generate topic:{section.name} queries==")
 
@@ -288,7 +311,9 @@ def search_db(state: SectionState, config: RunnableConfig):
 
     source_str = ""
     if use_local_db:
-        results = search_relevance_doc(query_list)
+        results = search_relevance_doc(
+            query_list, filters=configurable.get("local_db_filters", None)
+        )
         source_str = format_search_results_with_metadata(results)
 
     if use_web:
@@ -370,6 +395,7 @@ def write_section(
                 content="Generate a report section based on the provided sources."
             )
         ],
+        role="writer",
     )
     logger.info(
         f"End generate section content of topic:{section.name}, Search iteration:{state['search_iterations']}"
@@ -402,6 +428,7 @@ def write_section(
         ],
         tool=[feedback_formatter],
         tool_choice="required",
+        role="verify",
     )
     logger.info(
         f"Start grade section content of topic:{section.name}, Search iteration:{state['search_iterations']}"
@@ -424,6 +451,7 @@ def write_section(
             ],
             tool=[feedback_formatter],
             tool_choice="required",
+            role="verify",
         )
         feedback = feedback.tool_calls[0]["args"]
 
@@ -498,6 +526,7 @@ def refine_sections(state: ReportState, config: RunnableConfig):
             ],
             tool=[refine_section_formatter],
             tool_choice="required",
+            role="writer",
         )
         refined_section_data = refined_output.tool_calls[0]["args"]
         section.description += "\n\n" + refined_section_data["refined_description"]
@@ -555,6 +584,7 @@ def write_final_sections(state: SectionState, config: RunnableConfig):
                 content="Generate a report section based on the provided sources."
             )
         ],
+        role="conclude",
     )
     logger.info(f"End write section:{section.name}")
 
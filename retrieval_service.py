@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, Queue
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+from retriever import load_local_retrieval, reload_local_retrieval
+from Utils.retrieval_client import RETRIEVAL_PORT, document_to_dict
+
+logger = logging.getLogger("RetrievalService")
+logger.setLevel(logging.DEBUG)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+CONFIG_PATH = os.environ.get("RETRIEVER_CONFIG", "retriever_config.yaml")
+MAX_BATCH_QUERIES = int(os.environ.get("RETRIEVAL_MAX_BATCH", 64))
+MAX_BATCH_WAIT = float(os.environ.get("RETRIEVAL_MAX_WAIT_MS", 10)) / 1000
+
+
+def local_retrieval():
+    return load_local_retrieval(CONFIG_PATH, allow_remote=False)
+
+
+# =========================
+# Micro-batching
+# =========================
+class QueryBatcher(object):
+    """Merge queries from concurrent requests into one retriever call.
+
+    The worker takes the first waiting request, then keeps collecting for up
+    to `max_wait` seconds or `max_queries` queries. Requests with the same
+    filters are answered by a single `batch_get_relevant_documents` call, so
+    their queries share one embedding forward pass and one search.
+    """
+
+    def __init__(self, max_queries=MAX_BATCH_QUERIES, max_wait=MAX_BATCH_WAIT):
+        self.max_queries = max_queries
+        self.max_wait = max_wait
+        self.queue = Queue()
+        self.batches = 0
+        self.requests = 0
+        self.worker = threading.Thread(
+            target=self.run, name="retrieval-batcher", daemon=True
+        )
+        self.worker.start()
+
+    def submit(self, queries, filters=None):
+        future = Future()
+        self.queue.put((list(queries), filters, future))
+        return future
+
+    def collect(self):
+        batch = [self.queue.get()]
+        num_queries = len(batch[0][0])
+        deadline = time.time() + self.max_wait
+        while num_queries < self.max_queries:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except Empty:
+                break
+            batch.append(item)
+            num_queries += len(item[0])
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            groups = {}
+            for item in batch:
+                key = json.dumps(item[1], sort_keys=True, default=str)
+                groups.setdefault(key, []).append(item)
+            for items in groups.values():
+                self.answer(items)
+            self.batches += 1
+            self.requests += len(batch)
+
+    def answer(self, items):
+        # Deduplicate across requests; each query is searched once.
+        queries = list(dict.fromkeys(q for item in items for q in item[0]))
+        try:
+            hybrid_retriever, _ = local_retrieval()
+            found = dict(
+                zip(
+                    queries,
+                    hybrid_retriever.batch_get_relevant_documents(
+                        queries, filters=items[0][1]
+                    ),
+                )
+            )
+        except Exception as e:
+            logger.error(f"Batch of {len(queries)} queries failed: {e}")
+            for _, _, future in items:
+                future.set_exception(e)
+            return
+        for item_queries, _, future in items:
+            future.set_result([found[q] for q in item_queries])
+
+
+# =========================
+# FastAPI Setup
+# =========================
+app = FastAPI()
+batcher = QueryBatcher()
+
+
+class RetrieveRequest(BaseModel):
+    queries: List[str]
+    filters: Optional[Dict[str, Any]] = None
+
+
+class ExpandRequest(BaseModel):
+    spans: List[List[Any]]
+
+
+@app.post("/retrieve")
+def retrieve(request: RetrieveRequest):
+    if not request.queries:
+        return {"results": []}
+    results = batcher.submit(request.queries, request.filters).result()
+    return {"results": [[document_to_dict(doc) for doc in docs] for docs in results]}
+
+
+@app.post("/expand")
+def expand(request: ExpandRequest):
+    _, document_store = local_retrieval()
+    return {"contents": document_store.expand_many(request.spans)}
+
+
+@app.post("/reload")
+def reload():
+    start_time = time.time()
+    reload_local_retrieval(CONFIG_PATH)
+    return {"status": "ok", "seconds": time.time() - start_time}
+
+
+@app.get("/stats")
+def stats():
+    hybrid_retriever, _ = local_retrieval()
+    cache = getattr(hybrid_retriever, "cache", None)
+    return {
+        "batches": batcher.batches,
+        "requests": batcher.requests,
+        "queued": batcher.queue.qsize(),
+        "cache": cache.stats() if cache is not None else None,
+    }
+
+
+# =========================
+# Main Entrypoint
+# =========================
+if __name__ == "__main__":
+    # Build the index before accepting requests.
+    local_retrieval()
+    uvicorn.run(app, host="0.0.0.0", port=int(RETRIEVAL_PORT))
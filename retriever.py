@@ -1,18 +1,45 @@
 # %%
 import os
+import fcntl
 import glob
+import hashlib
 import json
+import multiprocessing
+import shutil
+import threading
+import time
+from collections import namedtuple
+from collections.abc import Mapping
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import omegaconf
 import torch
-from langchain.retrievers import BM25Retriever
-from langchain.retrievers.ensemble import EnsembleRetriever
 from langchain.schema import Document
 from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 import logging
 
+from Utils.bm25_index import SparseBM25Index, SparseBM25Retriever
+from Utils.document_store import (
+    DocumentStore,
+    is_table,
+    split_table,
+    split_with_offsets,
+)
+from Utils.embedding_backends import DEFAULT_BACKEND
+from Utils.embedding_cache import get_embeddings
+from Utils.hybrid_retriever import HybridRetriever, ShardedRetriever
+from Utils.metadata_index import MetadataIndex, parse_date_key
+from Utils.retrieval_cache import RetrievalCache
+from Utils.retrieval_client import (
+    RemoteDocumentStore,
+    RemoteRetriever,
+    retrieval_service_url,
+)
+from Utils.text_tokenizers import DEFAULT_TOKENIZER, get_tokenizer
+from Utils.vector_index import IVF_SYNC_GROWTH, MemmapVectorStore
+
 logger = logging.getLogger("Retriever")
 logger.setLevel(logging.DEBUG)
 
@@ -25,7 +52,7 @@ logger.addHandler(console_handler)
 
 
 # %%
-def process_date(information):
+def process_date(information, file):
     date = information["date"]
     if date is None or date == "None":
         logger.critical(file)
@@ -33,6 +60,7 @@ def process_date(information):
             "Can not get date information by first 5000 strngs. Try to parse the date information by file name"
         )
         try:
+            name = os.path.splitext(os.path.split(file)[-1])[0]
             date = name.split("-")[-1]
             if "_" in date:
                 date = date.split("_")[0]
@@ -41,99 +69,798 @@ def process_date(information):
             logger.critical(
                 "Can not get date information by file name. Set date to None"
             )
-        finally:
             date = "None"
     return date
 
 
-def process_document(name, date, information):
+def process_document(name, date, information, table_block_chars=8000):
+    """Documents for one preprocessed file.
+
+    A text file gives one document (split later). A table gives one
+    document per row-block: only the summary, plus the block's rows when
+    the table needs several blocks, is embedded, and the bodies stay in the
+    JSON file and are loaded by `load_table` when a hit is rendered.
+    """
+    # Filterable fields for the metadata index, shared by text and table chunks.
+    filter_metadata = {
+        "date_key": parse_date_key(date),
+        "source": os.path.dirname(name),
+        "target": str(
+            information.get("investment_target")
+            or information.get("institution")
+            or "None"
+        ),
+    }
     if "table" in information:
-        if len(information["table"]) >= 100000:
-            logger.critical(
-                f"File:{file}.\n\n The length of table string longer than 100000"
+        table = information["table"] or ""
+        header, blocks = split_table(table, table_block_chars)
+        rows = header_size = None
+        if len(blocks) > 1:
+            logger.info(f"File:{name}. Split table into {len(blocks)} row-blocks.")
+            rows = table.split("\n")
+            header_size = len(header.split("\n"))
+        docs = []
+        for start, end in blocks:
+            page_content = information["summary"]
+            if rows is not None:
+                # Blocks share the summary; their rows keep them apart in both indexes.
+                page_content += "\n\n" + "\n".join(
+                    [header, *rows[header_size + start : header_size + end]]
+                )
+            docs.append(
+                Document(
+                    page_content,
+                    metadata={
+                        "path": name,
+                        "date": date,
+                        "summary": information["summary"],
+                        "table_row_start": start,
+                        "table_row_end": end,
+                        "table_blocks": len(blocks),
+                        **filter_metadata,
+                    },
+                )
             )
-            return None
-
-        metadata = {
-            "path": name,
-            "date": date,
-            "context_heading": (
-                information["context_heading"]
-                if information["context_heading"]
-                else "None"
-            ),
-            "context_paragraph": (
-                information["context_paragraph"]
-                if information["context_paragraph"]
-                else "None"
-            ),
-            "summary": information["summary"],
-            "table": information["table"],
-        }
-        doc = Document(
-            information["summary"],
-            metadata=metadata,
-        )
+        return docs
 
-    else:
-        doc = Document(
+    return [
+        Document(
             information["full_content"],
             metadata={
                 "path": name,
-                "content": information["full_content"],
                 "date": date,
+                **filter_metadata,
             },
         )
-    return doc
+    ]
+
+
+def document_id(file):
+    return hashlib.sha1(file.encode("utf-8")).hexdigest()
+
+
+def build_text_splitter(chunk_size, chunk_overlap):
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\n\n\n\n", "\n\n\n", "\n\n", "\n"],
+        add_start_index=True,
+    )
+
+
+def load_file(file, text_splitter, table_block_chars=8000):
+    """Load, validate and split one preprocessed JSON file.
+
+    Returns `(file, chunks, has_text)`; `has_text` is False for table files.
+    """
+    with open(file, "rb") as f:
+        data = f.read()
+    information = json.loads(data)
+
+    date = process_date(information, file)
+    docs = process_document(file, date, information, table_block_chars)
+    if is_table(docs[0].metadata):
+        # Table bodies are read back at render time; the hash pins the version.
+        digest = hashlib.sha256(data).hexdigest()
+        for doc in docs:
+            doc.metadata["file_hash"] = digest
+        return file, docs, False
+    return file, split_with_offsets(text_splitter, docs[0], document_id(file)), True
+
+
+_worker_text_splitter = None
+_worker_table_block_chars = 8000
+
+
+def _init_ingest_worker(chunk_size, chunk_overlap, table_block_chars):
+    global _worker_text_splitter, _worker_table_block_chars
+    _worker_text_splitter = build_text_splitter(chunk_size, chunk_overlap)
+    _worker_table_block_chars = table_block_chars
+
+
+def _ingest_worker(file):
+    return load_file(file, _worker_text_splitter, _worker_table_block_chars)
+
+
+def file_hash(file, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PersistentIndex(object):
+    """Chroma collection persisted under `index_path` plus a manifest of the
+    content hash and chunk ids of every indexed file, so that only new,
+    changed or deleted files are re-embedded on startup.
+
+    Text chunks only store `(doc_id, start, end)`; full texts are resolved
+    through `document_store` when a hit is expanded. The BM25 side is a
+    `SparseBM25Index` kept in step with the collection and saved next to it."""
+
+    manifest_name = "manifest.json"
+    manifest_version = 4
+
+    def __init__(self, config, index_path=None, document_store=None):
+        self.index_path = index_path or config.get("index_path", "./retriever_index")
+        os.makedirs(self.index_path, exist_ok=True)
+        self.manifest_path = os.path.join(self.index_path, self.manifest_name)
+        self.chunk_size = config["split_chunk_size"]
+        self.chunk_overlap = config["split_chunk_overlap"]
+        self.text_splitter = build_text_splitter(self.chunk_size, self.chunk_overlap)
+        self.table_block_chars = config.get("table_block_chars", 8000)
+        # A process pool is opt-in: its spawned workers re-import `__main__`.
+        self.ingest_workers = config.get("ingest_workers", None) or 1
+        self.embed_batch_size = config.get("embed_batch_size", 256)
+        self.embedding_backend = (
+            config.get("embedding_backend", None) or DEFAULT_BACKEND
+        )
+        self.embeddings = get_embeddings(
+            config["embedding_model"],
+            config.get("embedding_cache_path", None),
+            config.get("embedding_cache_max_entries", None),
+            self.embedding_backend,
+        )
+        self.vector_backend = config.get("vector_backend", "chroma")
+        self.vector_dtype = config.get("vector_dtype", "float16")
+        self.ivf_nlist = config.get("ivf_nlist", 0)
+        self.ivf_nprobe = config.get("ivf_nprobe", 8)
+        self.vectorstore = self.create_vectorstore()
+        self.manifest = self.load_manifest()
+        self.bm25_path = os.path.join(self.index_path, "bm25")
+        self.tokenizer = get_tokenizer(
+            config.get("bm25_tokenizer", None), config.get("token_cache_path", None)
+        )
+        self.bm25_index = SparseBM25Index.load(
+            self.bm25_path, preprocess_func=self.tokenizer
+        ) or SparseBM25Index(preprocess_func=self.tokenizer)
+        # An empty store is falsy; test for None so a shared one is kept.
+        self.document_store = (
+            document_store if document_store is not None else DocumentStore()
+        )
+        self.register(self.document_store)
+
+    def register(self, document_store):
+        """Make the full texts of every indexed file resolvable through `document_store`."""
+        for file, entry in self.manifest.items():
+            if entry.get("doc_id"):
+                document_store.add_file(entry["doc_id"], file, entry["hash"])
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if (
+            manifest.get("version") != self.manifest_version
+            or manifest.get("vector_backend", "chroma") != self.vector_backend
+            or manifest.get("embedding_backend", "torch") != self.embedding_backend
+        ):
+            logger.info("Index manifest format changed. Rebuilding the index.")
+            self.vectorstore.delete_collection()
+            self.vectorstore = self.create_vectorstore()
+            return {}
+        return manifest["files"]
+
+    def create_vectorstore(self):
+        if self.vector_backend == "memmap":
+            return MemmapVectorStore(
+                os.path.join(self.index_path, "memmap"),
+                self.embeddings,
+                dtype=self.vector_dtype,
+                nlist=self.ivf_nlist,
+                nprobe=self.ivf_nprobe,
+            )
+        elif self.vector_backend == "chroma":
+            return Chroma(
+                collection_name="rag-chroma",
+                embedding_function=self.embeddings,
+                persist_directory=os.path.join(self.index_path, "chroma"),
+            )
+        else:
+            raise ValueError("Only support chroma and memmap vector backends")
+
+    @property
+    def version(self):
+        """Digest of the indexed file set; changes whenever a sync changes the index."""
+        payload = json.dumps(
+            [
+                self.manifest_version,
+                self.vector_backend,
+                self.embedding_backend,
+                self.tokenizer.name,
+                sorted((file, entry["hash"]) for file, entry in self.manifest.items()),
+            ]
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def save_manifest(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": self.manifest_version,
+                    "vector_backend": self.vector_backend,
+                    "embedding_backend": self.embedding_backend,
+                    "files": self.manifest,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.manifest_path)
+
+    def remove_file(self, file):
+        entry = self.manifest.pop(file)
+        if entry["ids"]:
+            self.vectorstore.delete(ids=entry["ids"])
+            self.bm25_index.remove(entry["ids"])
+        if entry.get("doc_id"):
+            self.document_store.remove(entry["doc_id"])
+
+    def load_files(self, files):
+        """Yield `load_file` results, fanned out over a process pool when
+        `ingest_workers` > 1.
+
+        The workers are spawned, so the script that builds the index must
+        guard its entry point with `if __name__ == "__main__":`.
+        """
+        if self.ingest_workers <= 1 or len(files) <= 1:
+            for file in files:
+                yield load_file(file, self.text_splitter, self.table_block_chars)
+            return
+
+        # spawn: the parent may already hold the embedding model (and CUDA).
+        with ProcessPoolExecutor(
+            max_workers=self.ingest_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_ingest_worker,
+            initargs=(self.chunk_size, self.chunk_overlap, self.table_block_chars),
+        ) as executor:
+            chunksize = max(1, min(64, len(files) // (self.ingest_workers * 4)))
+            yield from executor.map(_ingest_worker, files, chunksize=chunksize)
+
+    def flush(self, batch, hashes):
+        chunks, ids = [], []
+        for file, file_chunks, _ in batch:
+            # Ids are derived from the path so a crashed sync re-upserts instead of duplicating.
+            doc_id = document_id(file)
+            chunks.extend(file_chunks)
+            ids.extend(f"{doc_id}-{idx}" for idx in range(len(file_chunks)))
+        if chunks:
+            self.vectorstore.add_documents(chunks, ids=ids)
+            self.bm25_index.add(ids, [chunk.page_content for chunk in chunks])
+
+        for file, file_chunks, has_text in batch:
+            doc_id = document_id(file)
+            self.manifest[file] = {
+                "hash": hashes[file],
+                "ids": [f"{doc_id}-{idx}" for idx in range(len(file_chunks))],
+                "doc_id": doc_id if has_text else None,
+            }
+            if has_text:
+                self.document_store.add_file(doc_id, file, hashes[file])
+
+    def diff(self, files):
+        """Hash `files` and compare them with the manifest.
+
+        Returns `(hashes, added, changed, removed)`.
+        """
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            hashes = dict(zip(files, executor.map(file_hash, files)))
+        removed = [file for file in self.manifest if file not in hashes]
+        changed = [
+            file
+            for file, digest in hashes.items()
+            if file in self.manifest and self.manifest[file]["hash"] != digest
+        ]
+        added = [file for file in hashes if file not in self.manifest]
+        return hashes, added, changed, removed
+
+    def sync(self, files, save_every=100):
+        hashes, added, changed, removed = self.diff(files)
+        logger.info(
+            f"Index sync: {len(added)} new, {len(changed)} changed, {len(removed)} removed, {len(hashes) - len(added) - len(changed)} unchanged."
+        )
+
+        for file in removed + changed:
+            self.remove_file(file)
+
+        self.ingest(changed + added, hashes, save_every)
+        self.save_manifest()
+        self.sync_bm25(dirty=bool(removed or changed or added))
+        if self.vector_backend == "memmap":
+            self.vectorstore.maybe_train_ivf(IVF_SYNC_GROWTH)
+
+    def ingest(self, pending, hashes, save_every):
+        if not pending:
+            return
+        start_time = time.time()
+        num_files, num_chunks, num_saved = 0, 0, 0
+        batch, batch_chunks = [], 0
+        for result in self.load_files(pending):
+            batch.append(result)
+            batch_chunks += len(result[1])
+            if batch_chunks >= self.embed_batch_size:
+                self.flush(batch, hashes)
+                num_files += len(batch)
+                num_chunks += batch_chunks
+                batch, batch_chunks = [], 0
+            if num_files - num_saved >= save_every:
+                self.save_manifest()
+                num_saved = num_files
+                self.log_ingest_rate(num_files, len(pending), num_chunks, start_time)
+        self.flush(batch, hashes)
+        num_files += len(batch)
+        num_chunks += batch_chunks
+        self.log_ingest_rate(num_files, len(pending), num_chunks, start_time)
+
+    def log_ingest_rate(self, num_files, total_files, num_chunks, start_time):
+        elapsed = max(time.time() - start_time, 1e-6)
+        logger.info(
+            f"Ingested {num_files}/{total_files} files, {num_chunks} chunks in {elapsed:.1f}s ({num_files / elapsed:.1f} files/s, {num_chunks / elapsed:.1f} chunks/s)."
+        )
+
+    def sync_bm25(self, dirty):
+        # A crash between manifest and BM25 saves leaves them out of step.
+        indexed_ids = {
+            chunk_id for entry in self.manifest.values() for chunk_id in entry["ids"]
+        }
+        if set(self.bm25_index.rows) != indexed_ids:
+            logger.info("BM25 index is out of date. Rebuilding it from the collection.")
+            ids, docs = self.documents()
+            self.bm25_index = SparseBM25Index(preprocess_func=self.tokenizer)
+            self.bm25_index.add(ids, [doc.page_content for doc in docs])
+            dirty = True
+        if dirty:
+            self.bm25_index.save(self.bm25_path)
+
+    def documents(self):
+        stored = self.vectorstore.get(include=["documents", "metadatas"])
+        docs = [
+            Document(page_content, metadata=metadata)
+            for page_content, metadata in zip(stored["documents"], stored["metadatas"])
+        ]
+        return stored["ids"], docs
+
+    def metadatas(self):
+        stored = self.vectorstore.get(include=["metadatas"])
+        return stored["ids"], stored["metadatas"]
+
+    def bm25_retriever(self, k):
+        return SparseBM25Retriever(
+            index=self.bm25_index,
+            docs=StoredDocuments(self.vectorstore, self.bm25_index),
+            k=k,
+        )
+
+
+class StoredDocuments(Mapping):
+    """Read-only `{chunk_id: Document}` view over a vector store.
+
+    Chunks are read from the store when looked up rather than held in every
+    process; the keys are the ids in the shard's BM25 index.
+    """
+
+    def __init__(self, vectorstore, bm25_index):
+        self.vectorstore = vectorstore
+        self.bm25_index = bm25_index
+
+    def __getitem__(self, doc_id):
+        stored = self.vectorstore.get(ids=[doc_id])
+        if not stored["ids"]:
+            raise KeyError(doc_id)
+        return Document(stored["documents"][0], metadata=stored["metadatas"][0])
+
+    def __iter__(self):
+        return iter(list(self.bm25_index.rows))
+
+    def __len__(self):
+        return len(self.bm25_index)
+
+    def items(self):
+        """All `(chunk_id, Document)` pairs, read in one query."""
+        stored = self.vectorstore.get(include=["documents", "metadatas"])
+        return [
+            (doc_id, Document(page_content, metadata=metadata))
+            for doc_id, page_content, metadata in zip(
+                stored["ids"], stored["documents"], stored["metadatas"]
+            )
+        ]
 
 
 # %%
-config = omegaconf.OmegaConf.load("retriever_config.yaml")
-files = []
-if config["raw_file_path"] is not None:
-    for f in config["raw_file_path"]:
-        files.extend(glob.glob(f"{f}/*.*"))
-
-    documents, table_documents = [], []
-    for file in files:
-        name = os.path.split(file)[-1]
-        name, extension = os.path.splitext(name)
-        with open(file, "rb") as f:
-            information = json.load(f)
-
-        date = process_date(information)
-        doc = process_document(file, date, information)
-
-        if doc is None:
+_local_retrieval = (None, None)
+_shard_states = {}
+_hybrid_retriever_loaded = False
+_hybrid_retriever_lock = threading.Lock()
+_reload_lock = threading.Lock()
+_corpus_watcher = None
+_remote_retrieval = None
+
+ShardState = namedtuple("ShardState", ["index", "retriever", "generation"])
+
+
+def shard_name(directory):
+    """Stable shard name for a `raw_file_path` directory."""
+    directory = os.path.abspath(directory)
+    digest = hashlib.sha1(directory.encode("utf-8")).hexdigest()[:8]
+    return f"{os.path.basename(directory) or 'root'}-{digest}"
+
+
+def read_generation(shard_dir):
+    path = os.path.join(shard_dir, "CURRENT")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def write_generation(shard_dir, generation):
+    tmp_path = os.path.join(shard_dir, "CURRENT.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(generation)
+    os.replace(tmp_path, os.path.join(shard_dir, "CURRENT"))
+
+
+def generation_number(generation):
+    return int(generation.split("-")[1])
+
+
+@contextmanager
+def shard_lock(shard_dir):
+    """Exclusive lock on a shard, held by one process while it syncs,
+    copies or prunes generations."""
+    with open(os.path.join(shard_dir, "LOCK"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def write_lease(shard_dir, generations):
+    """Record under `leases/<pid>` the generations this process serves."""
+    lease_dir = os.path.join(shard_dir, "leases")
+    os.makedirs(lease_dir, exist_ok=True)
+    tmp_path = os.path.join(lease_dir, f".{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(sorted(generations), f)
+    os.replace(tmp_path, os.path.join(lease_dir, str(os.getpid())))
+
+
+def leased_generations(shard_dir):
+    """Generations served by other live processes; leases of dead ones are removed."""
+    lease_dir = os.path.join(shard_dir, "leases")
+    if not os.path.isdir(lease_dir):
+        return set()
+    in_use = set()
+    for name in os.listdir(lease_dir):
+        if not name.isdigit() or int(name) == os.getpid():
             continue
+        path = os.path.join(lease_dir, name)
+        if not pid_alive(int(name)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                in_use.update(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return in_use
 
-        if "table" in doc.metadata:
-            table_documents.append(doc)
 
-        else:
-            documents.append(doc)
+def prune_generations(shard_dir, keep):
+    """Remove generations older than all of `keep` that no live process leases.
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=config["split_chunk_size"],
-        chunk_overlap=config["split_chunk_overlap"],
-        separators=["\n\n\n\n", "\n\n\n", "\n\n", "\n"],
-    )
-    doc_splits = text_splitter.split_documents(documents) + table_documents
-    embeddings = HuggingFaceEmbeddings(model_name=config["embedding_model"])
-    vectorstore = Chroma.from_documents(
-        documents=doc_splits,
-        collection_name="rag-chroma",
-        embedding=embeddings,
+    Call with `shard_lock` held.
+    """
+    oldest = min(generation_number(generation) for generation in keep)
+    in_use = leased_generations(shard_dir)
+    for name in os.listdir(shard_dir):
+        if (
+            name.startswith("gen-")
+            and generation_number(name) < oldest
+            and name not in in_use
+        ):
+            shutil.rmtree(os.path.join(shard_dir, name), ignore_errors=True)
+
+
+def generation_is_current(index_path, config, files):
+    """Whether the generation at `index_path` already indexes `files` with
+    this config, so opening it for a sync leaves it untouched."""
+    manifest_path = os.path.join(index_path, PersistentIndex.manifest_name)
+    bm25_meta_path = os.path.join(index_path, "bm25", "bm25.json")
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    tokenizer = config.get("bm25_tokenizer", None) or DEFAULT_TOKENIZER
+    if os.path.exists(bm25_meta_path):
+        with open(bm25_meta_path, "r", encoding="utf-8") as f:
+            tokenizer = json.load(f).get("tokenizer", "whitespace")
+    elif manifest.get("files"):
+        return False
+    if (
+        manifest.get("version") != PersistentIndex.manifest_version
+        or manifest.get("vector_backend", "chroma")
+        != config.get("vector_backend", "chroma")
+        or manifest.get("embedding_backend", "torch")
+        != (config.get("embedding_backend", None) or DEFAULT_BACKEND)
+        or tokenizer != (config.get("bm25_tokenizer", None) or DEFAULT_TOKENIZER)
+        or set(manifest["files"]) != set(files)
+    ):
+        return False
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        hashes = dict(zip(files, executor.map(file_hash, files)))
+    return all(manifest["files"][file]["hash"] == hashes[file] for file in files)
+
+
+def copy_generation(shard_dir, generation):
+    """Copy `generation` to the next one and return the new generation's name."""
+    new_generation = f"gen-{generation_number(generation) + 1:06d}"
+    new_path = os.path.join(shard_dir, new_generation)
+    shutil.rmtree(new_path, ignore_errors=True)
+    shutil.copytree(os.path.join(shard_dir, generation), new_path)
+    return new_generation
+
+
+def build_shard(config, directory, document_store, previous=None):
+    """Sync the shard index of one `raw_file_path` directory and wrap it in a
+    `HybridRetriever`.
+
+    Each shard lives in numbered generation directories with `CURRENT`
+    naming the live one. On a reload (`previous` given) an unchanged shard
+    is reused as is; a changed one is copied to a new generation and synced
+    there, so the live generation keeps serving queries untouched. The
+    previous generation is kept for queries still running against it. A
+    process starting cold does the same when the corpus or config no
+    longer matches the live generation, which other processes may serve.
+
+    Processes sharing `index_path` take turns on a shard through
+    `shard_lock`, and each leases the generations it serves so that
+    another process never prunes them.
+    """
+    shard_dir = os.path.join(
+        config.get("index_path", "./retriever_index"),
+        "shards",
+        shard_name(directory),
     )
-    torch.cuda.empty_cache()
-    bm25_retriever = BM25Retriever.from_documents(doc_splits)
-    bm25_retriever.k = config["top_k"]
-    hybrid_retriever = EnsembleRetriever(
-        retrievers=[
-            vectorstore.as_retriever(search_kwargs={"k": config["top_k"]}),
-            bm25_retriever,
-        ],
-        weights=config["hybrid_weight"],
+    os.makedirs(shard_dir, exist_ok=True)
+    files = glob.glob(f"{directory}/*.*")
+    with shard_lock(shard_dir):
+        generation = read_generation(shard_dir)
+        if previous is not None:
+            _, added, changed, removed = previous.index.diff(files)
+            if not (added or changed or removed):
+                previous.index.register(document_store)
+                return previous
+            generation = copy_generation(shard_dir, generation)
+        elif generation is None:
+            generation = "gen-000001"
+        elif not generation_is_current(
+            os.path.join(shard_dir, generation), config, files
+        ):
+            generation = copy_generation(shard_dir, generation)
+
+        index = PersistentIndex(
+            config,
+            index_path=os.path.join(shard_dir, generation),
+            document_store=document_store,
+        )
+        index.sync(files)
+        torch.cuda.empty_cache()
+        retriever = HybridRetriever(
+            vectorstore=index.vectorstore,
+            bm25_retriever=index.bm25_retriever(config["top_k"]),
+            metadata_index=MetadataIndex.from_metadatas(*index.metadatas()),
+            k=config["top_k"],
+            weights=list(config["hybrid_weight"]),
+            dense_candidates=config.get("dense_candidates", config["top_k"]),
+            bm25_candidates=config.get("bm25_candidates", config["top_k"]),
+            fusion=config.get("hybrid_fusion", "rrf"),
+            rrf_c=config.get("rrf_c", 60),
+        )
+        write_generation(shard_dir, generation)
+        serving = {generation, previous.generation if previous else generation}
+        write_lease(shard_dir, serving)
+        prune_generations(shard_dir, serving)
+        return ShardState(index, retriever, generation)
+
+
+def build_hybrid_retriever(config, previous=None):
+    """Build the sharded retriever. Returns `(retriever, document_store, shard_states)`.
+
+    With `previous` shard states (see `reload_local_retrieval`), only shards
+    whose files changed are re-synced, each into a fresh generation.
+    """
+    if config["raw_file_path"] is None:
+        return None, None, {}
+    previous = previous or {}
+
+    # Shards are built one after another: each sync already saturates the
+    # ingest pool and the embedding model.
+    document_store = DocumentStore()
+    states, directories = {}, {}
+    for directory in config["raw_file_path"]:
+        name = shard_name(directory)
+        states[name] = build_shard(
+            config, directory, document_store, previous.get(name)
+        )
+        directories[name] = directory
+    hybrid_retriever = ShardedRetriever(
+        shards={name: state.retriever for name, state in states.items()},
+        directories=directories,
+        k=config["top_k"],
     )
-else:
-    hybrid_retriever = None
+    if config.get("retrieval_cache_size", 1024):
+        hybrid_retriever.cache = RetrievalCache(
+            config.get("retrieval_cache_size", 1024),
+            config.get("retrieval_cache_path", None),
+        )
+        versions = sorted(
+            f"{name}:{state.index.version}" for name, state in states.items()
+        )
+        fingerprint = (
+            next(iter(states.values())).retriever.fingerprint() if states else ""
+        )
+        hybrid_retriever.cache.set_version(
+            hashlib.sha1(
+                json.dumps([versions, fingerprint]).encode("utf-8")
+            ).hexdigest()
+        )
+    return hybrid_retriever, document_store, states
+
+
+def corpus_snapshot(directories):
+    """Cheap `(path -> (mtime, size))` view of the corpus, used to detect changes."""
+    snapshot = {}
+    for directory in directories:
+        for file in glob.glob(f"{directory}/*.*"):
+            try:
+                stat = os.stat(file)
+            except FileNotFoundError:
+                continue
+            snapshot[file] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+class CorpusWatcher(threading.Thread):
+    """Poll the `raw_file_path` directories and reload the index when they change.
+
+    A reload only starts once the directories look the same on two
+    consecutive polls, so files still being written are not half-indexed.
+    """
+
+    def __init__(self, config_path, directories, interval):
+        super().__init__(name="corpus-watcher", daemon=True)
+        self.config_path = config_path
+        self.directories = list(directories)
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        indexed = corpus_snapshot(self.directories)
+        pending = None
+        while not self.stop_event.wait(self.interval):
+            snapshot = corpus_snapshot(self.directories)
+            if snapshot == indexed:
+                pending = None
+                continue
+            if snapshot != pending:
+                pending = snapshot
+                continue
+            try:
+                reload_local_retrieval(self.config_path)
+                indexed = snapshot
+            except Exception as e:
+                logger.critical(f"Index reload failed: {e}")
+            pending = None
+
+
+def start_corpus_watcher(config_path, config):
+    global _corpus_watcher
+    interval = config.get("reload_watch_interval", 0)
+    if not interval or config["raw_file_path"] is None or _corpus_watcher is not None:
+        return
+    _corpus_watcher = CorpusWatcher(config_path, config["raw_file_path"], interval)
+    _corpus_watcher.start()
+
+
+def load_local_retrieval(config_path="retriever_config.yaml", allow_remote=True):
+    """`(hybrid_retriever, document_store)`, built on first use.
+
+    When `RETRIEVAL_HOST` points at a running `retrieval_service.py` (and
+    `allow_remote` is set), clients for the shared service are returned
+    instead and no index or embedding model is loaded in this process.
+
+    Callers needing both should take them from one call: a reload may swap
+    them between two separate calls.
+    """
+    global _local_retrieval, _shard_states, _hybrid_retriever_loaded, _remote_retrieval
+    if allow_remote and retrieval_service_url():
+        if _remote_retrieval is None:
+            url = retrieval_service_url()
+            _remote_retrieval = (RemoteRetriever(url=url), RemoteDocumentStore(url))
+        return _remote_retrieval
+    if not _hybrid_retriever_loaded:
+        with _reload_lock:
+            if not _hybrid_retriever_loaded:
+                config = omegaconf.OmegaConf.load(config_path)
+                retriever, document_store, states = build_hybrid_retriever(config)
+                with _hybrid_retriever_lock:
+                    _local_retrieval = (retriever, document_store)
+                    _shard_states = states
+                    _hybrid_retriever_loaded = True
+                start_corpus_watcher(config_path, config)
+    return _local_retrieval
+
+
+def reload_local_retrieval(config_path="retriever_config.yaml"):
+    """Re-sync the corpus and atomically swap in the new index.
+
+    Queries already running keep the retriever they started with; new
+    queries see the new one only once every shard is fully built.
+    """
+    global _local_retrieval, _shard_states, _hybrid_retriever_loaded
+    if not _hybrid_retriever_loaded:
+        return load_local_retrieval(config_path, allow_remote=False)[0]
+    with _reload_lock:
+        config = omegaconf.OmegaConf.load(config_path)
+        start_time = time.time()
+        retriever, document_store, states = build_hybrid_retriever(
+            config, previous=_shard_states
+        )
+        with _hybrid_retriever_lock:
+            _local_retrieval = (retriever, document_store)
+            _shard_states = states
+        logger.info(f"Index reloaded in {time.time() - start_time:.1f}s.")
+    return retriever
+
+
+def get_hybrid_retriever(config_path="retriever_config.yaml"):
+    """Build (or load) the hybrid retriever on first use and share it process-wide.
+
+    Returns None when `raw_file_path` is not configured.
+    """
+    return load_local_retrieval(config_path)[0]
+
+
+def get_document_store(config_path="retriever_config.yaml"):
+    """Document store resolving the `doc_id` of retrieved chunks to full texts."""
+    return load_local_retrieval(config_path)[1]
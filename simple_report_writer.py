@@ -16,7 +16,7 @@ from langgraph.types import Command
 from Prompt.simple_prompt import (answer_instructions, doc_judger_instructions,
                                   query_writer_instructions,
                                   section_grader_instructions)
-from retriever import hybrid_retriever
+from retriever import get_hybrid_retriever
 from State.simple_state import RAGState, RAGStateInput
 from Tools.simple_tools import (final_judge_formatter, queries_formatter,
                                 scores_formatter)
@@ -48,11 +48,13 @@ def generate_queries(state: RAGStateInput, config: RunnableConfig):
 
 def search_relevance_doc(state: RAGState, config: RunnableConfig):
     queries = state["queries"]
+    hybrid_retriever = get_hybrid_retriever()
     info = []
-    for q in queries:
-        if q == "":
-            continue
-        results = hybrid_retriever.get_relevant_documents(q)
+    queries = [q for q in queries if q != ""]
+    filters = config["configurable"].get("local_db_filters", None)
+    for results in hybrid_retriever.batch_get_relevant_documents(
+        queries, filters=filters
+    ):
         for res in results:
             if res not in info:
                 info.append(res)
@@ -0,0 +1,78 @@
+import random
+import threading
+
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from Utils.bm25_index import SparseBM25Index
+
+WORDS = [f"w{idx}" for idx in range(50)]
+
+
+def random_texts(count, seed):
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 30)))
+        for _ in range(count)
+    ]
+
+
+def test_scores_match_rank_bm25():
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    texts = random_texts(200, seed=0)
+    queries = random_texts(20, seed=1)
+    index = SparseBM25Index()
+    index.add([str(idx) for idx in range(len(texts))], texts)
+    reference = rank_bm25.BM25Okapi([text.split() for text in texts])
+    expected = np.array([reference.get_scores(query.split()) for query in queries])
+    np.testing.assert_allclose(index.score(queries), expected, atol=1e-6, rtol=1e-6)
+
+
+def test_concurrent_add_and_search():
+    index = SparseBM25Index()
+    index.add(["seed"], ["w0 w1 w2"])
+    errors = []
+    done = threading.Event()
+
+    def add():
+        try:
+            for batch in range(50):
+                texts = random_texts(20, seed=batch)
+                index.add([f"{batch}-{idx}" for idx in range(len(texts))], texts)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    def search():
+        try:
+            while not done.is_set():
+                for hits in index.search(random_texts(5, seed=None), k=3):
+                    assert all(doc_id in index.rows for doc_id, _ in hits)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=add)] + [
+        threading.Thread(target=search) for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(index) == 1 + 50 * 20
+
+
+def test_from_documents_keeps_an_empty_index():
+    from langchain_core.documents import Document
+
+    from Utils.bm25_index import SparseBM25Retriever
+
+    def tokenize(text):
+        return list(text)
+
+    index = SparseBM25Index(preprocess_func=tokenize)
+    retriever = SparseBM25Retriever.from_documents([Document("ab")], index=index)
+    assert retriever.index is index
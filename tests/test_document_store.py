@@ -0,0 +1,79 @@
+import hashlib
+import json
+
+from Utils.document_store import DocumentStore, TableStore, split_table
+
+TEXT = "first paragraph\n\nsecond paragraph here\n\nthird paragraph"
+TABLE = "\n".join(["| a | b |", "|---|---|", "| 1 | 2 |", "| 3 | 4 |", "| 5 | 6 |"])
+
+
+def write_json(path, information):
+    path.write_text(json.dumps(information), encoding="utf-8")
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def table_metadata(path, file_hash, start=0, end=2):
+    return {
+        "path": str(path),
+        "file_hash": file_hash,
+        "table_row_start": start,
+        "table_row_end": end,
+    }
+
+
+def test_expand_snaps_to_paragraph_boundaries():
+    store = DocumentStore()
+    store.add_text("doc", TEXT)
+    start = TEXT.index("paragraph here")
+    end = start + len("paragraph")
+    assert store.get_span("doc", start, end) == "paragraph"
+    assert store.expand("doc", start, end, 0, 0) == "second paragraph here"
+    assert store.expand("doc", start, end, 0, 100) == (
+        "first paragraph\n\nsecond paragraph here"
+    )
+    assert store.expand("doc", start, end, 100, 100) == TEXT
+
+
+def test_expand_reads_registered_files_only_while_their_hash_matches(tmp_path):
+    path = tmp_path / "doc.json"
+    file_hash = write_json(path, {"full_content": TEXT})
+    store = DocumentStore()
+    store.add_file("doc", str(path), file_hash)
+    assert store.expand("doc", 0, 5, 0, 0) == "first paragraph"
+
+    rewritten = DocumentStore()
+    rewritten.add_file("doc", str(path), file_hash)
+    write_json(path, {"full_content": "other text"})
+    assert rewritten.expand("doc", 0, 5, 0, 0) is None
+    path.unlink()
+    missing = DocumentStore()
+    missing.add_file("doc", str(path))
+    assert missing.expand("doc", 0, 5) is None
+    assert store.expand("unknown", 0, 5) is None
+
+
+def test_split_table_keeps_the_header_out_of_the_blocks():
+    header, blocks = split_table(TABLE, max_chars=len("| a | b |\n|---|---|") + 20)
+    assert header == "| a | b |\n|---|---|"
+    assert blocks == [(0, 2), (2, 3)]
+
+
+def test_table_store_reads_the_indexed_row_block(tmp_path):
+    path = tmp_path / "table.json"
+    file_hash = write_json(
+        path, {"table": TABLE, "context_heading": "Heading", "summary": "s"}
+    )
+    table = TableStore().load(table_metadata(path, file_hash, 1, 3))
+    assert table["context_heading"] == "Heading"
+    assert table["context_paragraph"] == "None"
+    assert table["table"] == "| a | b |\n|---|---|\n| 3 | 4 |\n| 5 | 6 |"
+
+
+def test_table_store_skips_changed_and_missing_files(tmp_path):
+    path = tmp_path / "table.json"
+    file_hash = write_json(path, {"table": TABLE})
+    store = TableStore()
+    write_json(path, {"table": "| x |\n|---|\n| 9 |"})
+    assert store.load(table_metadata(path, file_hash)) is None
+    path.unlink()
+    assert store.load(table_metadata(path, None)) is None
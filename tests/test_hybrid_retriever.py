@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.documents import Document
+
+from Utils.hybrid_retriever import HybridRetriever, ShardedRetriever, fuse
+
+
+class FakeEmbeddings(object):
+    def embed_query(self, text):
+        return [0.0]
+
+
+class FakeVectorStore(object):
+    def __init__(self, hits, embeddings):
+        self.hits = hits
+        self.embeddings = embeddings
+
+    def batch_search_ids(self, embeddings, k, ids=None):
+        return [self.hits[:k] for _ in embeddings]
+
+
+class FakeIndex(object):
+    def __init__(self, doc_ids, hits):
+        self.ids = list(doc_ids)
+        self.rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.hits = hits
+
+    def search(self, queries, k, ids=None):
+        return [self.hits[:k] for _ in queries]
+
+
+class FakeBM25Retriever(object):
+    def __init__(self, doc_ids, hits):
+        self.index = FakeIndex(doc_ids, hits)
+        self.docs = {doc_id: Document(doc_id) for doc_id in doc_ids}
+
+
+def make_shard(dense, bm25, embeddings, k=2):
+    doc_ids = sorted({doc_id for doc_id, _ in dense + bm25})
+    return HybridRetriever(
+        vectorstore=FakeVectorStore(dense, embeddings),
+        bm25_retriever=FakeBM25Retriever(doc_ids, bm25),
+        k=k,
+        dense_candidates=4,
+        bm25_candidates=4,
+    )
+
+
+def test_rrf_fusion_sums_weighted_reciprocal_ranks():
+    codes, scores = fuse(
+        [(np.array([1, 2]), np.zeros(2)), (np.array([2, 3]), np.zeros(2))],
+        [0.5, 0.5],
+        "rrf",
+        60,
+    )
+    assert codes[0] == 2
+    assert scores[0] == pytest.approx(0.5 / 62 + 0.5 / 61)
+
+
+def test_single_shard_returns_fused_top_k():
+    embeddings = FakeEmbeddings()
+    shard = make_shard(
+        [("a", 0.9), ("b", 0.8), ("c", 0.1)],
+        [("b", 3.0), ("a", 2.0)],
+        embeddings,
+    )
+    hits = shard.search_with_scores(["q"])[0]
+    assert [doc.page_content for doc, _ in hits] == ["a", "b"]
+
+
+def test_shards_are_fused_on_raw_candidates():
+    embeddings = FakeEmbeddings()
+    strong = make_shard(
+        [("a1", 0.9), ("a2", 0.8)], [("a1", 5.0), ("a2", 4.0)], embeddings
+    )
+    # Rank 1 in its own shard, but far less relevant than both strong hits.
+    weak = make_shard([("b1", 0.1)], [("b1", 0.5)], embeddings)
+    retriever = ShardedRetriever(shards={"strong": strong, "weak": weak}, k=2)
+
+    hits = retriever.search_with_scores(["q"])[0]
+    assert [doc.page_content for doc, _ in hits] == ["a1", "a2"]
+
+    hits = retriever.search_with_scores(["q"], {"shards": ["weak"]})[0]
+    assert [doc.page_content for doc, _ in hits] == ["b1"]
+    assert retriever.search_with_scores(["q"], {"shards": ["missing"]}) == [[]]
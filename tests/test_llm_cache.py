@@ -0,0 +1,73 @@
+import pytest
+
+pytest.importorskip("omegaconf")
+pytest.importorskip("httpx")
+pytest.importorskip("litellm")
+pytest.importorskip("langchain_community.chat_models")
+messages = pytest.importorskip("langchain_core.messages")
+
+import Utils.llm_cache as llm_cache
+from Utils.llm_cache import LLMCacheMiss, LLMResponseCache
+
+PROMPT = [messages.HumanMessage("hello")]
+
+
+def cache_path(tmp_path):
+    return str(tmp_path / "responses.sqlite")
+
+
+def test_off_mode_caches_nothing(tmp_path):
+    cache = LLMResponseCache(cache_path(tmp_path), mode="off")
+    assert cache.key("gpt-4o", PROMPT) is None
+    assert cache.get(None) is None
+    cache.put(None, "gpt-4o", messages.AIMessage("hi"))
+
+
+def test_on_mode_caches_temperature_zero_calls(tmp_path):
+    cache = LLMResponseCache(cache_path(tmp_path), mode="on")
+    key = cache.key("gpt-4o", PROMPT)
+    assert cache.get(key) is None
+    cache.put(key, "gpt-4o", messages.AIMessage("hi there"))
+    assert cache.get(key).content == "hi there"
+    assert cache.key("gpt-4o", [messages.HumanMessage("other")]) != key
+    assert cache.key("gpt-4o-mini", PROMPT) != key
+    assert cache.key("o3-mini", PROMPT) is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_replay_serves_recorded_calls_and_raises_on_a_miss(tmp_path):
+    recorder = LLMResponseCache(cache_path(tmp_path), mode="record")
+    key = recorder.key("o3-mini", PROMPT)
+    recorder.put(key, "o3-mini", messages.AIMessage("recorded"))
+
+    replay = LLMResponseCache(cache_path(tmp_path), mode="replay")
+    assert replay.get(replay.key("o3-mini", PROMPT)).content == "recorded"
+    with pytest.raises(LLMCacheMiss):
+        replay.get(replay.key("gpt-4o", PROMPT))
+
+
+def test_expired_entries_are_not_served(tmp_path, monkeypatch):
+    cache = LLMResponseCache(cache_path(tmp_path), mode="on", ttl=60)
+    key = cache.key("gpt-4o", PROMPT)
+    cache.put(key, "gpt-4o", messages.AIMessage("hi"))
+    now = llm_cache.time.time()
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now + 120)
+    assert cache.get(key) is None
+
+
+def test_a_backup_answer_is_cached_under_the_backup_model(tmp_path, monkeypatch):
+    pytest.importorskip("tavily")
+    pytest.importorskip("langchain.retrievers")
+    import Utils.utils as utils
+
+    class BackupRouter(object):
+        def call(self, model_name, backup_model_name, *args):
+            return backup_model_name, messages.AIMessage("from backup")
+
+    cache = LLMResponseCache(cache_path(tmp_path), mode="on")
+    monkeypatch.setattr(utils, "get_llm_cache", lambda: cache)
+    monkeypatch.setattr(utils, "get_llm_router", lambda: BackupRouter())
+
+    assert utils.call_llm("gpt-4o", "gpt-4o-mini", PROMPT).content == "from backup"
+    assert cache.get(cache.key("gpt-4o", PROMPT)) is None
+    assert cache.get(cache.key("gpt-4o-mini", PROMPT)).content == "from backup"
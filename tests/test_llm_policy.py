@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("omegaconf")
+pytest.importorskip("httpx")
+pytest.importorskip("litellm")
+pytest.importorskip("langchain_community.chat_models")
+
+import Utils.llm_policy as llm_policy
+from Utils.llm_policy import CallPolicy, get_call_policy, is_retryable
+
+
+class FlakyCall(object):
+    def __init__(self, errors, result="ok"):
+        self.errors = list(errors)
+        self.result = result
+        self.deadlines = []
+
+    def __call__(self, deadline):
+        self.deadlines.append(deadline)
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.result
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def policy(**settings):
+    return CallPolicy("test", **{"base_delay": 0.0, "max_delay": 0.0, **settings})
+
+
+def test_transient_errors_are_retried_up_to_max_attempts():
+    call = FlakyCall([TimeoutError(), StatusError(503)])
+    assert policy(max_attempts=3).run(call) == "ok"
+    assert len(call.deadlines) == 3
+
+    call = FlakyCall([TimeoutError()] * 3)
+    with pytest.raises(TimeoutError):
+        policy(max_attempts=3).run(call)
+    assert len(call.deadlines) == 3
+
+
+def test_other_errors_are_raised_at_once():
+    assert is_retryable(StatusError(429))
+    assert not is_retryable(StatusError(400))
+    call = FlakyCall([StatusError(400)])
+    with pytest.raises(StatusError):
+        policy().run(call)
+    assert len(call.deadlines) == 1
+
+
+def test_each_attempt_ends_by_its_timeout_and_the_overall_deadline():
+    start = time.monotonic()
+    call = FlakyCall([])
+    policy(timeout=5, deadline=60).run(call)
+    assert start + 5 <= call.deadlines[0] <= time.monotonic() + 5
+
+    call = FlakyCall([])
+    policy(timeout=60, deadline=5).run(call)
+    assert call.deadlines[0] <= time.monotonic() + 5
+
+
+def test_async_calls_follow_the_same_policy():
+    calls = FlakyCall([TimeoutError()])
+
+    async def call(deadline):
+        return calls(deadline)
+
+    assert asyncio.run(policy().arun(call)) == "ok"
+    assert len(calls.deadlines) == 2
+
+
+def test_role_defaults_sit_between_the_default_entry_and_the_role_entry(
+    monkeypatch,
+):
+    monkeypatch.setattr(
+        llm_policy,
+        "_policies",
+        {"default": {"timeout": 60, "max_attempts": 2}, "conclude": {"timeout": 400}},
+    )
+    light = get_call_policy("light")
+    assert (light.timeout, light.max_attempts, light.deadline) == (60, 2, 600)
+    writer = get_call_policy("writer")
+    assert (writer.timeout, writer.max_attempts, writer.deadline) == (300, 2, 900)
+    conclude = get_call_policy("conclude")
+    assert (conclude.timeout, conclude.deadline) == (400, 900)
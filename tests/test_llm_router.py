@@ -0,0 +1,78 @@
+import pytest
+
+pytest.importorskip("omegaconf")
+pytest.importorskip("httpx")
+pytest.importorskip("litellm")
+pytest.importorskip("langchain_community.chat_models")
+
+import Utils.llm_router as llm_router
+from Utils.llm_router import LLMRouter
+
+
+class FakeModels(object):
+    """Stands in for `invoke_chat_model`: each model answers with its name or
+    raises the errors queued for it."""
+
+    def __init__(self, errors=None):
+        self.errors = {name: list(items) for name, items in (errors or {}).items()}
+        self.calls = []
+
+    def __call__(self, model_name, prompt, tool, tool_choice, deadline, on_start):
+        self.calls.append(model_name)
+        on_start()
+        if self.errors.get(model_name):
+            raise self.errors[model_name].pop(0)
+        return f"answer from {model_name}"
+
+
+@pytest.fixture
+def models(monkeypatch):
+    def install(errors=None):
+        fake = FakeModels(errors)
+        monkeypatch.setattr(llm_router, "invoke_chat_model", fake)
+        return fake
+
+    return install
+
+
+def test_the_backup_answers_when_the_primary_fails(models):
+    fake = models({"primary": [TimeoutError()]})
+    router = LLMRouter()
+    assert router.call("primary", "backup", ["hi"]) == (
+        "backup",
+        "answer from backup",
+    )
+    assert router.call("primary", "backup", ["hi"]) == (
+        "primary",
+        "answer from primary",
+    )
+    assert fake.calls == ["primary", "backup", "primary"]
+
+
+def test_the_circuit_opens_after_consecutive_transient_failures(models):
+    fake = models({"primary": [TimeoutError(), TimeoutError()]})
+    router = LLMRouter(breaker={"failure_threshold": 2, "recovery_time": 60})
+    router.call("primary", "backup", ["hi"])
+    router.call("primary", "backup", ["hi"])
+    assert router.stats()["models"]["primary"]["state"] == "open"
+
+    fake.calls.clear()
+    assert router.call("primary", "backup", ["hi"])[0] == "backup"
+    assert fake.calls == ["backup"]
+
+
+def test_bad_requests_do_not_open_the_circuit(models):
+    models({"primary": [ValueError("bad request")] * 3})
+    router = LLMRouter(breaker={"failure_threshold": 2})
+    for _ in range(3):
+        assert router.call("primary", "backup", ["hi"])[0] == "backup"
+    assert router.stats()["models"]["primary"]["state"] == "closed"
+
+
+def test_a_probe_after_recovery_time_closes_the_circuit(models):
+    models({"primary": [TimeoutError()]})
+    router = LLMRouter(breaker={"failure_threshold": 1, "recovery_time": 0})
+    router.call("primary", "backup", ["hi"])
+    assert router.stats()["models"]["primary"]["state"] == "open"
+    assert router.call("primary", "backup", ["hi"])[0] == "primary"
+    assert router.stats()["models"]["primary"]["state"] == "closed"
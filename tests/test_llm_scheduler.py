@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("omegaconf")
+
+from Utils.llm_scheduler import LLMScheduler, ModelLimiter, remaining_time
+
+
+def test_unconfigured_models_are_not_limited():
+    scheduler = LLMScheduler()
+    with scheduler.slot("model", ["hello"]):
+        with scheduler.slot("model", ["hello"]):
+            assert scheduler.stats()["model"]["active"] == 2
+    assert scheduler.stats()["model"]["active"] == 0
+
+
+def test_concurrency_cap_queues_until_a_slot_is_released():
+    scheduler = LLMScheduler({"default": {"max_concurrency": 1}})
+    order = []
+
+    def second_call():
+        with scheduler.slot("model", ["hi"]):
+            order.append("second")
+
+    with scheduler.slot("model", ["hi"]):
+        waiter = threading.Thread(target=second_call)
+        waiter.start()
+        time.sleep(0.05)
+        assert scheduler.stats()["model"]["queued"] == 1
+        order.append("first")
+    waiter.join(timeout=5)
+    assert order == ["first", "second"]
+    assert scheduler.stats()["model"]["completed"] == 2
+
+
+def test_a_waiter_gives_up_at_its_deadline():
+    scheduler = LLMScheduler({"model": {"max_concurrency": 1}})
+    with scheduler.slot("model", ["hi"]):
+        with pytest.raises(TimeoutError):
+            with scheduler.slot("model", ["hi"], deadline=time.monotonic() + 0.05):
+                pass
+    assert scheduler.stats()["model"]["queued"] == 0
+    with pytest.raises(TimeoutError):
+        remaining_time(time.monotonic() - 1)
+    assert remaining_time(None) is None
+
+
+def test_request_bucket_spaces_out_calls():
+    limiter = ModelLimiter("model", rpm=60)
+    for _ in range(60):
+        assert limiter.try_acquire(1) == 0
+        limiter.release(1)
+    assert 0 < limiter.try_acquire(1) <= 1.0
+
+
+def test_token_bucket_is_charged_for_the_reported_usage():
+    limiter = ModelLimiter("model", tpm=600)
+    assert limiter.try_acquire(100) == 0
+    limiter.release(100, used_tokens=550)
+    assert limiter.try_acquire(100) > 0
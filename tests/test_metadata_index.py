@@ -0,0 +1,66 @@
+import os
+
+from Utils.metadata_index import MetadataIndex, parse_date_key
+
+
+def test_source_filter_matches_equivalent_paths(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    index = MetadataIndex()
+    index.add(
+        ["a-0", "b-0"],
+        [{"source": "corpus/reports"}, {"source": str(tmp_path / "corpus" / "news")}],
+    )
+
+    for source in (
+        str(tmp_path / "corpus" / "reports"),
+        "corpus/reports/",
+        "./corpus/../corpus/reports",
+    ):
+        assert index.select({"sources": [source]}) == ["a-0"]
+    assert index.select({"sources": [os.path.join("corpus", "news", "")]}) == ["b-0"]
+    assert index.chroma_where({"sources": ["./corpus/reports"]}) == {
+        "source": {"$in": ["corpus/reports"]}
+    }
+
+
+def make_index():
+    index = MetadataIndex()
+    index.add(
+        ["a", "b", "c", "d"],
+        [
+            {"date_key": 20240105, "source": "/corpus/x", "target": "Apple Inc."},
+            {"date_key": 20240301, "source": "/corpus/x", "target": "Tesla"},
+            {"date_key": 20240615, "source": "/corpus/y", "target": "apple"},
+            {"date_key": 0, "source": "/corpus/y", "target": "None"},
+        ],
+    )
+    return index
+
+
+def test_parse_date_key_accepts_common_formats():
+    assert parse_date_key("2024-03-05") == 20240305
+    assert parse_date_key("2024/3/5") == 20240305
+    assert parse_date_key("2024年3月5日") == 20240305
+    assert parse_date_key("20240305") == 20240305
+    assert parse_date_key("2024年3月") == 20240301
+    assert parse_date_key("2024-13-01") == 0
+    assert parse_date_key(None) == 0
+
+
+def test_filters_combine_and_drop_undated_chunks_from_date_bounds():
+    index = make_index()
+    assert index.select({}) is None
+    assert index.select({"date_from": "2024-03-01"}) == ["b", "c"]
+    assert index.select({"date_to": "2024年3月"}) == ["a", "b"]
+    assert index.select({"targets": ["APPLE"]}) == ["a", "c"]
+    assert index.select({"targets": ["apple"], "sources": ["/corpus/y"]}) == ["c"]
+    assert index.select({"targets": ["nobody"]}) == []
+
+
+def test_removed_and_replaced_chunks_leave_the_filter():
+    index = make_index()
+    index.remove(["a"])
+    index.add(["c"], [{"date_key": 20230101, "source": "/corpus/x", "target": "x"}])
+    assert len(index) == 3
+    assert index.select({"sources": ["/corpus/x"]}) == ["b", "c"]
+    assert index.select({"targets": ["apple"]}) == []
@@ -0,0 +1,42 @@
+import pytest
+
+documents_module = pytest.importorskip("langchain_core.documents")
+
+from Utils.retrieval_cache import RetrievalCache
+
+
+def doc(text):
+    return documents_module.Document(text, metadata={"doc_id": text})
+
+
+def test_hits_ignore_whitespace_and_return_copies():
+    cache = RetrievalCache()
+    cache.set_version("v1")
+    cache.put_many(["apple  pie"], 3, None, [[doc("a")]])
+
+    first, missing = cache.get_many([" apple pie ", "banana"], 3)
+    assert [hit.page_content for hit in first] == ["a"]
+    assert missing is None
+    assert cache.get_many(["apple pie"], 4) == [None]
+    assert cache.get_many(["apple pie"], 3, {"sources": ["x"]}) == [None]
+
+    first[0].metadata["doc_id"] = "changed"
+    assert cache.get_many(["apple pie"], 3)[0][0].metadata["doc_id"] == "a"
+    assert cache.stats()["hits"] == 2
+
+
+def test_a_new_index_version_invalidates_memory_and_disk(tmp_path):
+    path = str(tmp_path / "retrieval.sqlite")
+    cache = RetrievalCache(path=path)
+    cache.set_version("v1")
+    cache.put_many(["q"], 3, None, [[doc("old")]])
+
+    restarted = RetrievalCache(path=path)
+    restarted.set_version("v1")
+    assert restarted.get_many(["q"], 3)[0][0].page_content == "old"
+
+    restarted.set_version("v2")
+    assert len(restarted) == 0
+    assert restarted.get_many(["q"], 3) == [None]
+    restarted.set_version("v1")
+    assert restarted.get_many(["q"], 3) == [None]
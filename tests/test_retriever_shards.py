@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("langchain_community")
+omegaconf = pytest.importorskip("omegaconf")
+embeddings_module = pytest.importorskip("langchain_core.embeddings")
+
+from retriever import build_hybrid_retriever
+from Utils.embedding_cache import register_embeddings
+
+MODEL_NAME = "test-hash-embedding"
+
+
+class HashEmbeddings(embeddings_module.Embeddings):
+    """Deterministic bag-of-words embedder, so no model is downloaded."""
+
+    def embed(self, text):
+        vector = np.zeros(64, dtype=np.float32)
+        for token in text.split():
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            vector[digest[0] % 64] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed(text)
+
+
+register_embeddings(MODEL_NAME, HashEmbeddings(), backend="torch")
+
+PARAGRAPHS = {
+    "alpha-20240101.json": ["apple banana cherry " * 5, "alpha unique words here " * 5],
+    "beta-20240201.json": ["delta echo foxtrot " * 5, "golf hotel india " * 5],
+}
+
+
+def write_corpus(directory):
+    os.makedirs(directory, exist_ok=True)
+    for name, paragraphs in PARAGRAPHS.items():
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            json.dump({"full_content": "\n\n".join(paragraphs)}, f)
+
+
+def make_config(tmp_path, directories):
+    return omegaconf.OmegaConf.create(
+        {
+            "raw_file_path": [str(directory) for directory in directories],
+            "split_chunk_size": 120,
+            "split_chunk_overlap": 0,
+            "embedding_model": MODEL_NAME,
+            "embedding_backend": "torch",
+            "embedding_cache_path": str(tmp_path / "embeddings.sqlite"),
+            "index_path": str(tmp_path / "index"),
+            "vector_backend": "memmap",
+            "bm25_tokenizer": "whitespace",
+            "token_cache_path": "",
+            "retrieval_cache_size": 0,
+            "top_k": 2,
+            "hybrid_weight": [0.5, 0.5],
+        }
+    )
+
+
+def test_retrieved_hits_expand_through_the_shared_store(tmp_path):
+    corpus = tmp_path / "corpus"
+    write_corpus(corpus)
+    retriever, document_store, _ = build_hybrid_retriever(
+        make_config(tmp_path, [corpus])
+    )
+
+    hits = retriever.batch_get_relevant_documents(["alpha unique words"])[0]
+    assert hits
+    hit = hits[0]
+    expanded = document_store.expand(
+        hit.metadata["doc_id"], hit.metadata["start"], hit.metadata["end"], 5000, 2500
+    )
+    assert expanded is not None
+    assert hit.page_content in expanded
+    assert "apple banana cherry" in expanded
+
+
+def shard_state(states):
+    (state,) = states.values()
+    return state
+
+
+def manifest_files(state):
+    with open(os.path.join(state.index.index_path, "manifest.json")) as f:
+        return set(json.load(f)["files"])
+
+
+def test_cold_start_leaves_a_served_generation_untouched(tmp_path):
+    corpus = tmp_path / "corpus"
+    write_corpus(corpus)
+    config = make_config(tmp_path, [corpus])
+    first = shard_state(build_hybrid_retriever(config)[2])
+    assert shard_state(build_hybrid_retriever(config)[2]).generation == first.generation
+
+    # Another live process serves the first generation.
+    shard_dir = os.path.dirname(first.index.index_path)
+    os.makedirs(os.path.join(shard_dir, "leases"), exist_ok=True)
+    with open(os.path.join(shard_dir, "leases", str(os.getppid())), "w") as f:
+        json.dump([first.generation], f)
+    with open(corpus / "gamma-20240301.json", "w", encoding="utf-8") as f:
+        json.dump({"full_content": "juliet kilo lima " * 5}, f)
+
+    second = shard_state(build_hybrid_retriever(config)[2])
+    assert second.generation != first.generation
+    assert len(manifest_files(second)) == 3
+    assert len(manifest_files(first)) == 2
+
+
+def test_reload_syncs_changes_into_a_new_generation(tmp_path):
+    corpus = tmp_path / "corpus"
+    write_corpus(corpus)
+    config = make_config(tmp_path, [corpus])
+    _, _, states = build_hybrid_retriever(config)
+    unchanged = build_hybrid_retriever(config, previous=states)[2]
+    assert shard_state(unchanged) is shard_state(states)
+
+    os.remove(corpus / "beta-20240201.json")
+    with open(corpus / "gamma-20240301.json", "w", encoding="utf-8") as f:
+        json.dump({"full_content": "juliet kilo lima " * 5}, f)
+    retriever, document_store, reloaded = build_hybrid_retriever(
+        config, previous=states
+    )
+    assert shard_state(reloaded).generation != shard_state(states).generation
+    hit = retriever.batch_get_relevant_documents(["juliet kilo lima"])[0][0]
+    assert "juliet" in hit.page_content
+    assert document_store.expand(
+        hit.metadata["doc_id"], hit.metadata["start"], hit.metadata["end"]
+    )
+    texts = [doc.page_content for doc in retriever.search(["delta echo foxtrot"])[0]]
+    assert not any("delta" in text for text in texts)
+
+
+def test_old_generation_serves_until_the_next_reload_prunes_it(tmp_path):
+    corpus = tmp_path / "corpus"
+    write_corpus(corpus)
+    config = make_config(tmp_path, [corpus])
+    old_retriever, _, states = build_hybrid_retriever(config)
+    first = shard_state(states)
+
+    os.remove(corpus / "beta-20240201.json")
+    _, _, reloaded = build_hybrid_retriever(config, previous=states)
+    texts = [doc.page_content for doc in old_retriever.search(["golf hotel"])[0]]
+    assert any("golf" in text for text in texts)
+
+    with open(corpus / "gamma-20240301.json", "w", encoding="utf-8") as f:
+        json.dump({"full_content": "juliet kilo lima " * 5}, f)
+    build_hybrid_retriever(config, previous=reloaded)
+    assert not os.path.exists(first.index.index_path)
+    assert os.path.exists(shard_state(reloaded).index.index_path)
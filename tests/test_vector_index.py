@@ -0,0 +1,115 @@
+import json
+
+import numpy as np
+import pytest
+
+embeddings_module = pytest.importorskip("langchain_core.embeddings")
+pytest.importorskip("langchain_core.vectorstores")
+
+from Utils.vector_index import MemmapVectorStore, normalize
+
+
+class UnusedEmbeddings(embeddings_module.Embeddings):
+    def embed_documents(self, texts):
+        raise AssertionError("vectors are passed in directly")
+
+    def embed_query(self, text):
+        raise AssertionError("vectors are passed in directly")
+
+
+def random_vectors(count, dim=16, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+
+
+def add(store, start, vectors):
+    ids = [f"doc-{start + idx}" for idx in range(len(vectors))]
+    store.add_vectors(
+        ids, normalize(vectors), [f"text {doc_id}" for doc_id in ids], [{} for _ in ids]
+    )
+    return ids
+
+
+def test_ivf_is_retrained_as_the_collection_grows(tmp_path):
+    store = MemmapVectorStore(str(tmp_path), UnusedEmbeddings(), nlist=2, nprobe=1)
+    add(store, 0, random_vectors(77))
+    assert store.centroids is None
+
+    add(store, 77, random_vectors(1, seed=1))
+    assert store.trained_rows == 78
+
+    add(store, 78, random_vectors(50, seed=2))
+    assert store.trained_rows == 78
+    add(store, 128, random_vectors(50, seed=3))
+    assert store.trained_rows == 178
+
+    assert not store.maybe_train_ivf(1.25)
+    add(store, 178, random_vectors(50, seed=4))
+    assert store.maybe_train_ivf(1.25)
+    assert store.trained_rows == 228
+
+    with open(tmp_path / "meta.json", "r", encoding="utf-8") as f:
+        assert json.load(f)["trained_rows"] == 228
+    reopened = MemmapVectorStore(str(tmp_path), UnusedEmbeddings(), nlist=2)
+    assert reopened.trained_rows == 228
+    assert not reopened.maybe_train_ivf(1.25)
+
+
+def test_get_skips_documents_unless_included(tmp_path):
+    store = MemmapVectorStore(str(tmp_path), UnusedEmbeddings())
+    ids = add(store, 0, random_vectors(3))
+
+    stored = store.get(include=["metadatas"])
+    assert stored["ids"] == ids
+    assert stored["documents"] is None
+    assert stored["metadatas"] == [{}, {}, {}]
+    assert store.get(ids=[ids[1]])["documents"] == [f"text {ids[1]}"]
+
+
+def exact_top(vectors, queries, k):
+    scores = normalize(queries) @ normalize(vectors).T
+    return [list(np.argsort(-row, kind="stable")[:k]) for row in scores]
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_search_matches_brute_force(tmp_path, dtype):
+    vectors = random_vectors(200)
+    queries = random_vectors(5, seed=9)
+    store = MemmapVectorStore(str(tmp_path), UnusedEmbeddings(), dtype=dtype)
+    ids = add(store, 0, vectors)
+
+    hits = store.batch_search_ids(queries, k=5)
+    for found, truth in zip(hits, exact_top(vectors, queries, 5)):
+        assert [doc_id for doc_id, _ in found][:3] == [ids[row] for row in truth][:3]
+        scores = [score for _, score in found]
+        assert scores == sorted(scores, reverse=True)
+
+
+def test_ivf_probing_every_list_is_exact(tmp_path):
+    vectors = random_vectors(400)
+    queries = random_vectors(5, seed=9)
+    store = MemmapVectorStore(str(tmp_path), UnusedEmbeddings(), nlist=4, nprobe=4)
+    ids = add(store, 0, vectors)
+    assert store.centroids is not None
+
+    hits = store.batch_search_ids(queries, k=5)
+    for found, truth in zip(hits, exact_top(vectors, queries, 5)):
+        assert [doc_id for doc_id, _ in found] == [ids[row] for row in truth]
+
+
+def test_deleted_rows_stay_out_of_results_after_compaction(tmp_path):
+    vectors = random_vectors(1500)
+    store = MemmapVectorStore(str(tmp_path), UnusedEmbeddings())
+    ids = add(store, 0, vectors)
+    store.delete(ids[:1100])
+    assert store.count == 400
+
+    query = vectors[1200:1201]
+    (found,) = store.batch_search_ids(query, k=3)
+    assert found[0][0] == ids[1200]
+    assert all(doc_id in ids[1100:] for doc_id, _ in found)
+    (filtered,) = store.batch_search_ids(query, k=3, ids=ids[1300:1302])
+    assert sorted(doc_id for doc_id, _ in filtered) == ids[1300:1302]
+
+    reopened = MemmapVectorStore(str(tmp_path), UnusedEmbeddings())
+    assert reopened.batch_search_ids(query, k=1)[0][0][0] == ids[1200]
+    assert reopened.get(ids=[ids[1200]])["documents"] == [f"text {ids[1200]}"]